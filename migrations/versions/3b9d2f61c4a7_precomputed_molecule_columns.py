@@ -0,0 +1,36 @@
+"""precomputed molecule columns: canonical smiles, fingerprint and binary molecule
+
+Revision ID: 3b9d2f61c4a7
+Revises: 0340ea62a505
+Create Date: 2026-10-19 10:12:41.118233
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3b9d2f61c4a7"
+down_revision: Union[str, None] = "0340ea62a505"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # nullable, existing rows do not have these values until they are written again
+    op.add_column(
+        "molecules", sa.Column("canonical_smiles", sa.String(), nullable=True)
+    )
+    op.add_column(
+        "molecules", sa.Column("fingerprint", sa.LargeBinary(), nullable=True)
+    )
+    op.add_column("molecules", sa.Column("mol_pickle", sa.LargeBinary(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("molecules", "mol_pickle")
+    op.drop_column("molecules", "fingerprint")
+    op.drop_column("molecules", "canonical_smiles")
@@ -0,0 +1,32 @@
+"""replace mass index with (mass, molecule_id) index for keyset pagination
+
+Revision ID: 8c1e4a7d2f90
+Revises: 3b9d2f61c4a7
+Create Date: 2026-10-19 13:05:22.401877
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8c1e4a7d2f90"
+down_revision: Union[str, None] = "3b9d2f61c4a7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # pages ordered by mass are fetched with WHERE (mass, molecule_id) > (:mass, :id),
+    # this index serves both the row comparison and the ORDER BY mass, molecule_id
+    op.execute(
+        "CREATE INDEX molecules_mass_molecule_id_idx ON molecules (mass, molecule_id);"
+    )
+    op.execute("DROP INDEX molecules_mass_idx;")
+
+
+def downgrade() -> None:
+    op.execute("CREATE INDEX molecules_mass_idx ON molecules (mass);")
+    op.execute("DROP INDEX molecules_mass_molecule_id_idx;")
@@ -0,0 +1,51 @@
+"""molecule descriptors: logp, tpsa, h-bond donors and acceptors, rotatable bonds, rings, lipinski violations
+
+Revision ID: d47a9c3e1b52
+Revises: 8c1e4a7d2f90
+Create Date: 2026-10-19 15:41:09.537110
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d47a9c3e1b52"
+down_revision: Union[str, None] = "8c1e4a7d2f90"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+RANGE_FILTERED_COLUMNS = {
+    "logp": sa.Float(),
+    "tpsa": sa.Float(),
+    "hbd": sa.Integer(),
+    "hba": sa.Integer(),
+    "rotatable_bonds": sa.Integer(),
+    "ring_count": sa.Integer(),
+}
+
+
+def upgrade() -> None:
+    # nullable, existing rows get the values from the backfill_descriptors celery task
+    for column, column_type in RANGE_FILTERED_COLUMNS.items():
+        op.add_column("molecules", sa.Column(column, column_type, nullable=True))
+        op.execute(f"CREATE INDEX molecules_{column}_idx ON molecules ({column});")
+    op.add_column(
+        "molecules", sa.Column("lipinski_violations", sa.Integer(), nullable=True)
+    )
+    # ruleOfFive=true pages are ordered by molecule_id, partial index serves them without touching other rows
+    op.execute(
+        "CREATE INDEX molecules_rule_of_five_idx ON molecules (molecule_id) "
+        "WHERE lipinski_violations <= 1;"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX molecules_rule_of_five_idx;")
+    op.drop_column("molecules", "lipinski_violations")
+    for column in reversed(list(RANGE_FILTERED_COLUMNS)):
+        op.execute(f"DROP INDEX molecules_{column}_idx;")
+        op.drop_column("molecules", column)
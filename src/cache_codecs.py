@@ -0,0 +1,118 @@
+"""
+Encodings of the values stored in redis by RedisCacheServiceSingleton.
+
+Every stored value starts with one byte naming the codec it was encoded with, so the codec of an entry
+can be chosen per entry, and entries written with another codec, or before codecs existed, are still
+recognised. Unknown first byte is an UnknownCodecError, the caller treats such entry as a miss.
+
+Structured values, like cached totals, are packed with msgpack first, the packed bytes go through the same codecs.
+"""
+
+import threading
+from abc import ABC, abstractmethod
+from typing import Any
+
+import msgpack
+import zstandard
+
+
+class UnknownCodecError(ValueError):
+    pass
+
+
+class CacheCodec(ABC):
+    """
+    Base class of the codecs, encode and decode work on the payload without the codec byte
+    """
+
+    tag: bytes
+
+    @abstractmethod
+    def encode(self, data: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def decode(self, data: bytes) -> bytes:
+        pass
+
+
+class RawCodec(CacheCodec):
+    tag = b"r"
+
+    def encode(self, data: bytes) -> bytes:
+        return data
+
+    def decode(self, data: bytes) -> bytes:
+        return data
+
+
+class ZstdCodec(CacheCodec):
+    """
+    Compressors are not thread safe, sync endpoints run in the threadpool, so every thread gets its own
+    """
+
+    tag = b"z"
+
+    def __init__(self, level: int = 3):
+        self._level = level
+        self._local = threading.local()
+
+    def encode(self, data: bytes) -> bytes:
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(level=self._level)
+        return self._local.compressor.compress(data)
+
+    def decode(self, data: bytes) -> bytes:
+        if not hasattr(self._local, "decompressor"):
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local.decompressor.decompress(data)
+
+
+CODECS: dict[bytes, CacheCodec] = {
+    codec.tag: codec for codec in (RawCodec(), ZstdCodec())
+}
+
+
+class SizeTieredCodec:
+    """
+    Small entries are stored raw, compression saves few bytes there and costs a call on every hit.
+    Larger entries are compressed with zstd, JSON pages of molecules with repeated keys and links
+    compress more than 5 times, see src/molecules/tests/benchmarks/cache_codecs.py.
+    If compression does not make the entry smaller, it is stored raw.
+    """
+
+    DEFAULT_MIN_COMPRESSED_SIZE = 1024
+
+    def __init__(
+        self,
+        min_compressed_size: int = DEFAULT_MIN_COMPRESSED_SIZE,
+        compressed: CacheCodec = CODECS[ZstdCodec.tag],
+    ):
+        self._min_compressed_size = min_compressed_size
+        self._compressed = compressed
+        self._raw = CODECS[RawCodec.tag]
+
+    def encode(self, data: bytes) -> bytes:
+        if len(data) >= self._min_compressed_size:
+            encoded = self._compressed.encode(data)
+            if len(encoded) < len(data):
+                return self._compressed.tag + encoded
+        return self._raw.tag + data
+
+    @staticmethod
+    def decode(data: bytes) -> bytes:
+        """
+        :raises UnknownCodecError: if the entry was not written by any of CODECS
+        """
+        codec = CODECS.get(data[:1])
+        if codec is None:
+            raise UnknownCodecError(data[:1])
+        return codec.decode(data[1:])
+
+
+def pack(value: Any) -> bytes:
+    return msgpack.packb(value)
+
+
+def unpack(data: bytes) -> Any:
+    return msgpack.unpackb(data)
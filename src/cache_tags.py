@@ -0,0 +1,69 @@
+"""
+Tags of the cached responses, and their invalidation after writes.
+
+Every cached response is tagged with what it depends on, a single entity like "molecule:5",
+or a whole collection like "molecules" for the lists and searches. Services invalidate the tags
+after committing a write, every cached response with any of those tags is deleted from redis,
+which is shared by all the web nodes, so no node serves the stale response.
+"""
+
+import logging
+
+from redis import RedisError
+
+from src.caching_service import RedisCacheServiceSingleton
+
+logger = logging.getLogger(__name__)
+
+MOLECULES_TAG = "molecules"
+DRUGS_TAG = "drugs"
+
+# first path segment -> collection tag, the entity tag is "<collection tag without s>:<id>"
+_COLLECTION_TAGS = {"molecules": MOLECULES_TAG, "drugs": DRUGS_TAG}
+
+
+def molecule_tag(molecule_id: int) -> str:
+    return f"molecule:{molecule_id}"
+
+
+def drug_tag(drug_id: int) -> str:
+    return f"drug:{drug_id}"
+
+
+def tags_for_path(path: str) -> list[str]:
+    """
+    /molecules/5 depends on the molecule 5 only, any other path under /molecules, lists and searches,
+    depends on the whole collection, same for drugs.
+
+    :return: tags of the response of the path, empty if the path is not under a tagged collection
+    """
+    segments = [segment for segment in path.split("/") if segment]
+    if not segments or segments[0] not in _COLLECTION_TAGS:
+        return []
+
+    if len(segments) == 2 and segments[1].isdigit():
+        entity = molecule_tag if segments[0] == "molecules" else drug_tag
+        return [entity(int(segments[1]))]
+    return [_COLLECTION_TAGS[segments[0]]]
+
+
+def invalidate_cache_tags(*tags: str) -> None:
+    """
+    Delete every cached response tagged with any of the tags, called after the write is committed.
+
+    Redis errors are logged and swallowed, the write itself already succeeded.
+    """
+    try:
+        RedisCacheServiceSingleton.get_instance().invalidate_tags(tags)
+    except RedisError as e:
+        logger.error(f"Could not invalidate cache tags {tags}: {e}")
+
+
+async def invalidate_cache_tags_async(*tags: str) -> None:
+    """
+    Same as invalidate_cache_tags, for the async services, the event loop does not wait for redis
+    """
+    try:
+        await RedisCacheServiceSingleton.get_instance().aio.invalidate_tags(tags)
+    except RedisError as e:
+        logger.error(f"Could not invalidate cache tags {tags}: {e}")
@@ -1,22 +1,142 @@
+import json
 import logging
+import time
+import uuid
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
 
 import redis
+import redis.asyncio
 
-from src.redis_client import get_redis_client
+from src.cache_codecs import SizeTieredCodec, UnknownCodecError, pack, unpack
+from src.local_cache import LocalLRUCache
+from src.redis_client import get_async_redis_client, get_redis_client
 
 logger = logging.getLogger(__name__)
 
+# deletes the lock only if it is still held by the caller, it might have expired and been taken by another node
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# invalidated keys are deleted and published in batches of this size, a collection tag can have many members
+INVALIDATION_BATCH_SIZE = 1000
+
+
+# keys and decoding are shared by RedisCacheServiceSingleton and AsyncRedisCacheService, both read each other's writes
+
+
+def _lock_key(key) -> str:
+    return f"lock:{key}"
+
+
+def _tag_key(tag) -> str:
+    """
+    Sorted set of the keys tagged with the tag, scored by the expiration time of their entries
+    """
+    return f"tag-members:{tag}"
+
+
+def _tag_version_key(tag) -> str:
+    return f"tag-version:{tag}"
+
+
+def _decode(codec: SizeTieredCodec, stored: Optional[bytes]) -> Optional[bytes]:
+    """
+    :return: decoded value, None if nothing is stored or it was written in an unknown format
+    """
+    if stored is None:
+        return None
+    try:
+        return codec.decode(stored)
+    except UnknownCodecError:
+        logger.warning("Cache entry in an unknown format, ignored")
+        return None
+
+
+def _batches(keys: Iterable) -> Iterator[list]:
+    keys = iter(keys)
+    while batch := list(islice(keys, INVALIDATION_BATCH_SIZE)):
+        yield batch
+
+
+def _add_to_tags(pipeline, key, tags, expiration_seconds: int) -> None:
+    """
+    Add the key to the set of every tag. Members of the expired entries are removed on every write,
+    so a set holds the live entries only, and it lives as long as its longest living member.
+    """
+    now = time.time()
+    for tag in tags:
+        pipeline.zadd(_tag_key(tag), {key: now + expiration_seconds})
+        pipeline.zremrangebyscore(_tag_key(tag), "-inf", now)
+        # a set without TTL never gets one with GT, it is set with NX first
+        pipeline.expire(_tag_key(tag), expiration_seconds, nx=True)
+        pipeline.expire(_tag_key(tag), expiration_seconds, gt=True)
+
+
+def _read_tag_members(pipeline, tags) -> None:
+    """
+    Queue reading the keys of the live entries of every tag, the results are lists of keys
+    """
+    now = time.time()
+    for tag in tags:
+        pipeline.zrangebyscore(_tag_key(tag), now, "+inf")
+
+
+def _delete_tagged(pipeline, keys: list[str], tags) -> None:
+    """
+    Queue deleting the keys and the sets of the tags, and incrementing the versions of the tags.
+    Deleted keys are published in batches, every node evicts them from its local tier.
+
+    Versions are incremented last, a key tagged after its tag was read is caught by the version check.
+    """
+    for batch in _batches(keys):
+        pipeline.delete(*batch)
+        pipeline.publish(
+            RedisCacheServiceSingleton.INVALIDATION_CHANNEL, json.dumps(batch)
+        )
+    for tag in tags:
+        pipeline.delete(_tag_key(tag))
+        pipeline.incr(_tag_version_key(tag))
+
 
 class RedisCacheServiceSingleton:
     CACHE_EXPIRATION = 60 * 60 * 24 * 7  # 1 week
+    # keys deleted from redis are published here, every node evicts them from its local tier
+    INVALIDATION_CHANNEL = "cache-invalidation"
+    # seconds the invalidation listener waits before it reconnects to redis
+    LISTENER_RETRY_SECONDS = 1
 
     __INSTANCE = None
 
-    def __init__(self, redis_client: redis.Redis):
+    def __init__(
+        self,
+        redis_client: redis.Redis,
+        local_cache: LocalLRUCache = None,
+        codec: SizeTieredCodec = None,
+        async_redis_client_factory: Callable[[], redis.asyncio.Redis] = None,
+    ):
         """
         Be careful when using this class, it is a singleton, so it is shared between all the instances of the app
 
+        Methods of this class block, they are used by the sync services in the threadpool and by celery tasks.
+        Code running in the event loop uses the async twin, see aio, so it never waits for redis synchronously.
+
+        Values are encoded by the codec before they are stored, large ones are compressed, see src/cache_codecs.py,
+        a plain redis server is enough, no modules are needed.
+
+        Raw bytes, the cached responses, are also kept in the in-process local_cache for a few seconds,
+        hot keys are served without a round trip to redis. Other nodes are told to evict invalidated keys
+        through redis pub/sub, see start_invalidation_listener.
+
         :param redis_client:  a redis client instance
+        :param local_cache: in-process tier, a new one with the default limits if None
+        :param codec: encoding of the stored values, SizeTieredCodec with the default limits if None
+        :param async_redis_client_factory: returns the asyncio client of the running event loop,
+            get_async_redis_client if None
         :raises ValueError: if the instance already exists
         """
         if self.__INSTANCE is not None:
@@ -25,13 +145,30 @@ class RedisCacheServiceSingleton:
                 "or create to override it."
             )
         self.redis_client = redis_client
+        self.local_cache = local_cache or LocalLRUCache()
+        self.codec = codec or SizeTieredCodec()
+        self._async_redis_client_factory = (
+            async_redis_client_factory or get_async_redis_client
+        )
+        self._aio = None
+        self._listener = None
 
     @classmethod
-    def create(cls, redis_client: redis.Redis) -> "RedisCacheServiceSingleton":
+    def create(
+        cls,
+        redis_client: redis.Redis,
+        local_cache: LocalLRUCache = None,
+        codec: SizeTieredCodec = None,
+        async_redis_client_factory: Callable[[], redis.asyncio.Redis] = None,
+    ) -> "RedisCacheServiceSingleton":
         """
         Overwrites the current instance
         """
-        cls.__INSTANCE = cls(redis_client)
+        if cls.__INSTANCE is not None:
+            cls.__INSTANCE.stop_invalidation_listener()
+        cls.__INSTANCE = cls(
+            redis_client, local_cache, codec, async_redis_client_factory
+        )
         return cls.__INSTANCE
 
     @classmethod
@@ -46,20 +183,286 @@ class RedisCacheServiceSingleton:
             cls.create(get_redis_client())
         return cls.__INSTANCE
 
-    def set_json(
-        self, key, value: dict, expiration_seconds: int = CACHE_EXPIRATION
+    @property
+    def aio(self) -> "AsyncRedisCacheService":
+        """
+        Async twin of this service for the running event loop, it shares the local tier and the codec
+
+        :raises RuntimeError: if called outside of a running event loop
+        """
+        client = self._async_redis_client_factory()
+        if self._aio is None or self._aio.redis_client is not client:
+            self._aio = AsyncRedisCacheService(client, self)
+        return self._aio
+
+    def set_object(
+        self, key, value, expiration_seconds: int = CACHE_EXPIRATION
     ) -> None:
         """
         :param key:  the key to be used in the cache
-        :param value:  the value to be cached
+        :param value:  the value to be cached, anything msgpack can pack, dicts, lists, strings and numbers
         :param expiration_seconds:  after this, cache will be expired, defaults to CachingService.CACHE_EXPIRATION
         """
-        self.redis_client.json().set(key, ".", value)
-        self.redis_client.expire(key, expiration_seconds)
+        self.redis_client.set(
+            key, self.codec.encode(pack(value)), ex=expiration_seconds
+        )
 
-    def get_json(self, key) -> dict:
+    def get_object(self, key):
         """
         :param key:  the key to be used in the cache
         :return:  the value from the cache, if it exists, otherwise None
         """
-        return self.redis_client.json().get(key, ".")
+        value = _decode(self.codec, self.redis_client.get(key))
+        return None if value is None else unpack(value)
+
+    def get_bytes(self, key) -> Optional[bytes]:
+        """
+        Local tier first, then redis, values found in redis are kept locally for the next requests
+
+        :return: the stored bytes, None if the key does not exist
+        """
+        value = self.local_cache.get(key)
+        if value is not None:
+            return value
+
+        generation = self.local_cache.generation
+        value = _decode(self.codec, self.redis_client.get(key))
+        if value is not None:
+            self.local_cache.put(key, value, generation)
+        return value
+
+    def set_tagged_bytes(
+        self,
+        key,
+        value: bytes,
+        tags,
+        expiration_seconds: int = CACHE_EXPIRATION,
+    ) -> None:
+        """
+        Store raw bytes and add the key to the set of every tag, in one round trip.
+
+        This is not atomic, invalidation running in between does not see the key, but it increments the
+        tag versions, so the caller has to compare them with get_tag_versions after storing.
+        """
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline.set(key, self.codec.encode(value), ex=expiration_seconds)
+        _add_to_tags(pipeline, key, tags, expiration_seconds)
+        pipeline.execute()
+        self.local_cache.put(key, value)
+
+    def get_tag_versions(self, tags) -> list:
+        """
+        Versions change on every invalidation, compare them before and after computing a response
+        to find out whether it was invalidated in the meantime.
+        """
+        if not tags:
+            return []
+        return self.redis_client.mget([_tag_version_key(tag) for tag in tags])
+
+    def invalidate_tags(self, tags) -> None:
+        """
+        Delete all the keys tagged with any of the tags and increment the versions of the tags,
+        deleted keys are evicted from the local tier of every node. Members of all the tags are read
+        in one round trip, they are deleted in another one.
+        """
+        if not tags:
+            return
+        pipeline = self.redis_client.pipeline(transaction=False)
+        _read_tag_members(pipeline, tags)
+        keys = [key.decode() for key in set().union(*pipeline.execute())]
+
+        pipeline = self.redis_client.pipeline(transaction=False)
+        _delete_tagged(pipeline, keys, tags)
+        pipeline.execute()
+        self.local_cache.evict(keys)
+
+    def delete(self, key) -> None:
+        pipeline = self.redis_client.pipeline(transaction=False)
+        _delete_tagged(pipeline, [key], [])
+        pipeline.execute()
+        self.local_cache.evict([key])
+
+    def start_invalidation_listener(self) -> None:
+        """
+        Subscribe to the invalidation channel in a background thread, started once per web process.
+
+        Pub/sub delivers at most once, messages published while the listener reconnects are lost,
+        the local tier is cleared when the connection is lost, see _on_listener_error.
+
+        :raises RedisError: if redis is not reachable
+        """
+        if self._listener is not None:
+            return
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.INVALIDATION_CHANNEL: self._on_invalidation})
+        self._listener = pubsub.run_in_thread(
+            sleep_time=1, daemon=True, exception_handler=self._on_listener_error
+        )
+
+    def stop_invalidation_listener(self) -> None:
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _on_invalidation(self, message) -> None:
+        self.local_cache.evict(json.loads(message["data"]))
+
+    def _on_listener_error(self, error, pubsub, thread) -> None:
+        """
+        Without a handler the first connection error ends the listener thread for good. The thread goes on,
+        its next get_message reconnects and subscribes to the channel again, see PubSub.on_connect.
+        Invalidations published in between are lost, so the local tier is cleared.
+        """
+        logger.warning(f"Invalidation listener lost redis, reconnecting: {error}")
+        self.local_cache.clear()
+        time.sleep(self.LISTENER_RETRY_SECONDS)
+
+    def acquire_lock(self, key, timeout_seconds: float) -> Optional[str]:
+        """
+        Lock shared by all the nodes, it expires after timeout_seconds, so a crashed holder does not block others
+
+        :return: token to release the lock with, None if the lock is held by somebody else
+        """
+        token = uuid.uuid4().hex
+        acquired = self.redis_client.set(
+            _lock_key(key), token, nx=True, px=int(timeout_seconds * 1000)
+        )
+        return token if acquired else None
+
+    def release_lock(self, key, token: str) -> None:
+        self.redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, _lock_key(key), token)
+
+    def is_locked(self, key) -> bool:
+        return bool(self.redis_client.exists(_lock_key(key)))
+
+    def increment(self, key) -> int:
+        """
+        Atomically increment the integer stored at the key, missing key counts as 0
+
+        :return: the value after the increment
+        """
+        return self.redis_client.incr(key)
+
+    def get_int(self, key) -> int:
+        """
+        :return: integer stored at the key, 0 if the key does not exist
+        """
+        value = self.redis_client.get(key)
+        return int(value) if value is not None else 0
+
+
+class AsyncRedisCacheService:
+    """
+    Same methods as RedisCacheServiceSingleton, awaited on the asyncio client, used by the caching middleware
+    and the async services. Every value and its TTL are written in one command, values with tags in one pipeline.
+
+    Get it from RedisCacheServiceSingleton.get_instance().aio, it shares the local tier, the codec and the
+    invalidation channel of the singleton.
+    """
+
+    def __init__(
+        self, redis_client: redis.asyncio.Redis, cache: RedisCacheServiceSingleton
+    ):
+        self.redis_client = redis_client
+        self._cache = cache
+
+    @property
+    def local_cache(self) -> LocalLRUCache:
+        return self._cache.local_cache
+
+    @property
+    def codec(self) -> SizeTieredCodec:
+        return self._cache.codec
+
+    async def set_object(
+        self,
+        key,
+        value,
+        expiration_seconds: int = RedisCacheServiceSingleton.CACHE_EXPIRATION,
+    ) -> None:
+        await self.redis_client.set(
+            key, self.codec.encode(pack(value)), ex=expiration_seconds
+        )
+
+    async def get_object(self, key):
+        value = _decode(self.codec, await self.redis_client.get(key))
+        return None if value is None else unpack(value)
+
+    async def get_bytes(self, key) -> Optional[bytes]:
+        value = self.local_cache.get(key)
+        if value is not None:
+            return value
+
+        generation = self.local_cache.generation
+        value = _decode(self.codec, await self.redis_client.get(key))
+        if value is not None:
+            self.local_cache.put(key, value, generation)
+        return value
+
+    async def set_tagged_bytes(
+        self,
+        key,
+        value: bytes,
+        tags,
+        expiration_seconds: int = RedisCacheServiceSingleton.CACHE_EXPIRATION,
+    ) -> None:
+        async with self.redis_client.pipeline(transaction=False) as pipeline:
+            pipeline.set(key, self.codec.encode(value), ex=expiration_seconds)
+            _add_to_tags(pipeline, key, tags, expiration_seconds)
+            await pipeline.execute()
+        self.local_cache.put(key, value)
+
+    async def get_tag_versions(self, tags) -> list:
+        if not tags:
+            return []
+        return await self.redis_client.mget([_tag_version_key(tag) for tag in tags])
+
+    async def invalidate_tags(self, tags) -> None:
+        """
+        Same as RedisCacheServiceSingleton.invalidate_tags
+        """
+        if not tags:
+            return
+        async with self.redis_client.pipeline(transaction=False) as pipeline:
+            _read_tag_members(pipeline, tags)
+            members = await pipeline.execute()
+        keys = [key.decode() for key in set().union(*members)]
+
+        async with self.redis_client.pipeline(transaction=False) as pipeline:
+            _delete_tagged(pipeline, keys, tags)
+            await pipeline.execute()
+        self.local_cache.evict(keys)
+
+    async def delete(self, key) -> None:
+        async with self.redis_client.pipeline(transaction=False) as pipeline:
+            _delete_tagged(pipeline, [key], [])
+            await pipeline.execute()
+        self.local_cache.evict([key])
+
+    async def acquire_lock(self, key, timeout_seconds: float) -> Optional[str]:
+        token = uuid.uuid4().hex
+        acquired = await self.redis_client.set(
+            _lock_key(key),
+            token,
+            nx=True,
+            px=int(timeout_seconds * 1000),
+        )
+        return token if acquired else None
+
+    async def release_lock(self, key, token: str) -> None:
+        await self.redis_client.eval(
+            _RELEASE_LOCK_SCRIPT,
+            1,
+            _lock_key(key),
+            token,
+        )
+
+    async def is_locked(self, key) -> bool:
+        return bool(await self.redis_client.exists(_lock_key(key)))
+
+    async def increment(self, key) -> int:
+        return await self.redis_client.incr(key)
+
+    async def get_int(self, key) -> int:
+        value = await self.redis_client.get(key)
+        return int(value) if value is not None else 0
@@ -28,8 +28,27 @@ class Settings(BaseSettings):
     DB_PORT: int
     DB_NAME: str
 
+    # connection pool of every engine, web workers and celery children have a pool each,
+    # so max connections to postgres is (DB_POOL_SIZE + DB_MAX_OVERFLOW) * number of processes * engines
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # seconds to wait for a free connection before giving up
+    DB_POOL_TIMEOUT: int = 30
+    # connections older than this many seconds are replaced, -1 disables recycling
+    DB_POOL_RECYCLE: int = 1800
+    # test connections before using them, so connections dropped by postgres are not handed out
+    DB_POOL_PRE_PING: bool = True
+    # statement_timeout of every connection in milliseconds, 0 disables the timeout
+    DB_STATEMENT_TIMEOUT_MS: int = 0
+
     REDIS_HOST: str
     REDIS_PORT: int
+    # connection pool of the asyncio redis client, one per web process,
+    # requests wait up to REDIS_POOL_TIMEOUT seconds for a free connection when all of them are busy
+    REDIS_POOL_MAX_CONNECTIONS: int = 50
+    REDIS_POOL_TIMEOUT: float = 5
+    # seconds to wait for a redis reply, a stuck redis fails the cache call instead of hanging the request
+    REDIS_SOCKET_TIMEOUT: float = 5
 
     BROKER_HOST: str
     BROKER_PORT: int
@@ -39,6 +58,17 @@ class Settings(BaseSettings):
     BACKEND_PORT: int
     BACKEND_DB: int
 
+    # responses of the GET endpoints are cached in redis, see CachingMiddleware, false serves every request
+    # from the app, to measure it without the cache, see src/molecules/tests/benchmarks/load.py
+    RESPONSE_CACHE_ENABLED: bool = True
+
+    # the celery worker serves its metrics on this port, the web processes on GET /metrics, see src/metrics.py
+    METRICS_PORT: int = 9100
+
+    # tokens allowing to profile requests in PROD, in the X-Profile-Token header, see src/profiling.py,
+    # a JSON list in the environment, for example PROFILING_TOKENS='["secret"]'
+    PROFILING_TOKENS: list[str] = []
+
     model_config = {
         "env_file": ".env",
     }
@@ -47,6 +77,13 @@ class Settings(BaseSettings):
     def database_url(self):
         return f"postgresql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
+    @property
+    def async_database_url(self):
+        """
+        Same database, asyncpg driver, used by the async request handlers
+        """
+        return f"postgresql+asyncpg://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+
 
 class DevSettings(Settings):
     model_config = {
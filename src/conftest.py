@@ -0,0 +1,24 @@
+import pytest
+from sqlalchemy import NullPool
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.config import get_test_settings
+from src.database import get_async_database_engine
+from src.main import app
+
+
+@pytest.fixture(scope="session", autouse=True)
+def async_engine():
+    """
+    Async engine of the test database for the async endpoints of every test module.
+
+    Connections are not pooled, the schema is recreated between tests and asyncpg caches type oids
+    per connection, also every request of the TestClient runs in its own event loop, a pooled connection
+    would belong to the loop of an earlier request.
+    """
+    engine = create_async_engine(
+        get_test_settings().async_database_url, poolclass=NullPool
+    )
+    app.dependency_overrides[get_async_database_engine] = lambda: engine
+    yield engine
+    app.dependency_overrides.pop(get_async_database_engine, None)
@@ -1,9 +1,15 @@
+import time
 from datetime import datetime
 from functools import lru_cache
 from typing import Annotated
 
 from fastapi import Depends
-from sqlalchemy import func, create_engine, Engine
+from sqlalchemy import func, create_engine, Engine, event
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import (
     DeclarativeBase,
     declared_attr,
@@ -11,8 +17,11 @@ from sqlalchemy.orm import (
     Mapped,
     sessionmaker,
 )
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
-from src.config import get_settings
+from src.config import get_settings, Settings
+from src.metrics import DB_POOL_CHECKOUT_WAIT, DB_POOL_IN_USE, DB_POOL_OVERFLOW
+from src.timing import add_time
 
 created_at = Annotated[datetime, mapped_column(server_default=func.now())]
 updated_at = Annotated[
@@ -31,13 +40,100 @@ class Base(DeclarativeBase):
     updated_at: Mapped[updated_at]
 
 
+class _InstrumentedPoolMixin:
+    """
+    Publishes how long a checkout waits for a connection, that includes opening a new connection
+    when the pool is not full yet.
+    """
+
+    pool_label = None
+
+    def connect(self):
+        start_time = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(self.pool_label).observe(
+                time.perf_counter() - start_time
+            )
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pool_label = "sync"
+
+
+class InstrumentedAsyncAdaptedQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pool_label = "async"
+
+
+def instrument_pool(engine: Engine, pool_label: str) -> None:
+    """
+    Keep connections in use and overflow gauges up to date on every checkout and checkin.
+
+    Listeners are registered on the engine, so they survive engine.dispose(), which recreates the pool.
+    """
+
+    def on_checkout(*args):
+        DB_POOL_IN_USE.labels(pool_label).inc()
+        DB_POOL_OVERFLOW.labels(pool_label).set(max(engine.pool.overflow(), 0))
+
+    def on_checkin(*args):
+        DB_POOL_IN_USE.labels(pool_label).dec()
+        DB_POOL_OVERFLOW.labels(pool_label).set(max(engine.pool.overflow(), 0))
+
+    event.listen(engine, "checkout", on_checkout)
+    event.listen(engine, "checkin", on_checkin)
+
+
+# listeners on the Engine class apply to every engine, the async ones and the ones created by the tests too
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    context.statement_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _report_statement_time(conn, cursor, statement, parameters, context, executemany):
+    """
+    Statement time is the db phase of the request timings, see src.timing.
+    Rows fetched later from server-side cursors, like the exports, are not included.
+    """
+    add_time("db", time.perf_counter() - context.statement_started)
+
+
+def get_engine_options(settings: Settings) -> dict:
+    """
+    Pool options from the settings, shared by the sync and the async engine
+    """
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
 def get_database_url():
     return get_settings().database_url
 
 
 @lru_cache
 def get_database_engine(database_url: Annotated[str, Depends(get_database_url)]):
-    return create_engine(database_url)
+    settings = get_settings()
+    connect_args = {}
+    if settings.DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = (
+            f"-c statement_timeout={settings.DB_STATEMENT_TIMEOUT_MS}"
+        )
+
+    engine = create_engine(
+        database_url,
+        poolclass=InstrumentedQueuePool,
+        connect_args=connect_args,
+        **get_engine_options(settings),
+    )
+    instrument_pool(engine, InstrumentedQueuePool.pool_label)
+    return engine
 
 
 @lru_cache
@@ -45,3 +141,45 @@ def get_session_factory(
     database_engine: Annotated[Engine, Depends(get_database_engine)]
 ):
     return sessionmaker(bind=database_engine, autoflush=False, autocommit=False)
+
+
+def get_async_database_url():
+    return get_settings().async_database_url
+
+
+@lru_cache
+def get_async_database_engine(
+    async_database_url: Annotated[str, Depends(get_async_database_url)]
+):
+    """
+    Async engine is used by the async request handlers, so they do not hold a threadpool thread
+    while waiting for postgres.
+
+    Connections of the async engine belong to the event loop they were created in,
+    so the engine should be disposed when the loop is done, see lifespan in src/main.py.
+    """
+    settings = get_settings()
+    connect_args = {}
+    if settings.DB_STATEMENT_TIMEOUT_MS:
+        connect_args["server_settings"] = {
+            "statement_timeout": str(settings.DB_STATEMENT_TIMEOUT_MS)
+        }
+
+    engine = create_async_engine(
+        async_database_url,
+        poolclass=InstrumentedAsyncAdaptedQueuePool,
+        connect_args=connect_args,
+        **get_engine_options(settings),
+    )
+    instrument_pool(engine.sync_engine, InstrumentedAsyncAdaptedQueuePool.pool_label)
+    return engine
+
+
+@lru_cache
+def get_async_session_factory(
+    async_database_engine: Annotated[AsyncEngine, Depends(get_async_database_engine)]
+):
+    # objects are not expired on commit, lazy loading expired attributes is not possible in async sessions
+    return async_sessionmaker(
+        bind=async_database_engine, autoflush=False, expire_on_commit=False
+    )
@@ -1,10 +1,11 @@
 from functools import lru_cache
 
-from sqlalchemy import delete
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 
 from src.drugs.model import Drug, DrugMolecule
-from src.repository import SQLAlchemyRepository
+from src.repository import SQLAlchemyRepository, AsyncSQLAlchemyRepository
 
 import logging
 
@@ -58,6 +59,66 @@ class DrugRepository(SQLAlchemyRepository):
             return False
 
 
+class AsyncDrugRepository(AsyncSQLAlchemyRepository):
+    """
+    Async variant of DrugRepository.
+
+    Drug.molecules can not be lazy loaded in an async session, so every method that returns drugs
+    loads the molecules eagerly with selectinload.
+    """
+
+    def __init__(self):
+        super().__init__(Drug)
+
+    async def find_by_id(self, obj_id, session: AsyncSession):
+        return await session.get(Drug, obj_id, options=[selectinload(Drug.molecules)])
+
+    async def find_all(self, session: AsyncSession, page=0, page_size=1000):
+        stmt = (
+            select(Drug)
+            .options(selectinload(Drug.molecules))
+            .limit(page_size)
+            .offset(page * page_size)
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    async def save(self, data: dict, session: AsyncSession):
+        """
+        Same as DrugRepository.save, molecules of the drug are loaded before returning
+        """
+        drug = Drug(name=data["name"], description=data.get("description"))
+        session.add(drug)
+        await session.flush()
+        for molecule in data["molecules"]:
+            session.add(
+                DrugMolecule(
+                    drug_id=drug.drug_id,
+                    molecule_id=molecule["molecule_id"],
+                    quantity=molecule["quantity"],
+                    quantity_unit=molecule["quantity_unit"],
+                )
+            )
+        await session.flush()
+        await session.refresh(drug, attribute_names=["molecules"])
+
+        return drug
+
+    async def delete(self, session: AsyncSession, obj_id):
+        try:
+            await session.execute(delete(Drug).where(Drug.drug_id == obj_id))
+            await session.flush()
+            return True
+        except Exception as e:
+            logger.error(e)
+            return False
+
+
 @lru_cache
 def get_drug_repository():
     return DrugRepository()
+
+
+@lru_cache
+def get_async_drug_repository():
+    return AsyncDrugRepository()
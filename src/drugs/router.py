@@ -4,7 +4,7 @@ from fastapi import APIRouter, Depends, Path, Body
 from starlette import status
 
 from src.drugs.schema import DrugResponse, DrugRequest
-from src.drugs.service import get_drug_service, DrugService
+from src.drugs.service import get_async_drug_service, AsyncDrugService
 from src.schema import PaginationQueryParams, get_pagination_query_params
 
 router = APIRouter()
@@ -21,11 +21,11 @@ router = APIRouter()
         },
     },
 )
-def add_drug(
+async def add_drug(
     drug_request: Annotated[DrugRequest, Body(...)],
-    service: Annotated[DrugService, Depends(get_drug_service)],
+    service: Annotated[AsyncDrugService, Depends(get_async_drug_service)],
 ) -> DrugResponse:
-    return service.save(drug_request)
+    return await service.save(drug_request)
 
 
 @router.get(
@@ -36,11 +36,11 @@ def add_drug(
         status.HTTP_404_NOT_FOUND: {"model": str, "description": "No drugs found"},
     },
 )
-def get_by_id(
+async def get_by_id(
     drug_id: Annotated[int, Path(..., description="Unique identifier for the drug")],
-    service: Annotated[get_drug_service, Depends(get_drug_service)],
+    service: Annotated[AsyncDrugService, Depends(get_async_drug_service)],
 ) -> DrugResponse:
-    return service.find_by_id(drug_id)
+    return await service.find_by_id(drug_id)
 
 
 @router.get(
@@ -48,13 +48,13 @@ def get_by_id(
     status_code=200,
     responses={status.HTTP_200_OK: {"model": list[DrugResponse]}},
 )
-def get_all(
+async def get_all(
     pagination_args: Annotated[
         PaginationQueryParams, Depends(get_pagination_query_params)
     ],
-    service: Annotated[DrugService, Depends(get_drug_service)],
+    service: Annotated[AsyncDrugService, Depends(get_async_drug_service)],
 ) -> list[DrugResponse]:
-    return service.find_all(
+    return await service.find_all(
         page_size=pagination_args.page_size, page=pagination_args.page
     )
 
@@ -67,8 +67,8 @@ def get_all(
         status.HTTP_404_NOT_FOUND: {"model": str, "description": "No drugs found"},
     },
 )
-def delete(
+async def delete(
     drug_id: Annotated[int, Path(..., description="Unique identifier for the drug")],
-    service: Annotated[DrugService, Depends(get_drug_service)],
+    service: Annotated[AsyncDrugService, Depends(get_async_drug_service)],
 ) -> bool:
-    return service.delete(drug_id)
+    return await service.delete(drug_id)
@@ -2,13 +2,25 @@ from typing import Annotated
 
 from fastapi import Depends
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 
+from src.cache_tags import (
+    DRUGS_TAG,
+    drug_tag,
+    invalidate_cache_tags,
+    invalidate_cache_tags_async,
+)
 from src.drugs import mapper
-from src.drugs.repository import DrugRepository, get_drug_repository
+from src.drugs.repository import (
+    DrugRepository,
+    get_drug_repository,
+    AsyncDrugRepository,
+    get_async_drug_repository,
+)
 from src.drugs.schema import DrugRequest, DrugResponse
 from src.exception import BadRequestException, UnknownIdentifierException
-from src.database import get_session_factory
+from src.database import get_session_factory, get_async_session_factory
 
 
 class DrugService:
@@ -23,6 +35,7 @@ class DrugService:
                 drug = self._drug_repository.save(drug.model_dump(), session)
                 ans = mapper.drug_to_response(drug)
                 session.commit()
+                invalidate_cache_tags(DRUGS_TAG)
             except IntegrityError as e:
                 """
                 Here most probably if this exception is raised,
@@ -59,6 +72,7 @@ class DrugService:
                 raise UnknownIdentifierException(drug_id)
             ans = self._drug_repository.delete(session=session, obj_id=drug_id)
             session.commit()
+            invalidate_cache_tags(DRUGS_TAG, drug_tag(drug_id))
             return ans
 
     def find_all(self, page: int = 0, page_size: int = 1000):
@@ -72,3 +86,65 @@ def get_drug_service(
     session_factory: Annotated[sessionmaker, Depends(get_session_factory)],
 ):
     return DrugService(drug_repository, session_factory=session_factory)
+
+
+class AsyncDrugService:
+    """
+    Async variant of DrugService, used by the async request handlers
+    """
+
+    def __init__(self, drug_repository: AsyncDrugRepository, session_factory):
+        self._drug_repository = drug_repository
+        self._session_factory = session_factory
+
+    async def save(self, drug: DrugRequest) -> DrugResponse:
+        """
+        :raises BadRequestException: if the molecules of the drug do not exist
+        """
+        async with self._session_factory() as session:
+            try:
+                drug = await self._drug_repository.save(drug.model_dump(), session)
+                ans = mapper.drug_to_response(drug)
+                await session.commit()
+                await invalidate_cache_tags_async(DRUGS_TAG)
+            except IntegrityError as e:
+                # same as in DrugService.save, most probably molecule_id is not found in the database
+                raise BadRequestException(
+                    "Check if the molecules exist in the database. \n" + str(e)
+                )
+            return ans
+
+    async def find_by_id(self, drug_id: int) -> DrugResponse:
+        """
+        :raise UnknownIdentifierException: if the drug with the given id does not exist
+        """
+        async with self._session_factory() as session:
+            drug = await self._drug_repository.find_by_id(drug_id, session)
+            if drug is None:
+                raise UnknownIdentifierException(drug_id)
+            return mapper.drug_to_response(drug)
+
+    async def delete(self, drug_id: int) -> bool:
+        """
+        :raises UnknownIdentifierException: if the drug with the given id does not exist
+        """
+        async with self._session_factory() as session:
+            drug = await self._drug_repository.find_by_id(drug_id, session)
+            if not drug:
+                raise UnknownIdentifierException(drug_id)
+            ans = await self._drug_repository.delete(session=session, obj_id=drug_id)
+            await session.commit()
+            await invalidate_cache_tags_async(DRUGS_TAG, drug_tag(drug_id))
+            return ans
+
+    async def find_all(self, page: int = 0, page_size: int = 1000):
+        async with self._session_factory() as session:
+            drugs = await self._drug_repository.find_all(session, page, page_size)
+            return [mapper.drug_to_response(drug) for drug in drugs]
+
+
+def get_async_drug_service(
+    drug_repository: Annotated[AsyncDrugRepository, Depends(get_async_drug_repository)],
+    session_factory: Annotated[async_sessionmaker, Depends(get_async_session_factory)],
+):
+    return AsyncDrugService(drug_repository, session_factory=session_factory)
@@ -4,6 +4,7 @@ import pytest
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from starlette.testclient import TestClient
+from src.caching_service import RedisCacheServiceSingleton
 from src.config import get_test_settings
 from src.drugs.repository import DrugRepository
 from src.drugs.service import DrugService
@@ -31,6 +32,9 @@ app.dependency_overrides[get_database_url] = lambda: get_test_settings().databas
 
 @pytest.fixture
 def init_db():
+    # drugs are cached now, ids start from 1 again after the schema is recreated
+    RedisCacheServiceSingleton.get_instance().redis_client.flushdb()
+    RedisCacheServiceSingleton.get_instance().local_cache.clear()
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
     # add caffeine molecule
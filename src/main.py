@@ -1,5 +1,19 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+
+from typing import Annotated, Optional
+
+from fastapi import FastAPI, Header, Response
+from redis import RedisError
+from src.caching_service import RedisCacheServiceSingleton
+from src.database import get_async_database_engine, get_async_database_url
+from src.exception import UnknownIdentifierException
+from src.metrics import generate_metrics, mark_process_dead
+from src.profiling import get_profile_key, is_profiling_allowed
 from src.middleware import register_middlewares
+from src.redis_client import close_async_redis_client
 from src.molecules.router import router as molecule_router
 from src.drugs.router import router as drug_router
 from src.handler import register_exception_handlers
@@ -7,8 +21,42 @@ from src.config import setup_logging
 from src.celery_worker import celery
 
 setup_logging()
+logger = logging.getLogger(__name__)
+
+# seconds between the attempts to subscribe to the cache invalidations while redis is not reachable
+INVALIDATION_LISTENER_RETRY_SECONDS = 5
+
+
+async def listen_to_invalidations(cache: RedisCacheServiceSingleton) -> None:
+    """
+    Start the invalidation listener, retried until redis is reachable, so the node boots without redis,
+    entries of the local tier live for their TTL only meanwhile
+    """
+    while True:
+        try:
+            await asyncio.to_thread(cache.start_invalidation_listener)
+            return
+        except RedisError as e:
+            logger.warning(f"Subscribing to the cache invalidations failed: {e}")
+            await asyncio.sleep(INVALIDATION_LISTENER_RETRY_SECONDS)
+
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # local cache tiers of the other nodes are invalidated through redis pub/sub
+    cache = RedisCacheServiceSingleton.get_instance()
+    listener = asyncio.create_task(listen_to_invalidations(cache))
+    yield
+    listener.cancel()
+    cache.stop_invalidation_listener()
+    await close_async_redis_client()
+    # connections of the async engine belong to this event loop, they can not be reused after it is closed
+    await get_async_database_engine(get_async_database_url()).dispose()
+    # gauges of this worker are not summed up anymore, a restarted worker writes new ones
+    mark_process_dead(os.getpid())
+
+
+app = FastAPI(lifespan=lifespan)
 
 # register the routers
 app.include_router(molecule_router, prefix="/molecules")
@@ -25,6 +73,32 @@ def get_server_id():
     return "Hello from  server " + getenv("SERVER_ID", "")
 
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    content, content_type = generate_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+@app.get("/profiles/{profile_id}", include_in_schema=False)
+def get_profile(
+    profile_id: str, x_profile_token: Annotated[Optional[str], Header()] = None
+):
+    """
+    Profile of a request or a task in the collapsed stacks format, see src.profiling.
+    Unknown profiles and requests that are not allowed to profile get 404.
+    """
+    profile = (
+        RedisCacheServiceSingleton.get_instance().get_object(
+            get_profile_key(profile_id)
+        )
+        if is_profiling_allowed(x_profile_token)
+        else None
+    )
+    if profile is None:
+        raise UnknownIdentifierException(profile_id)
+    return Response(content=profile, media_type="text/plain")
+
+
 @app.get("/tasks/{task_id}")
 def read_item(task_id: str):
     task = celery.AsyncResult(task_id)
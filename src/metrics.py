@@ -0,0 +1,148 @@
+"""
+Prometheus metrics of the app, exposed on GET /metrics.
+
+When the app runs with several worker processes, PROMETHEUS_MULTIPROC_DIR environment variable must point to
+an empty directory shared by the workers, every process writes its values there and /metrics aggregates them,
+whichever worker serves the scrape. Counters and histograms are summed up, gauges use the "livesum" mode,
+so values of the live worker processes are summed up. Without the variable, values of the serving process are exposed.
+Exiting processes remove their gauge files, see mark_process_dead, otherwise a restarted worker would be summed up
+with the dead one.
+
+The celery worker has no web app, the substructure searches run there, its pool processes share a directory
+the same way and the main process serves the aggregated metrics on METRICS_PORT, see start_metrics_server.
+
+Search metrics of the substructure searches are per search type, RDKit matches per second is
+rate(molecule_search_rows_scanned_total) / rate(molecule_search_duration_seconds_sum),
+every scanned row is one RDKit substructure match.
+"""
+
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a connection from the database pool",
+    ["pool"],
+    buckets=(
+        0.0005,
+        0.001,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1,
+        2.5,
+        5,
+        10,
+        30,
+    ),
+)
+
+DB_POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use",
+    "Connections currently checked out from the database pool",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow_connections",
+    "Connections opened above the pool size",
+    ["pool"],
+    multiprocess_mode="livesum",
+)
+
+# route is the path template, for example /molecules/{molecule_id}, so the number of series stays bounded
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Time from receiving the request until the response starts, streamed bodies are not included",
+    ["method", "route", "status"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+# result is one of hit, stale, miss, coalesced, bypass, see CachingMiddleware
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "GET requests of the cached endpoints by the cache result",
+    ["result"],
+)
+
+# result is hit or miss, hit ratio is rate of hits / rate of all lookups
+CHEM_SERVICE_LOOKUPS = Counter(
+    "chem_service_lookups_total",
+    "Lookups of RDKit molecules in the ChemService cache",
+    ["result"],
+)
+
+CHEM_SERVICE_SIZE = Gauge(
+    "chem_service_cached_molecules",
+    "RDKit molecules held in the ChemService cache",
+    multiprocess_mode="livesum",
+)
+
+# search is substructures or superstructures
+SEARCH_DURATION = Histogram(
+    "molecule_search_duration_seconds",
+    "Duration of the substructure searches",
+    ["search"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+SEARCH_ROWS_SCANNED = Counter(
+    "molecule_search_rows_scanned_total",
+    "Molecules read from the database and matched with RDKit by the substructure searches",
+    ["search"],
+)
+
+SEARCH_HITS = Counter(
+    "molecule_search_hits_total",
+    "Molecules returned by the substructure searches",
+    ["search"],
+)
+
+
+def _get_registry() -> CollectorRegistry:
+    """
+    :return: registry aggregating the files of all the processes in multiprocess mode, the default one otherwise
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def generate_metrics() -> tuple[bytes, str]:
+    """
+    :return: metrics in the text format and its content type
+    """
+    return generate_latest(_get_registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port: int) -> None:
+    """
+    Serve the metrics over HTTP from a background thread, for processes without the web app
+    """
+    start_http_server(port, registry=_get_registry())
+
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Remove the livesum gauge values of an exiting process, does nothing outside multiprocess mode
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
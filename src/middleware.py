@@ -1,137 +1,612 @@
+import asyncio
+import hashlib
 import json
+import struct
 import time
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qsl
+
 from fastapi import Request
 import logging
+from starlette.datastructures import Headers
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import StreamingResponse, JSONResponse
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from src.cache_tags import tags_for_path
 from src.caching_service import RedisCacheServiceSingleton
+from src.config import get_settings
+from src.metrics import CACHE_REQUESTS, HTTP_REQUEST_DURATION
+from src.profiling import ProfilingMiddleware
+from src.timing import (
+    collect_timings,
+    format_server_timing,
+    timed,
+    timings_in_milliseconds,
+)
 import fnmatch
 
 logger = logging.getLogger(__name__)
 
 CACHED_CONTENT_LENGTH_LIMIT = 1024 * 1024
 
+# endpoints that are cached with their respective expiration time, fnmatch patterns of the path
+# responses are tagged and invalidated by the service writes, see src/cache_tags.py, so they can live long
+CACHED_ENDPOINTS = {
+    "**/molecules**": 60 * 60 * 24 * 7,
+    "**/drugs**": 60 * 60 * 24 * 7,
+}
+
+# these match CACHED_ENDPOINTS, but must not be cached, exports are streamed and can be huge
+NOT_CACHED_ENDPOINTS = {"**/molecules/export**"}
+
 
 async def log_request_time_middleware(request: Request, call_next):
-    start_time = time.perf_counter()
-    response = await call_next(request)
-    process_time = time.perf_counter() - start_time
+    """
+    Time until the response starts, broken down by phase, is sent in the Server-Timing header and logged,
+    timings are in the "timings" attribute of the log record too, in milliseconds, see src.timing
+    """
+    with collect_timings() as timings:
+        response = await call_next(request)
+    process_time = timings["total"]
+    response.headers["Server-Timing"] = format_server_timing(timings)
+    HTTP_REQUEST_DURATION.labels(
+        request.method, get_route_template(request.scope), response.status_code
+    ).observe(process_time)
     logger.info(
         f"Request {request.method} {request.url.path} {request.query_params} processed in {process_time:.5f} seconds"
+        f" ({response.headers['Server-Timing']})",
+        extra={"timings": timings_in_milliseconds(timings)},
     )
     return response
 
 
-called = 0
+def get_route_template(scope: Scope) -> str:
+    """
+    Path template of the route, for example /molecules/{molecule_id}, used as the metrics label.
+
+    Cached responses are sent before the request is routed, so the route is looked up here then.
+
+    :return: path of the matching route, "unmatched" if no route matches
+    """
+    route = scope.get("route")
+    if route is None:
+        for candidate in scope["app"].router.routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate
+                break
+    return route.path if route is not None else "unmatched"
 
 
-async def caching_middleware(
-    request: Request,
-    call_next,
-):
+class CachingMiddleware:
+    """
+    Pure ASGI middleware that caches successful GET responses in redis as raw bytes.
 
-    # I could not find a way to inject the redis client into the middleware, so I am accessing it from the function
-    # All of the dependencies are singletons, so it should not be a problem
-    # I with there was a dependency injection container library like in .NET or Spring, but it is not widely used in
-    # fastapi community for some reason as far as I can see
-    # when the app is running in DEV or TEST mode, which is possible by just setting these environment variables,
-    # different redis instance is used, so the cache is not shared between the environments
-    redis = RedisCacheServiceSingleton.get_instance()
+    On a miss the response is passed to the client message by message, and a copy of the body is collected
+    on the side. If the body grows over max_body_size, the copy is dropped and the response is not cached,
+    the client still gets the whole response. Streaming responses often have no content-length header,
+    so the size is checked on the bytes that actually went through.
 
-    # this is a dictionary of endpoints that should be cached with their respective expiration time
+    On a hit the stored status, headers and body are sent as they are, no JSON is decoded or encoded,
+    a hit costs one redis GET and one write to the socket. Redis is called through the asyncio client,
+    see AsyncRedisCacheService, the event loop serves other requests while waiting for it.
 
-    cached_endpoints = {
-        "**/molecules**": 60 * 60 * 24 * 7,
-    }
-    # cached_endpoints = {}
+    Misses are coalesced, only one request computes the response of a key, concurrent requests for the same key
+    wait for it and get the cached bytes. Requests in the same process wait for a future, the nodes agree
+    through a redis lock, requests on other nodes poll redis until the lock is released. If the leader
+    does not cache the response, because it is not 200 or too large, the waiting requests compute it themselves.
 
-    if request.method != "GET":
-        logger.info("Request is not cached because it is not a GET request")
-        return await call_next(request)
+    Entries are fresh for the expiration of the endpoint, then they are stale for stale_while_revalidate seconds.
+    Stale entry is served right away and one request refreshes it in the background.
+    Invalidated entries are deleted, see src/cache_tags.py, they are never served stale.
 
-    # fnmatch is used to match the request URL with the cached endpoints, it supports unix shell-style wildcards
-    if not any(
-        fnmatch.fnmatch(request.url.path, endpoint) for endpoint in cached_endpoints
+    Every cached response gets an ETag, a hash of the body computed once when the entry is stored.
+    Request with a matching "if-none-match" header gets 304 Not Modified without the body, on a hit that costs
+    one redis GET, nothing is computed or serialized. On a miss the ETag is sent with the response too,
+    unless it is streamed in several chunks, the headers are sent before the whole body is known then.
+
+    Request with "cache-control: no-cache" header skips the cached response, the fresh response is cached again.
+    """
+
+    # how long the leader may compute a response, other requests wait at most this long
+    LOCK_TIMEOUT_SECONDS = 30
+    LOCK_POLL_INTERVAL_SECONDS = 0.05
+    STALE_WHILE_REVALIDATE_SECONDS = 60 * 60
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        cached_endpoints: dict[str, int] = None,
+        not_cached_endpoints: set[str] = None,
+        max_body_size: int = CACHED_CONTENT_LENGTH_LIMIT,
+        stale_while_revalidate: int = STALE_WHILE_REVALIDATE_SECONDS,
+        lock_timeout: float = LOCK_TIMEOUT_SECONDS,
     ):
-        logger.info(f"URL {request.url.path} is not cached")
-        return await call_next(request)
-
-    url = request.url.path
-
-    # sorting the query params is super important because the order of query params does not matter
-    # if we do not do this, the cache key will be different for the same URL with different query params
-    params = sorted(request.query_params.items())
-    cache_key = (
-        url + "?" + "&".join([f"{k}={v}" for k, v in params])
-        if len(params) > 0
-        else url
-    )
+        """
+        :param cached_endpoints: fnmatch pattern of the path -> expiration seconds
+        :param not_cached_endpoints: patterns that match cached_endpoints, but must not be cached
+        :param max_body_size: responses with larger bodies are not cached
+        :param stale_while_revalidate: seconds after the expiration during which the stale entry is still served
+        :param lock_timeout: seconds the leader may take to compute a response
+        """
+        self.app = app
+        self.cached_endpoints = (
+            CACHED_ENDPOINTS if cached_endpoints is None else cached_endpoints
+        )
+        self.not_cached_endpoints = (
+            NOT_CACHED_ENDPOINTS
+            if not_cached_endpoints is None
+            else not_cached_endpoints
+        )
+        self.max_body_size = max_body_size
+        self.stale_while_revalidate = stale_while_revalidate
+        self.lock_timeout = lock_timeout
+        # cache key -> future with the cached bytes, or None if the leader did not cache the response
+        self._in_flight: dict[str, asyncio.Future] = {}
+        # references to the background refreshes and stores, so they are not garbage collected while running
+        self._background_tasks: set[asyncio.Task] = set()
 
-    cached_response = redis.get_json(cache_key)
-    if cached_response:
-        logger.info(f"cache hit for {cache_key}")
-        if "no-cache" not in request.headers.get("cache-control", {}):
-            return JSONResponse(
-                content=cached_response["body"],
-                status_code=cached_response["status_code"],
-                headers=cached_response["headers"],
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        expiration = self._expiration(path)
+        if expiration is None:
+            logger.info(f"URL {path} is not cached")
+            await self.app(scope, receive, send)
+            return
+
+        # I could not find a way to inject the redis client into the middleware, so I am accessing it from here
+        # All of the dependencies are singletons, so it should not be a problem
+        redis = RedisCacheServiceSingleton.get_instance().aio
+        cache_key = get_cache_key(path, scope["query_string"])
+        request_headers = Headers(scope=scope)
+
+        if "no-cache" in request_headers.get("cache-control", ""):
+            logger.info(f"no-cache header found, revalidating cache for {cache_key}")
+            CACHE_REQUESTS.labels("bypass").inc()
+            await self._compute(scope, receive, send, redis, cache_key, expiration)
+            return
+
+        with timed("cache"):
+            cached = await redis.get_bytes(cache_key)
+        if cached is not None:
+            response = decode_cached_response(cached)
+            if response.fresh_until is not None and response.fresh_until < time.time():
+                logger.info(f"stale cache hit for {cache_key}, revalidating")
+                CACHE_REQUESTS.labels("stale").inc()
+                self._revalidate_in_background(scope, redis, cache_key, expiration)
+            else:
+                logger.info(f"cache hit for {cache_key}")
+                CACHE_REQUESTS.labels("hit").inc()
+            await send_cached_response(
+                send, response, request_headers.get("if-none-match")
             )
-        logger.info(f"no-cache header found, revalidating cache for {cache_key}")
-    else:
+            return
+
         logger.info(f"cache miss for {cache_key}")
+        await self._compute_coalesced(
+            scope, receive, send, redis, cache_key, expiration
+        )
+
+    def _expiration(self, path: str) -> Optional[int]:
+        """
+        :return: expiration seconds of the first cached endpoint matching the path, None if not cached
+        """
+        if any(fnmatch.fnmatch(path, pattern) for pattern in self.not_cached_endpoints):
+            return None
+        for pattern, expiration in self.cached_endpoints.items():
+            if fnmatch.fnmatch(path, pattern):
+                return expiration
+        return None
+
+    async def _compute_coalesced(
+        self, scope, receive, send, redis, cache_key, expiration
+    ) -> None:
+        """
+        Compute the response, unless somebody is computing it already, then wait for it and send the cached bytes
+        """
+        in_flight = self._in_flight.get(cache_key)
+        if in_flight is not None:
+            logger.info(f"waiting for the response of {cache_key} computed meanwhile")
+            cached = await self._wait_for_future(in_flight)
+            if cached is not None:
+                CACHE_REQUESTS.labels("coalesced").inc()
+                await send_cached_response(
+                    send, decode_cached_response(cached), _if_none_match(scope)
+                )
+                return
+            CACHE_REQUESTS.labels("miss").inc()
+            await self._compute(scope, receive, send, redis, cache_key, expiration)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        cached = None
+        try:
+            token = await redis.acquire_lock(cache_key, self.lock_timeout)
+            if token is None:
+                logger.info(f"{cache_key} is computed by another node, waiting")
+                cached = await self._wait_for_other_node(redis, cache_key)
+                if cached is not None:
+                    CACHE_REQUESTS.labels("coalesced").inc()
+                    await send_cached_response(
+                        send, decode_cached_response(cached), _if_none_match(scope)
+                    )
+                    return
+            CACHE_REQUESTS.labels("miss").inc()
+            try:
+                cached = await self._compute(
+                    scope, receive, send, redis, cache_key, expiration
+                )
+            finally:
+                if token is not None:
+                    await redis.release_lock(cache_key, token)
+        finally:
+            del self._in_flight[cache_key]
+            future.set_result(cached)
+
+    async def _wait_for_future(self, future: asyncio.Future) -> Optional[bytes]:
+        try:
+            # shielded, a waiter that times out or disconnects must not cancel the future of the others
+            return await asyncio.wait_for(asyncio.shield(future), self.lock_timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _wait_for_other_node(self, redis, cache_key: str) -> Optional[bytes]:
+        """
+        :return: bytes cached by the node holding the lock, None if it released the lock without caching
+            or the lock timed out
+        """
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.LOCK_POLL_INTERVAL_SECONDS)
+            with timed("cache"):
+                cached = await redis.get_bytes(cache_key)
+            if cached is not None:
+                return cached
+            if not await redis.is_locked(cache_key):
+                return None
+        return None
+
+    async def _compute(
+        self, scope, receive, send, redis, cache_key, expiration
+    ) -> Optional[bytes]:
+        """
+        Run the app and cache its response
+
+        :return: the cached bytes, None if the response was not cached
+        """
+        # versions are taken before the response is computed, see _store
+        tags = tags_for_path(scope["path"])
+        with timed("cache"):
+            tag_versions = await redis.get_tag_versions(tags)
+        stored = {}
+
+        try:
+            await self.app(
+                scope,
+                receive,
+                self._tee(
+                    send,
+                    redis,
+                    cache_key,
+                    expiration,
+                    tags,
+                    tag_versions,
+                    stored,
+                    _if_none_match(scope),
+                ),
+            )
+        finally:
+            # the waiting requests are woken up when the bytes are in redis, see _compute_coalesced
+            if "task" in stored:
+                await asyncio.shield(stored["task"])
+        return stored.get("value")
+
+    def _revalidate_in_background(self, scope, redis, cache_key, expiration) -> None:
+        if cache_key in self._in_flight:
+            return
+        self._run_in_background(
+            self._revalidate(dict(scope), redis, cache_key, expiration)
+        )
+
+    def _run_in_background(self, coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _revalidate(self, scope, redis, cache_key, expiration) -> None:
+        """
+        Compute the response again without a client, only one node refreshes the entry,
+        the stale one is served meanwhile
+        """
+        if cache_key in self._in_flight:
+            return
+        token = await redis.acquire_lock(cache_key, self.lock_timeout)
+        if token is None:
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        cached = None
+        try:
+            cached = await self._compute(
+                scope, _background_receive(), _discard, redis, cache_key, expiration
+            )
+        except Exception:
+            logger.exception(f"Revalidation of {cache_key} failed")
+        finally:
+            await redis.release_lock(cache_key, token)
+            del self._in_flight[cache_key]
+            future.set_result(cached)
+
+    def _tee(
+        self,
+        send: Send,
+        redis,
+        cache_key: str,
+        expiration: int,
+        tags: list[str],
+        tag_versions: list,
+        stored: dict,
+        if_none_match: Optional[str] = None,
+    ) -> Send:
+        """
+        Wrap send, every message goes to the client right away, the body is also copied for the cache.
+
+        Start of a cacheable response is held until the first body message, if that is the whole body,
+        the ETag is added to the headers, or 304 is sent instead if it matches if_none_match.
+        The response is stored after its last message is sent, in a task under the "task" key of stored.
+
+        :param stored: the cached bytes are put under the "value" key once they are stored
+        """
+        state = {"caching": True, "status": None, "headers": None, "start": None}
+        body = bytearray()
+
+        async def store(value: bytes) -> None:
+            with timed("cache"):
+                is_stored = await self._store(
+                    redis,
+                    cache_key,
+                    value,
+                    expiration + self.stale_while_revalidate,
+                    tags,
+                    tag_versions,
+                )
+            if is_stored:
+                stored["value"] = value
+
+        async def send_and_cache(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["headers"] = message.get("headers", [])
+                content_length = Headers(raw=state["headers"]).get("content-length")
+                if state["status"] != 200:
+                    logger.info(f"Response for {cache_key} is not 200, not caching")
+                    state["caching"] = False
+                elif content_length and int(content_length) > self.max_body_size:
+                    logger.info(f"Response for {cache_key} is too large, not caching")
+                    state["caching"] = False
+                else:
+                    state["start"] = message
+                    return
+                await send(message)
+                return
+
+            etag = None
+            value = None
+            if message["type"] == "http.response.body" and state["caching"]:
+                body.extend(message.get("body", b""))
+                if len(body) > self.max_body_size:
+                    logger.info(f"Response for {cache_key} is too large, not caching")
+                    state["caching"] = False
+                    body.clear()
+                elif not message.get("more_body", False):
+                    etag = compute_etag(bytes(body))
+                    value = encode_cached_response(
+                        state["status"],
+                        state["headers"],
+                        bytes(body),
+                        fresh_until=time.time() + expiration,
+                        etag=etag,
+                    )
+
+            start = state.pop("start", None)
+            if (
+                start is not None
+                and etag is not None
+                and etag_matches(if_none_match, etag)
+            ):
+                await send_not_modified(send, etag)
+            else:
+                if start is not None:
+                    if etag is not None:
+                        start = {
+                            **start,
+                            "headers": [*start["headers"], _etag_header(etag)],
+                        }
+                    await send(start)
+                await send(message)
 
-    response = await call_next(request)
-
-    if response.status_code != 200:
-        logger.info(f"Response for {cache_key} is not 200, not caching")
-        return response
-
-    # Looks like fastapi always returns a StreamingResponse for responses that are not JSONResponse
-    # I could not find exact documentation on this, but this is what I observed
-    # So, I implemented a logic just for caching StreamingResponse
-    # because extracting the body from StreamingResponse is a bit different than JSONResponse and other responses
-    if not isinstance(response, StreamingResponse):
-        logger.info(f"Response for {cache_key} is not a StreamingResponse, not caching")
-        return response
-
-    # What I am doing I am reading the content of the StreamingResponse and then converting it to JSONResponse
-    # This can cause several concerns.
-    # 1. If the response is too large, it will consume a lot of memory
-    # 2. There is a possibility of mismatch in the response content-length header and the actual content length
-
-    # I had the second problem and I just removed the content-length header from the response headers, fortunately
-    # fastapi automatically recalculates the content-length header
-
-    # For the first problem, I think you can not get away with caching and not buffering the response,
-    # what you can do is to limit the size of the response that you are caching, by reading the response content-length
-
-    # This is just and arbitrary limit, can be changed according to the memory available
-    if int(response.headers.get("content-length", 0)) > CACHED_CONTENT_LENGTH_LIMIT:
-        logger.info(f"Response for {cache_key} is too large, not caching")
-        return response
-
-    response_body = b"".join([chunk async for chunk in response.body_iterator])
-    response_json = json.loads(response_body.decode())
-    headers = dict(response.headers)
-    headers.pop("content-length")
-
-    # Cache the response
-    cache_data = {
-        "body": response_json,
-        "status_code": response.status_code,
-        "headers": headers,
-    }
-    redis.set_json(cache_key, cache_data)
-    logger.info(f"Response for {cache_key} is cached")
-
-    # Remember, the reason we are converting the StreamingResponse to JSONResponse is because the StreamingResponse is
-    # already consumed because we read it to cache it
-    return JSONResponse(
-        content=response_json, status_code=response.status_code, headers=headers
+            # the client has the whole response already, storing it does not delay it. It runs in a task,
+            # streaming responses cancel the send once their body is complete and the client is gone
+            if value is not None:
+                stored["task"] = self._run_in_background(store(value))
+
+        return send_and_cache
+
+    @staticmethod
+    async def _store(redis, cache_key, value, expiration, tags, tag_versions) -> bool:
+        """
+        Store the response under its tags. If any tag was invalidated while the response was computed,
+        the response may be stale, the invalidation might have missed it, so it is deleted right away.
+
+        :return: True if the response stays cached
+        """
+        await redis.set_tagged_bytes(cache_key, value, tags, expiration)
+        if await redis.get_tag_versions(tags) != tag_versions:
+            logger.info(f"Response for {cache_key} was invalidated meanwhile, dropped")
+            await redis.delete(cache_key)
+            return False
+        logger.info(f"Response for {cache_key} is cached")
+        return True
+
+
+def _background_receive() -> Receive:
+    """
+    Receive of a request without a client, empty body first, then it waits until the response is sent,
+    the app cancels it after the response is complete
+    """
+    sent = False
+
+    async def receive() -> Message:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    return receive
+
+
+async def _discard(message: Message) -> None:
+    pass
+
+
+def get_cache_key(path: str, query_string: bytes) -> str:
+    """
+    Sorting the query params is super important because the order of query params does not matter,
+    if we do not do this, the cache key will be different for the same URL with different query params order
+    """
+    params = sorted(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True))
+    return path + "?" + "&".join(f"{k}={v}" for k, v in params) if params else path
+
+
+# headers describing the transfer of the original response, the cached body is sent in one piece
+_NOT_REPLAYED_HEADERS = {b"content-length", b"transfer-encoding"}
+
+
+class CachedResponse(NamedTuple):
+    status: int
+    headers: list
+    body: bytes
+    # unix time after which the response is stale, None if it never gets stale
+    fresh_until: Optional[float] = None
+    etag: Optional[str] = None
+
+
+def compute_etag(body: bytes) -> str:
+    """
+    Strong ETag, hash of the body, the same body always gets the same ETag on every node
+    """
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Weak comparison, as required for If-None-Match, W/ prefixes are ignored
+
+    :param if_none_match: value of the header, "*" or comma separated ETags
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
     )
 
 
+def encode_cached_response(
+    status: int,
+    headers: list,
+    body: bytes,
+    fresh_until: float = None,
+    etag: str = None,
+) -> bytes:
+    """
+    Cached entry is a 4 byte length of the JSON metadata, the metadata with status, raw headers,
+    the freshness time and the ETag, and the body bytes as they were sent.
+    Only the small metadata is decoded on a hit.
+    """
+    meta = json.dumps(
+        {
+            "status": status,
+            "fresh_until": fresh_until,
+            "etag": etag,
+            "headers": [
+                [name.decode("latin-1"), value.decode("latin-1")]
+                for name, value in headers
+                if name.lower() not in _NOT_REPLAYED_HEADERS
+            ],
+        }
+    ).encode()
+    return struct.pack(">I", len(meta)) + meta + body
+
+
+def decode_cached_response(cached: bytes) -> CachedResponse:
+    """
+    :return: status, raw headers and body of an entry written by encode_cached_response
+    """
+    (meta_length,) = struct.unpack_from(">I", cached)
+    body_start = 4 + meta_length
+    meta = json.loads(cached[4:body_start])
+    headers = [
+        (name.encode("latin-1"), value.encode("latin-1"))
+        for name, value in meta["headers"]
+    ]
+    return CachedResponse(
+        meta["status"],
+        headers,
+        cached[body_start:],
+        meta.get("fresh_until"),
+        meta.get("etag"),
+    )
+
+
+async def send_cached_response(
+    send: Send, response: CachedResponse, if_none_match: Optional[str] = None
+) -> None:
+    """
+    :param if_none_match: If-None-Match header of the request, 304 is sent if it matches the ETag of the response
+    """
+    status, headers, body, _, etag = response
+    if etag is not None:
+        if etag_matches(if_none_match, etag):
+            await send_not_modified(send, etag)
+            return
+        headers.append(_etag_header(etag))
+    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_not_modified(send: Send, etag: str) -> None:
+    await send(
+        {"type": "http.response.start", "status": 304, "headers": [_etag_header(etag)]}
+    )
+    await send({"type": "http.response.body", "body": b""})
+
+
+def _etag_header(etag: str) -> tuple[bytes, bytes]:
+    return b"etag", etag.encode("latin-1")
+
+
+def _if_none_match(scope: Scope) -> Optional[str]:
+    return Headers(scope=scope).get("if-none-match")
+
+
 def register_middlewares(app):
-    app.add_middleware(BaseHTTPMiddleware, dispatch=caching_middleware)
+    if get_settings().RESPONSE_CACHE_ENABLED:
+        app.add_middleware(CachingMiddleware)
+    else:
+        logger.warning("Response cache is disabled, every request is computed")
     # request time logging middleware should be added last
     app.add_middleware(BaseHTTPMiddleware, dispatch=log_request_time_middleware)
+    # except profiling, profiles cover the whole request, logging included
+    app.add_middleware(ProfilingMiddleware)
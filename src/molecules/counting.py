@@ -0,0 +1,94 @@
+import json
+from functools import lru_cache
+from typing import Optional
+
+from src.caching_service import AsyncRedisCacheService, RedisCacheServiceSingleton
+from src.molecules.schema import SearchParams
+
+
+class MoleculeCountCache:
+    """
+    Totals of the molecule collection responses, cached in redis per search params.
+
+    Every cached total is stored under the current version, every write to the molecules table increments
+    the version, so all the cached totals are invalidated at once, without looking them up.
+    Old entries are not deleted, they just expire.
+
+    Exact count scans every matching row, so it is only run when the planner estimates at most
+    EXACT_COUNT_LIMIT matches, otherwise the planner estimate itself is returned and flagged as an estimate.
+
+    Methods ending with _async do the same on the asyncio redis client, they are used by AsyncMoleculeService.
+    """
+
+    EXACT_COUNT_LIMIT = 100_000
+    CACHE_EXPIRATION = 60 * 60  # 1 hour
+    VERSION_KEY = "molecules:count:version"
+
+    @property
+    def _redis(self) -> RedisCacheServiceSingleton:
+        # instance is looked up every time, tests replace it with RedisCacheServiceSingleton.create
+        return RedisCacheServiceSingleton.get_instance()
+
+    @property
+    def _async_redis(self) -> AsyncRedisCacheService:
+        return RedisCacheServiceSingleton.get_instance().aio
+
+    def key(self, search_params: SearchParams) -> str:
+        """
+        Key of the total under the current version. Take the key before counting, so a total counted
+        while a write was committed is stored under the old version and is never read.
+        """
+        return self._versioned_key(search_params, self._redis.get_int(self.VERSION_KEY))
+
+    async def key_async(self, search_params: SearchParams) -> str:
+        version = await self._async_redis.get_int(self.VERSION_KEY)
+        return self._versioned_key(search_params, version)
+
+    @staticmethod
+    def _versioned_key(search_params: SearchParams, version: int) -> str:
+        # ordering does not change the total, only the filters are part of the key
+        filters = search_params.model_dump(exclude={"order_by", "order"})
+        return f"molecules:count:{version}:{json.dumps(filters, sort_keys=True)}"
+
+    def get(self, key: str) -> Optional[tuple[int, bool]]:
+        """
+        :return: total and whether it is an estimate, None if it is not cached
+        """
+        return self._from_cached(self._redis.get_object(key))
+
+    async def get_async(self, key: str) -> Optional[tuple[int, bool]]:
+        return self._from_cached(await self._async_redis.get_object(key))
+
+    @staticmethod
+    def _from_cached(cached: Optional[dict]) -> Optional[tuple[int, bool]]:
+        if cached is None:
+            return None
+        return cached["total"], cached["is_estimate"]
+
+    def set(self, key: str, total: int, is_estimate: bool) -> None:
+        self._redis.set_object(
+            key,
+            {"total": total, "is_estimate": is_estimate},
+            self.CACHE_EXPIRATION,
+        )
+
+    async def set_async(self, key: str, total: int, is_estimate: bool) -> None:
+        await self._async_redis.set_object(
+            key,
+            {"total": total, "is_estimate": is_estimate},
+            self.CACHE_EXPIRATION,
+        )
+
+    def invalidate(self) -> None:
+        """
+        Called after every committed write to the molecules table
+        """
+        self._redis.increment(self.VERSION_KEY)
+
+    async def invalidate_async(self) -> None:
+        await self._async_redis.increment(self.VERSION_KEY)
+
+
+@lru_cache
+def get_molecule_count_cache():
+    return MoleculeCountCache()
@@ -0,0 +1,35 @@
+from typing import Any, Callable
+
+from rdkit import Chem
+from rdkit.Chem import Crippen, Lipinski, rdMolDescriptors
+from rdkit.Chem.Descriptors import MolWt
+
+
+def lipinski_violations(mol: Chem.Mol) -> int:
+    """
+    Number of broken Lipinski rules: mass over 500, logP over 5, more than 5 H-bond donors
+    and more than 10 H-bond acceptors. Molecules with at most one violation pass the Rule of Five.
+    """
+    return sum(
+        (
+            MolWt(mol) > 500,
+            Crippen.MolLogP(mol) > 5,
+            Lipinski.NumHDonors(mol) > 5,
+            Lipinski.NumHAcceptors(mol) > 10,
+        )
+    )
+
+
+# column -> deriver, registered in MoleculeWritePipeline, every column has a btree index for the range filters
+DESCRIPTOR_DERIVERS: dict[str, Callable[[Chem.Mol], Any]] = {
+    "logp": Crippen.MolLogP,
+    "tpsa": rdMolDescriptors.CalcTPSA,
+    "hbd": Lipinski.NumHDonors,
+    "hba": Lipinski.NumHAcceptors,
+    "rotatable_bonds": rdMolDescriptors.CalcNumRotatableBonds,
+    "ring_count": rdMolDescriptors.CalcNumRings,
+    "lipinski_violations": lipinski_violations,
+}
+
+# molecules with at most this many violations pass the Rule of Five
+RULE_OF_FIVE_MAX_VIOLATIONS = 1
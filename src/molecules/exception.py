@@ -32,3 +32,29 @@ class CsvLineParsingException(Exception):
     def __init__(self, line):
         self.line = line
         self.message = f"CSV line {line} can not be parsed into the molecule"
+
+
+class UnsupportedFileFormatException(BadRequestException):
+    def __init__(self, filename):
+        self.filename = filename
+        super().__init__(
+            message=f"File {filename} has unsupported format, supported formats are csv, sdf and smi, "
+            f"optionally gzip or zstd compressed"
+        )
+
+
+class InvalidCursorException(BadRequestException):
+    def __init__(self, cursor):
+        self.cursor = cursor
+        super().__init__(
+            message=f"Cursor {cursor} is invalid, or it was issued for different search parameters"
+        )
+
+
+class InvalidFieldsException(BadRequestException):
+    def __init__(self, fields):
+        self.fields = fields
+        super().__init__(
+            message=f"Fields {fields} are invalid, molecules have fields molecule_id, smiles, name, mass, "
+            f"created_at and updated_at"
+        )
@@ -0,0 +1,133 @@
+import csv
+import datetime
+import io
+import json
+from typing import Iterable, Iterator, Literal, Sequence
+
+export_formats = Literal["csv", "ndjson", "parquet"]
+
+# columns written to every export, links are not exported, they can be built from molecule_id and smiles
+EXPORT_COLUMNS = (
+    "molecule_id",
+    "smiles",
+    "name",
+    "mass",
+    "created_at",
+    "updated_at",
+)
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def export_chunks(
+    export_format: export_formats, partitions: Iterable[Sequence]
+) -> Iterator[bytes]:
+    """
+    Encode chunks of rows into the given format.
+
+    Every chunk of rows coming from the database cursor is encoded and yielded right away,
+    so at most one chunk is held in memory, no matter how large the export is.
+
+    :param export_format: csv, ndjson or parquet
+    :param partitions: iterable of row chunks, rows are tuples in the EXPORT_COLUMNS order
+    :return: iterator of encoded bytes
+    """
+    if export_format == "csv":
+        return _csv_chunks(partitions)
+    if export_format == "ndjson":
+        return _ndjson_chunks(partitions)
+    return _parquet_chunks(partitions)
+
+
+def _csv_chunks(partitions: Iterable[Sequence]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in partitions:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # header of the empty export
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _ndjson_chunks(partitions: Iterable[Sequence]) -> Iterator[bytes]:
+    for rows in partitions:
+        lines = [
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), default=_json_default)
+            for row in rows
+        ]
+        yield ("\n".join(lines) + "\n").encode()
+
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class _DrainableSink(io.RawIOBase):
+    """
+    Writable file object for the parquet writer, bytes written so far can be drained and sent to the client.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _parquet_chunks(partitions: Iterable[Sequence]) -> Iterator[bytes]:
+    """
+    Every chunk of rows is written as a separate parquet row group and the bytes are sent right away,
+    footer is written when the writer is closed.
+    """
+    # pyarrow is a big library, it is imported only when somebody actually asks for parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("molecule_id", pa.int64()),
+            ("smiles", pa.string()),
+            ("name", pa.string()),
+            ("mass", pa.float64()),
+            ("created_at", pa.timestamp("us")),
+            ("updated_at", pa.timestamp("us")),
+        ]
+    )
+
+    sink = _DrainableSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for rows in partitions:
+            columns = list(zip(*rows))
+            table = pa.Table.from_arrays(
+                [
+                    pa.array(column, type=field.type)
+                    for column, field in zip(columns, schema)
+                ],
+                schema=schema,
+            )
+            writer.write_table(table)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
@@ -1,7 +1,15 @@
-from src.molecules.schema import MoleculeResponse, MoleculeRequest
+from typing import Optional
+from urllib.parse import urlencode
+
+from src.molecules.schema import (
+    MOLECULE_FIELDS,
+    FieldSelection,
+    MoleculeResponse,
+    MoleculeCollectionResponse,
+    SearchParams,
+    SEARCH_QUERY_PARAMS,
+)
 from src.schema import Link
-from rdkit import Chem
-from rdkit.Chem.Descriptors import MolWt
 
 
 def generate_links_from_id(molecule_id: int):
@@ -56,6 +64,55 @@ def generate_links_from_id_and_smiles(molecule_id: int, smiles: str):
     }
 
 
+def link(href: str, rel: str) -> dict:
+    """
+    Link as a plain dict, see molecule_to_dict
+    """
+    return {"href": href, "rel": rel, "type": "GET"}
+
+
+_TIMESTAMP_FIELDS = {"created_at", "updated_at"}
+
+
+def molecule_to_dict(molecule, selection: FieldSelection = None) -> dict:
+    """
+    Same as model_to_response, but a plain dict, shaped like MoleculeResponse.
+
+    Rows read from the database are trusted, validating every field and link of a page through pydantic
+    costs more than reading the page, so collections are built from dicts, and the routes encode them
+    with orjson in one pass.
+
+    :param molecule: row or model with the columns of selection.columns
+    :param selection: fields and links of the result, all of them if not given
+    """
+    fields, links = (
+        (MOLECULE_FIELDS, True)
+        if selection is None
+        else (selection.fields, selection.links)
+    )
+
+    result = {}
+    for field in fields:
+        value = getattr(molecule, field)
+        if field in _TIMESTAMP_FIELDS and value is not None:
+            value = value.isoformat()
+        result[field] = value
+
+    if links:
+        molecule_id, smiles = molecule.molecule_id, molecule.smiles
+        result["links"] = {
+            "self": link(f"/molecules/{molecule_id}", "self"),
+            "substructures": link(
+                f"/molecules/search/substructures?smiles={smiles}", "substructures"
+            ),
+            "superstructures": link(
+                f"/molecules/search/superstructures?smiles={smiles}",
+                "superstructures",
+            ),
+        }
+    return result
+
+
 def model_to_response(molecule):
     return MoleculeResponse(
         molecule_id=molecule.molecule_id,
@@ -68,12 +125,101 @@ def model_to_response(molecule):
     )
 
 
-def request_to_model_json(molecule_request: MoleculeRequest) -> dict:
-    # calculate molecular mass
-    molecule = Chem.MolFromSmiles(molecule_request.smiles)
-    mass = MolWt(molecule)
+def models_to_collection_response(
+    molecules,
+    page: int,
+    page_size: int,
+    search_params: SearchParams = None,
+    next_cursor: Optional[str] = None,
+    total: Optional[int] = None,
+    total_is_estimate: bool = False,
+) -> MoleculeCollectionResponse:
+    """
+    Validated version of models_to_collection_dict
+    """
+    return MoleculeCollectionResponse.model_validate(
+        models_to_collection_dict(
+            molecules,
+            page,
+            page_size,
+            search_params,
+            next_cursor,
+            total,
+            total_is_estimate,
+        )
+    )
+
+
+def models_to_collection_dict(
+    molecules,
+    page: int,
+    page_size: int,
+    search_params: SearchParams = None,
+    next_cursor: Optional[str] = None,
+    total: Optional[int] = None,
+    total_is_estimate: bool = False,
+    selection: FieldSelection = None,
+) -> dict:
+    """
+    Paginated collection of MoleculeService.find_all and AsyncMoleculeService.find_all,
+    a plain dict shaped like MoleculeCollectionResponse, see molecule_to_dict
+
+    total is the number of all the matching molecules, if it is not given, size of the page is used.
+
+    next_page link carries the cursor of the last row and is left out on the last page.
+    prev_page link is offset based, cursors only go forward.
+    Both keep the field selection, links=false leaves out the links of the molecules, not of the pages.
+    """
+    data = [molecule_to_dict(mol, selection) for mol in molecules]
+
+    links = {}
+    if next_cursor is not None:
+        links["next_page"] = link(
+            collection_href(page + 1, page_size, search_params, next_cursor, selection),
+            "nextPage",
+        )
+    links["prev_page"] = link(
+        collection_href(
+            max(0, page - 1), page_size, search_params, selection=selection
+        ),
+        "prevPage",
+    )
+
     return {
-        "smiles": molecule_request.smiles,
-        "name": molecule_request.name,
-        "mass": mass,
+        "total": len(data) if total is None else total,
+        "total_is_estimate": total_is_estimate,
+        "page": page,
+        "page_size": page_size,
+        "data": data,
+        "links": links,
     }
+
+
+def collection_href(
+    page: int,
+    page_size: int,
+    search_params: SearchParams = None,
+    cursor: Optional[str] = None,
+    selection: FieldSelection = None,
+) -> str:
+    """
+    Link to the molecules collection with the same search params and field selection, cursor is added if given
+    """
+    query = {"page": page, "pageSize": page_size}
+    if search_params is not None:
+        query.update(
+            {
+                alias: getattr(search_params, field)
+                for field, alias in SEARCH_QUERY_PARAMS.items()
+            }
+        )
+    if selection is not None:
+        if selection.fields != MOLECULE_FIELDS:
+            query["fields"] = ",".join(selection.fields)
+        if not selection.links:
+            query["links"] = "false"
+    query["cursor"] = cursor
+
+    return "/molecules?" + urlencode(
+        {key: value for key, value in query.items() if value is not None}
+    )
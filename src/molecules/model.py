@@ -1,4 +1,4 @@
-from typing import Annotated
+from typing import Annotated, Optional
 from sqlalchemy.orm import Mapped, mapped_column
 from src.database import Base
 from src.molecules.schema import MoleculeResponse
@@ -25,6 +25,24 @@ class Molecule(Base):
     # I think this will work just fine for now
     mass: Mapped[Annotated[float, mapped_column()]]
 
+    # These columns are derived from the parsed molecule at write time by MoleculeWritePipeline,
+    # they are nullable because rows inserted before the pipeline existed do not have them.
+    canonical_smiles: Mapped[Optional[str]] = mapped_column(nullable=True)
+    # RDKit pattern fingerprint, used for substructure screening
+    fingerprint: Mapped[Optional[bytes]] = mapped_column(nullable=True, deferred=True)
+    # Binary RDKit molecule, Chem.Mol(mol_pickle) is much faster than parsing smiles again
+    mol_pickle: Mapped[Optional[bytes]] = mapped_column(nullable=True, deferred=True)
+
+    # Descriptors for the range filters of the search, see src/molecules/descriptors.py,
+    # indexes are created in the migration script, like the mass index
+    logp: Mapped[Optional[float]] = mapped_column(nullable=True)
+    tpsa: Mapped[Optional[float]] = mapped_column(nullable=True)
+    hbd: Mapped[Optional[int]] = mapped_column(nullable=True)
+    hba: Mapped[Optional[int]] = mapped_column(nullable=True)
+    rotatable_bonds: Mapped[Optional[int]] = mapped_column(nullable=True)
+    ring_count: Mapped[Optional[int]] = mapped_column(nullable=True)
+    lipinski_violations: Mapped[Optional[int]] = mapped_column(nullable=True)
+
     def __repr__(self):
         return f"Molecule(molecule_id={self.molecule_id}, smiles={self.smiles}, name={self.name})"
 
@@ -0,0 +1,63 @@
+import base64
+import binascii
+import json
+from typing import Optional
+
+from src.molecules.exception import InvalidCursorException
+from src.molecules.schema import SearchParams
+
+
+def sort_key(search_params: SearchParams) -> str:
+    """
+    Column the molecules are ordered by, molecule_id is always the tiebreaker after it.
+
+    :return: "distance" (trigram distance) for the name search, "mass" if ordered by mass, "molecule_id" otherwise
+    """
+    if search_params.name:
+        return "distance"
+    if search_params.order_by:
+        return search_params.order_by
+    return "molecule_id"
+
+
+def encode_cursor(search_params: SearchParams, last_row) -> str:
+    """
+    Opaque cursor pointing right after the last row of the page.
+
+    It keeps the sort key value and the molecule_id of the last row, so the next page is fetched with
+    WHERE (key, molecule_id) > (last key, last id) instead of OFFSET, and costs the same as the first page.
+
+    :param last_row: last row returned by MoleculeRepository.find_all
+    """
+    key = sort_key(search_params)
+    cursor = {"o": key, "id": last_row.molecule_id}
+    if key != "molecule_id":
+        cursor["k"] = getattr(last_row, key)
+
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode().rstrip("=")
+
+
+def decode_cursor(search_params: SearchParams, cursor: Optional[str]) -> Optional[dict]:
+    """
+    :return: dict with "id" and, unless ordered by molecule_id, "k" keys, None if cursor is None
+    :raises InvalidCursorException: if the cursor is malformed, or it was issued for a different ordering
+    """
+    if cursor is None:
+        return None
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        decoded = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError):
+        raise InvalidCursorException(cursor)
+
+    key = sort_key(search_params)
+    if (
+        not isinstance(decoded, dict)
+        or decoded.get("o") != key
+        or not isinstance(decoded.get("id"), int)
+        or (key != "molecule_id" and not isinstance(decoded.get("k"), (int, float)))
+    ):
+        raise InvalidCursorException(cursor)
+
+    return decoded
@@ -0,0 +1,76 @@
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+from rdkit import Chem, DataStructs
+from rdkit.Chem.Descriptors import MolWt
+
+from src.molecules.descriptors import DESCRIPTOR_DERIVERS
+from src.molecules.utils import get_chem_molecule_from_smiles_or_raise_exception
+from src.timing import timed
+
+
+def _pattern_fingerprint(mol: Chem.Mol) -> bytes:
+    """
+    Pattern fingerprint is the one RDKit uses for substructure screening, stored as binary text.
+    """
+    return DataStructs.BitVectToBinaryText(Chem.PatternFingerprint(mol))
+
+
+class MoleculeWritePipeline:
+    """
+    Turns a SMILES string into the column values stored in the molecules table.
+
+    SMILES string is parsed into the RDKit molecule once, and every precomputed column is derived from that
+    single molecule object. Adding a new precomputed column means registering one more deriver,
+    it does not add one more parse.
+
+    Every write path goes through this pipeline: MoleculeService.save, process_csv_file and bulk_insert_from_file.
+    """
+
+    DEFAULT_DERIVERS: dict[str, Callable[[Chem.Mol], Any]] = {
+        "mass": MolWt,
+        "canonical_smiles": Chem.MolToSmiles,
+        "fingerprint": _pattern_fingerprint,
+        "mol_pickle": lambda mol: mol.ToBinary(),
+        **DESCRIPTOR_DERIVERS,
+    }
+
+    def __init__(self, derivers: dict[str, Callable[[Chem.Mol], Any]] = None):
+        self._derivers = dict(self.DEFAULT_DERIVERS if derivers is None else derivers)
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self._derivers)
+
+    def register(self, column: str, deriver: Callable[[Chem.Mol], Any]) -> None:
+        """
+        :param column: name of the column in the molecules table
+        :param deriver: function that computes the column value from the RDKit molecule
+        """
+        self._derivers[column] = deriver
+
+    def to_model_json(
+        self, smiles: str, name: Optional[str], mol: Chem.Mol = None
+    ) -> dict:
+        """
+        :param smiles: SMILES string, stored as it is
+        :param name: name of the molecule
+        :param mol: already parsed molecule, for example MoleculeRequest.mol, if None, smiles is parsed here
+        :return: dict with all the stored columns, ready for the repository
+        :raises InvalidSmilesException: if mol is not given and smiles does not represent a valid molecule
+        """
+        with timed("chem"):
+            if mol is None:
+                mol = get_chem_molecule_from_smiles_or_raise_exception(smiles)
+            return {"smiles": smiles, "name": name, **self.derive(mol)}
+
+    def derive(self, mol: Chem.Mol) -> dict:
+        """
+        :return: dict with the derived columns only, used by the backfill of existing rows
+        """
+        return {column: deriver(mol) for column, deriver in self._derivers.items()}
+
+
+@lru_cache
+def get_molecule_write_pipeline():
+    return MoleculeWritePipeline()
@@ -0,0 +1,153 @@
+import csv
+import gzip
+import io
+from pathlib import PurePath
+from typing import BinaryIO, Iterator, Optional
+
+import zstandard
+from rdkit import Chem
+
+from src.molecules.exception import (
+    InvalidCsvHeaderColumnsException,
+    UnsupportedFileFormatException,
+)
+
+# file extension -> format name, compression extensions are stripped before the lookup
+SUPPORTED_FORMATS = {
+    ".csv": "csv",
+    ".sdf": "sdf",
+    ".sd": "sdf",
+    ".smi": "smi",
+    ".smiles": "smi",
+}
+
+COMPRESSION_EXTENSIONS = {".gz", ".gzip", ".zst", ".zstd"}
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# properties checked for the molecule name in SD files, when the title line is empty
+SDF_NAME_PROPERTIES = ("name", "Name", "NAME")
+
+
+def read_molecule_rows(
+    file: BinaryIO, filename: Optional[str], required_columns: set[str]
+) -> Iterator[dict]:
+    """
+    Open an uploaded molecule file and return an iterator of rows, every row is a dict with at least
+    "smiles" and "name" keys, so every format feeds the same ingestion pipeline as CSV.
+
+    Supported formats are CSV, SDF and SMILES files, the format is taken from the file extension,
+    files without a known extension are treated as CSV, like before. Any of them can be gzip or zstd compressed,
+    compression is detected from the magic bytes, so the extension does not matter there.
+
+    Nothing is decompressed to disk or read in memory entirely, the file is parsed as a stream.
+
+    This is not a generator itself, so the format and the CSV header are validated right away,
+    before the first row is consumed.
+
+    :param file: binary file object, for example UploadFile.file
+    :param filename: name of the uploaded file, used to detect the format
+    :param required_columns: columns that must be present in the CSV header
+    :return: iterator of rows
+    :raises UnsupportedFileFormatException: if the file extension is not supported
+    :raises InvalidCsvHeaderColumnsException: if the CSV header misses the required columns
+    """
+    file_format = detect_file_format(filename)
+    stream = open_decompressed_stream(file)
+
+    if file_format == "sdf":
+        return _read_sdf_rows(stream)
+
+    text_stream = io.TextIOWrapper(stream, encoding="utf-8")
+
+    if file_format == "smi":
+        return _read_smi_rows(text_stream)
+
+    csv_reader = csv.DictReader(text_stream)
+    missing_columns = required_columns - set(csv_reader.fieldnames or [])
+    if missing_columns:
+        raise InvalidCsvHeaderColumnsException(missing_columns)
+    return iter(csv_reader)
+
+
+def detect_file_format(filename: Optional[str]) -> str:
+    """
+    :param filename: name of the file, for example molecules.sdf.gz
+    :return: one of the SUPPORTED_FORMATS values
+    :raises UnsupportedFileFormatException: if the extension is not supported
+    """
+    if not filename:
+        return "csv"
+
+    suffixes = [suffix.lower() for suffix in PurePath(filename).suffixes]
+    while suffixes and suffixes[-1] in COMPRESSION_EXTENSIONS:
+        suffixes.pop()
+
+    if not suffixes:
+        return "csv"
+
+    if suffixes[-1] not in SUPPORTED_FORMATS:
+        raise UnsupportedFileFormatException(filename)
+    return SUPPORTED_FORMATS[suffixes[-1]]
+
+
+def open_decompressed_stream(file: BinaryIO) -> BinaryIO:
+    """
+    Wrap the file in a streaming decompressor if it is gzip or zstd compressed.
+
+    The file has to be seekable, the first bytes are peeked to detect compression and then the position
+    is restored. UploadFile.file is a SpooledTemporaryFile, so that is fine.
+    """
+    magic = file.read(len(ZSTD_MAGIC))
+    file.seek(0)
+
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=file, mode="rb")
+    if magic.startswith(ZSTD_MAGIC):
+        return zstandard.ZstdDecompressor().stream_reader(file)
+    return file
+
+
+def _read_smi_rows(text_stream) -> Iterator[dict]:
+    """
+    SMILES files have one molecule per line, SMILES string first and optionally the name after whitespace.
+    Empty lines and lines starting with # are skipped, the first line is skipped if it is a "smiles name" header.
+    Molecules without a name are named by their SMILES string, the name column is not nullable.
+    """
+    for line_number, line in enumerate(text_stream, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split(maxsplit=1)
+        if line_number == 1 and parts[0].lower() == "smiles":
+            continue
+        yield {"smiles": parts[0], "name": parts[1] if len(parts) > 1 else parts[0]}
+
+
+def _read_sdf_rows(stream) -> Iterator[dict]:
+    """
+    ForwardSDMolSupplier reads records one by one from the stream, records that RDKit can not parse come as None,
+    those are yielded with an empty SMILES string, so they are reported as invalid by the ingestion pipeline.
+    Records without a name are named by their SMILES string, like the unnamed lines of SMILES files.
+    """
+    supplier = Chem.ForwardSDMolSupplier(stream)
+    for record, mol in enumerate(supplier, start=1):
+        if mol is None:
+            yield {"smiles": "", "name": None, "record": record}
+            continue
+        smiles = Chem.MolToSmiles(mol)
+        yield {
+            "smiles": smiles,
+            "name": _get_sdf_molecule_name(mol) or smiles,
+            "record": record,
+        }
+
+
+def _get_sdf_molecule_name(mol) -> Optional[str]:
+    if mol.HasProp("_Name") and mol.GetProp("_Name").strip():
+        return mol.GetProp("_Name").strip()
+    for prop in SDF_NAME_PROPERTIES:
+        if mol.HasProp(prop):
+            return mol.GetProp(prop)
+    return None
@@ -1,11 +1,37 @@
 from functools import lru_cache
 
-from sqlalchemy import text, insert
+from typing import Iterator, Optional, Sequence
+
+from sqlalchemy import (
+    REAL,
+    Select,
+    cast,
+    func,
+    insert,
+    literal,
+    literal_column,
+    or_,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlmodel import Session
 
 from src.molecules.model import Molecule
-from src.molecules.schema import SearchParams
-from src.repository import SQLAlchemyRepository
+from src.molecules.pagination import sort_key
+from src.molecules.descriptors import RULE_OF_FIVE_MAX_VIOLATIONS
+from src.molecules.schema import (
+    RANGE_FILTERED_COLUMNS,
+    SearchParams,
+    get_search_params,
+)
+from src.repository import (
+    SQLAlchemyRepository,
+    AsyncSQLAlchemyRepository,
+    Explain,
+    planned_rows,
+)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,68 +47,99 @@ class MoleculeRepository(SQLAlchemyRepository):
         page=0,
         page_size=1000,
         search_params: SearchParams = None,
+        cursor: dict = None,
+        columns: Sequence[str] = None,
     ):
         """
-        If name is provided, then fuzzy search with trigrams is performed, results are ordered by similarity,
-        notice that in that case, order_by and order are ignored. Filtering by mass is still possible.
+        If name is provided, then fuzzy search with trigrams is performed, results are ordered by trigram
+        distance (name <-> :name), notice that in that case, order_by and order are ignored.
+        Filtering by mass is still possible.
+
+        Ordering by the distance operator lets postgres walk the GiST trigram index in distance order
+        and stop after page_size rows, instead of computing similarity of every match and sorting them all.
+        Names are matched with %, so only names at least as similar as similarity_threshold are returned,
+        the threshold is set for the current transaction only.
+
+        If name is not provided, then normal search is performed, results are ordered by order_by and order,
+        or by molecule_id if order_by is not given. molecule_id is always the tiebreaker.
 
-        If name is not provided, then normal search is performed, results are ordered by order_by and order.
+        If cursor is given, page is ignored, rows after the cursor are returned using keyset pagination
+        instead of OFFSET, so deep pages cost as much as the first one.
 
-        Return type for now is a collection of ScalarResult, might include extra field "sml" for similarity,
-        so be careful when using this method.
+        Statement is built from SQLAlchemy constructs and every user value is a bound parameter, so the SQL text
+        is the same for every name, mass bound and page. SQLAlchemy compiles it once and caches it,
+        and with asyncpg postgres reuses the prepared statement and its plan.
 
-        //TODO: This append is not a good practice, but I will keep it for now, I saw there are nice patterns
-        //TODO: in sql alchemy querying guide, I will try to implement them later.
+        Returns rows with the FIND_ALL_COLUMNS, not ORM objects. Name search rows also have distance.
+
+        :param cursor: decoded cursor, see src.molecules.pagination.decode_cursor
+        :param columns: names of the Molecule columns to select instead of FIND_ALL_COLUMNS, molecule_id
+            and the column the rows are ordered by are always selected, the next page cursor is built from them
         """
+        _set_similarity_threshold(session, search_params)
 
-        min_mass_filter = (
-            f" AND mass >= {search_params.min_mass}" if search_params.min_mass else ""
-        )
+        return session.execute(
+            _find_all_statement(page, page_size, search_params, cursor, columns)
+        ).all()
+
+    def find_row_by_id(self, session: Session, obj_id: int, columns: Sequence[str]):
+        """
+        Only the given columns of the molecule, as a row instead of an ORM object
+
+        :return: the row, None if there is no molecule with the given id
+        """
+        return session.execute(_find_row_by_id_statement(obj_id, columns)).first()
+
+    def count(self, session: Session, search_params: SearchParams) -> int:
+        """
+        Exact number of molecules matching the search params, it scans every match, use estimate_count first
+        """
+        _set_similarity_threshold(session, search_params)
+        return session.execute(_count_statement(search_params)).scalar_one()
 
-        max_mass_filter = (
-            f" AND mass <= {search_params.max_mass}" if search_params.max_mass else ""
+    def estimate_count(self, session: Session, search_params: SearchParams) -> int:
+        """
+        Number of matching molecules estimated by the planner from the table statistics, nothing is scanned
+        """
+        _set_similarity_threshold(session, search_params)
+        return planned_rows(
+            session.execute(Explain(_matching_ids(search_params))).scalar_one()
         )
 
-        name_filter = f" AND name % '{search_params.name}'"
-
-        if search_params.name:
-            query = f"""
-                SELECT similarity('{search_params.name}',m.name) as sml, * FROM molecules m
-                WHERE 1=1
-                {min_mass_filter}
-                {max_mass_filter}
-                {name_filter}
-                ORDER BY sml DESC
-                LIMIT {page_size} OFFSET {page * page_size}
-            """
-        else:
-            order_by = (
-                f"ORDER BY {search_params.order_by}" if search_params.order_by else ""
-            )
-            order = (
-                ""
-                if not search_params.order_by
-                else search_params.order if search_params.order else "ASC"
-            )
-            query = f"""
-                SELECT * FROM molecules
-                WHERE 1=1
-                {min_mass_filter}
-                {max_mass_filter}
-                {order_by} {order}
-                LIMIT {page_size} OFFSET {page * page_size}
-            """
+    def stream_all(
+        self,
+        session: Session,
+        columns: Sequence[str],
+        search_params: SearchParams,
+        chunk_size: int = 5000,
+    ) -> Iterator[Sequence]:
+        """
+        Stream all the molecules matching the search params from one server-side cursor, chunk by chunk.
+
+        Only the given columns are selected and rows are not turned into ORM objects, this is meant
+        for exporting the whole table, where per-row overhead matters.
 
-        return session.execute(text(query)).all()
+        :param columns: names of the Molecule columns to select
+        :param search_params: same filters as find_all, pagination is not applied
+        :param chunk_size: number of rows fetched from the cursor at a time
+        :return: iterator of row chunks
+        """
+        stmt = _filtered_select(
+            search_params, *[getattr(Molecule, column) for column in columns]
+        )
+        _set_similarity_threshold(session, search_params)
+        result = session.execute(stmt, execution_options={"yield_per": chunk_size})
+        yield from result.partitions()
 
     def bulk_insert(self, session: Session, data: list):
         """
         returns the int number of added rows, commits automatically
 
+        Rows should already contain every stored column, see MoleculeWritePipeline.
+
         //TODO: I was in rush for deadline, I will implement a better way to handle errors and let the user know what
         went wrong.
         """
-        data = [{"mass": len(d["smiles"]), **d} for d in data]
         try:
             session.execute(insert(Molecule), data)
             session.flush()
@@ -92,7 +149,264 @@ class MoleculeRepository(SQLAlchemyRepository):
 
         return len(data)
 
+    def find_without_descriptors(
+        self, session: Session, after_id: int = 0, limit: int = 1000
+    ):
+        """
+        Molecules written before the descriptor columns existed, ordered by molecule_id
+
+        :param after_id: only molecules with greater molecule_id are returned, keyset of the backfill
+        :return: rows with molecule_id, smiles and mol_pickle
+        """
+        stmt = (
+            select(Molecule.molecule_id, Molecule.smiles, Molecule.mol_pickle)
+            .where(
+                Molecule.molecule_id > after_id,
+                or_(
+                    Molecule.lipinski_violations.is_(None),
+                    Molecule.mol_pickle.is_(None),
+                ),
+            )
+            .order_by(Molecule.molecule_id)
+            .limit(limit)
+        )
+        return session.execute(stmt).all()
+
+    def bulk_update(self, session: Session, data: list[dict]) -> int:
+        """
+        Update molecules by primary key, every dict must contain molecule_id and the columns to set
+
+        :return: number of updated rows
+        """
+        if data:
+            session.execute(update(Molecule), data)
+        return len(data)
+
+
+class AsyncMoleculeRepository(AsyncSQLAlchemyRepository):
+    """
+    Async variant of MoleculeRepository for the async request handlers, only the read and write methods
+    used by the CRUD endpoints are here, streaming, bulk inserts and searches stay synchronous.
+    """
+
+    def __init__(self):
+        super().__init__(Molecule)
+
+    async def find_all(
+        self,
+        session: AsyncSession,
+        page=0,
+        page_size=1000,
+        search_params: SearchParams = None,
+        cursor: dict = None,
+        columns: Sequence[str] = None,
+    ):
+        """
+        Same query and same return type as MoleculeRepository.find_all
+        """
+        await _set_similarity_threshold_async(session, search_params)
+        result = await session.execute(
+            _find_all_statement(page, page_size, search_params, cursor, columns)
+        )
+        return result.all()
+
+    async def find_row_by_id(
+        self, session: AsyncSession, obj_id: int, columns: Sequence[str]
+    ):
+        """
+        Same as MoleculeRepository.find_row_by_id
+        """
+        result = await session.execute(_find_row_by_id_statement(obj_id, columns))
+        return result.first()
+
+    async def count(self, session: AsyncSession, search_params: SearchParams) -> int:
+        await _set_similarity_threshold_async(session, search_params)
+        result = await session.execute(_count_statement(search_params))
+        return result.scalar_one()
+
+    async def estimate_count(
+        self, session: AsyncSession, search_params: SearchParams
+    ) -> int:
+        await _set_similarity_threshold_async(session, search_params)
+        result = await session.execute(Explain(_matching_ids(search_params)))
+        return planned_rows(result.scalar_one())
+
+
+# columns returned by find_all, binary columns like fingerprint and mol_pickle are not needed for responses
+FIND_ALL_COLUMNS = (
+    Molecule.molecule_id,
+    Molecule.smiles,
+    Molecule.name,
+    Molecule.mass,
+    Molecule.created_at,
+    Molecule.updated_at,
+)
+
+
+def _filtered_select(
+    search_params: SearchParams, *columns, cursor: dict = None
+) -> Select:
+    """
+    Select statement with the filters and ordering of the search params, values are bound parameters.
+
+    If name is provided, results are ordered by trigram distance and order_by is ignored.
+    Used by find_all, AsyncMoleculeRepository.find_all and stream_all.
+
+    :param cursor: decoded cursor, only rows after it in the ordering are selected
+    """
+    stmt = select(*columns)
+
+    for column in RANGE_FILTERED_COLUMNS:
+        min_value = getattr(search_params, f"min_{column}")
+        max_value = getattr(search_params, f"max_{column}")
+        if min_value is not None:
+            stmt = stmt.where(getattr(Molecule, column) >= min_value)
+        if max_value is not None:
+            stmt = stmt.where(getattr(Molecule, column) <= max_value)
+
+    if search_params.rule_of_five is not None:
+        # constant is inlined, not bound, so the planner can match the partial rule of five index
+        max_violations = literal_column(str(RULE_OF_FIVE_MAX_VIOLATIONS))
+        # molecules without descriptors yet, see backfill_descriptors, match neither
+        stmt = stmt.where(
+            Molecule.lipinski_violations <= max_violations
+            if search_params.rule_of_five
+            else Molecule.lipinski_violations > max_violations
+        )
+
+    if search_params.name:
+        stmt = stmt.where(Molecule.name.op("%")(search_params.name))
+
+    key_column, descending = _sort_column(search_params)
+
+    if cursor is not None:
+        last_id = literal(cursor["id"])
+        if key_column is Molecule.molecule_id:
+            row, last_row = Molecule.molecule_id, last_id
+        else:
+            last_key = literal(cursor["k"])
+            if search_params.name:
+                # distance is real, the cursor value is compared as real too, otherwise equal values differ
+                last_key = cast(last_key, REAL)
+            row = tuple_(key_column, Molecule.molecule_id)
+            last_row = tuple_(last_key, last_id)
+        stmt = stmt.where(row < last_row if descending else row > last_row)
+
+    if descending:
+        return stmt.order_by(key_column.desc(), Molecule.molecule_id.desc())
+    if key_column is Molecule.molecule_id:
+        return stmt.order_by(Molecule.molecule_id)
+    return stmt.order_by(key_column, Molecule.molecule_id)
+
+
+def _sort_column(search_params: SearchParams):
+    """
+    :return: column or expression the rows are ordered by, and whether the order is descending
+    """
+    key = sort_key(search_params)
+    if key == "distance":
+        return _name_distance(search_params), False
+    if key == "molecule_id":
+        return Molecule.molecule_id, False
+    return getattr(Molecule, key), search_params.order == "desc"
+
+
+def _find_all_statement(
+    page: int,
+    page_size: int,
+    search_params: SearchParams = None,
+    cursor: dict = None,
+    column_names: Sequence[str] = None,
+) -> Select:
+    """
+    Statement of MoleculeRepository.find_all, shared with AsyncMoleculeRepository.find_all
+    """
+    if search_params is None:
+        search_params = get_search_params()
+
+    if column_names is None:
+        columns = FIND_ALL_COLUMNS
+    else:
+        # name search is ordered by distance, it is not a column, it is added below
+        key = sort_key(search_params)
+        required = ("molecule_id",) if key == "distance" else ("molecule_id", key)
+        columns = tuple(
+            getattr(Molecule, column)
+            for column in dict.fromkeys((*required, *column_names))
+        )
+    if search_params.name:
+        # selected, so the cursor of the next page can be built from the last row
+        columns += (_name_distance(search_params).label("distance"),)
+
+    stmt = _filtered_select(search_params, *columns, cursor=cursor).limit(page_size)
+    if cursor is None:
+        stmt = stmt.offset(page * page_size)
+    return stmt
+
+
+def _find_row_by_id_statement(obj_id: int, column_names: Sequence[str]) -> Select:
+    return select(*[getattr(Molecule, column) for column in column_names]).where(
+        Molecule.molecule_id == obj_id
+    )
+
+
+def _name_distance(search_params: SearchParams):
+    """
+    Trigram distance, 1 - similarity, the GiST trigram index can return rows ordered by it
+    """
+    return Molecule.name.op("<->", return_type=REAL)(search_params.name)
+
+
+def _similarity_threshold_statement(search_params: SearchParams) -> Optional[Select]:
+    """
+    set_config with is_local true, the threshold of the % operator is changed until the transaction ends,
+    other requests using the same connection later are not affected
+    """
+    if (
+        search_params is None
+        or not search_params.name
+        or search_params.similarity_threshold is None
+    ):
+        return None
+    return select(
+        func.set_config(
+            "pg_trgm.similarity_threshold",
+            str(search_params.similarity_threshold),
+            True,
+        )
+    )
+
+
+def _set_similarity_threshold(session: Session, search_params: SearchParams):
+    stmt = _similarity_threshold_statement(search_params)
+    if stmt is not None:
+        session.execute(stmt)
+
+
+async def _set_similarity_threshold_async(
+    session: AsyncSession, search_params: SearchParams
+):
+    stmt = _similarity_threshold_statement(search_params)
+    if stmt is not None:
+        await session.execute(stmt)
+
+
+def _matching_ids(search_params: SearchParams) -> Select:
+    """
+    Ids of the molecules matching the search params, unordered, counts do not need the ordering
+    """
+    return _filtered_select(search_params, Molecule.molecule_id).order_by(None)
+
+
+def _count_statement(search_params: SearchParams) -> Select:
+    return select(func.count()).select_from(_matching_ids(search_params).subquery())
+
 
 @lru_cache
 def get_molecule_repository():
     return MoleculeRepository()
+
+
+@lru_cache
+def get_async_molecule_repository():
+    return AsyncMoleculeRepository()
@@ -1,14 +1,33 @@
-from typing import Annotated
-from fastapi import Depends, status, Body, Path, Query, UploadFile, APIRouter
+import uuid
+from typing import Annotated, Optional
+from fastapi import (
+    Depends,
+    status,
+    Body,
+    Path,
+    Query,
+    Request,
+    UploadFile,
+    APIRouter,
+)
+from starlette.responses import StreamingResponse
+
+from src.molecules.exporters import export_formats, EXPORT_MEDIA_TYPES
 
 from src.molecules.schema import (
+    FieldSelection,
     MoleculeRequest,
     MoleculeResponse,
     SearchParams,
+    get_field_selection,
     get_search_params,
     MoleculeCollectionResponse,
 )
-from src.molecules.service import get_molecule_service
+from src.molecules.service import (
+    get_molecule_service,
+    get_async_molecule_service,
+    AsyncMoleculeService,
+)
 from src.schema import (
     PaginationQueryParams,
     get_pagination_query_params,
@@ -16,6 +35,7 @@ from src.schema import (
 )
 from src.molecules.service import MoleculeService
 from src.tasks import substructure_search_task
+from src.timing import TimedORJSONResponse
 
 router = APIRouter()
 
@@ -31,11 +51,45 @@ router = APIRouter()
         },
     },
 )
-def add_molecule(
+async def add_molecule(
     molecule_request: Annotated[MoleculeRequest, Body(...)],
-    service: Annotated[MoleculeService, Depends(get_molecule_service)],
+    service: Annotated[AsyncMoleculeService, Depends(get_async_molecule_service)],
 ) -> MoleculeResponse:
-    return service.save(molecule_request)
+    return await service.save(molecule_request)
+
+
+# this route has to be registered before /{molecule_id}, otherwise "export" is matched as the molecule id
+@router.get(
+    "/export",
+    status_code=200,
+    response_class=StreamingResponse,
+    responses={
+        status.HTTP_200_OK: {
+            "description": "All the molecules matching the filters, in the requested format",
+            "content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()},
+        },
+    },
+)
+def export_molecules(
+    service: Annotated[MoleculeService, Depends(get_molecule_service)],
+    search_params: Annotated[SearchParams, Depends(get_search_params)],
+    export_format: Annotated[
+        export_formats, Query(alias="format", description="Format of the export")
+    ] = "csv",
+):
+    """
+    Export the whole molecule catalog, or the part matching the filters, as a stream.
+
+    Accepts the same filters as GET /molecules, there is no pagination and no links,
+    rows are streamed from one database cursor, so the export is not held in memory.
+    """
+    return StreamingResponse(
+        service.export(export_format, search_params),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="molecules.{export_format}"'
+        },
+    )
 
 
 @router.get(
@@ -49,27 +103,38 @@ def add_molecule(
         },
     },
 )
-def get_molecule(
+async def get_molecule(
     molecule_id: Annotated[
         int, Path(..., description="Unique identifier for the molecule")
     ],
-    service: Annotated[MoleculeService, Depends(get_molecule_service)],
-):
-    return service.find_by_id(molecule_id)
+    service: Annotated[AsyncMoleculeService, Depends(get_async_molecule_service)],
+    selection: Annotated[FieldSelection, Depends(get_field_selection)],
+) -> TimedORJSONResponse:
+    """
+    fields selects the returned fields of the molecule, links=false leaves out its links,
+    only the columns needed for them are read from the database.
+    """
+    return TimedORJSONResponse(await service.find_by_id(molecule_id, selection))
 
 
 @router.get(
     "/",
     status_code=200,
+    response_model=MoleculeCollectionResponse,
     responses={
         # status.HTTP_200_OK: {"model": list[MoleculeResponse]},
     },
 )
-def get_molecules(
-    service: Annotated[MoleculeService, Depends(get_molecule_service)],
+async def get_molecules(
+    service: Annotated[AsyncMoleculeService, Depends(get_async_molecule_service)],
     pagination: Annotated[PaginationQueryParams, Depends(get_pagination_query_params)],
     search_params: Annotated[SearchParams, Depends(get_search_params)],
-) -> MoleculeCollectionResponse:
+    selection: Annotated[FieldSelection, Depends(get_field_selection)],
+    cursor: Annotated[
+        Optional[str],
+        Query(description="Opaque cursor from the next_page link, page is ignored"),
+    ] = None,
+) -> TimedORJSONResponse:
     """
     Get all molecules with pagination and search parameters with pagination support.
 
@@ -82,9 +147,25 @@ def get_molecules(
     If name is provided, then fuzzy search with trigrams is performed, results are ordered by similarity
     and order_by and order are ignored. Filtering by mass is still possible.
 
+    similarityThreshold sets the minimum similarity of the found names for this request, from 0 to 1,
+    higher threshold returns fewer, closer names. Default is the database setting, 0.3 unless changed.
+
+    Follow the next_page link to get the next page, it carries a cursor pointing after the last molecule,
+    so the next page does not skip rows with OFFSET and deep pages are as fast as the first one.
+    next_page link is missing on the last page.
+
+    fields selects the returned fields of every molecule, for example fields=molecule_id,smiles,
+    and links=false leaves out the links of every molecule, the page links stay. Only the columns
+    needed for them are read from the database. Page links keep fields and links.
+
     """
 
-    return service.find_all(pagination.page, pagination.page_size, search_params)
+    # the page is built from trusted rows, returned as a response it is not validated by FastAPI again
+    return TimedORJSONResponse(
+        await service.find_all(
+            pagination.page, pagination.page_size, search_params, cursor, selection
+        )
+    )
 
 
 @router.patch(
@@ -98,19 +179,19 @@ def get_molecules(
         },
     },
 )
-def update_molecule(
+async def update_molecule(
     molecule_id: Annotated[
         int, Path(..., description="Unique identifier for the molecule")
     ],
     molecule_request: Annotated[MoleculeUpdateRequest, Body(...)],
-    service: Annotated[MoleculeService, Depends(get_molecule_service)],
+    service: Annotated[AsyncMoleculeService, Depends(get_async_molecule_service)],
 ) -> MoleculeResponse:
     """
     Does not really make sense to be able to change the id, smiles, molecular mass of a molecule.
     Only name is allowed to be changed.
     """
 
-    return service.update(molecule_id, molecule_request)
+    return await service.update(molecule_id, molecule_request)
 
 
 @router.delete(
@@ -124,13 +205,13 @@ def update_molecule(
         },
     },
 )
-def delete_molecule(
+async def delete_molecule(
     molecule_id: Annotated[
         int, Path(..., description="Unique identifier for the molecule")
     ],
-    service: Annotated[MoleculeService, Depends(get_molecule_service)],
+    service: Annotated[AsyncMoleculeService, Depends(get_async_molecule_service)],
 ) -> bool:
-    return service.delete(molecule_id)
+    return await service.delete(molecule_id)
 
 
 @router.get(
@@ -153,14 +234,26 @@ def substructure_search(
         ),
     ],
     service: Annotated[MoleculeService, Depends(get_molecule_service)],
+    selection: Annotated[FieldSelection, Depends(get_field_selection)],
+    request: Request,
     limit: Annotated[
         int, Query(description="Stop searching after finding this many molecules")
     ] = 1000,
 ):
     """
     Find all molecules that ARE SUBSTRUCTURES of the given smile, not vice vera.
+
+    fields and links select the fields of the found molecules, the same way as in GET /molecules.
+
+    The task of a profiled request is profiled too, its profile is stored under the task id, see src.profiling.
     """
-    task = substructure_search_task.delay(smiles, limit)
+    task_id = str(uuid.uuid4())
+    profile_id = task_id if getattr(request.state, "profile_id", None) else None
+    task = substructure_search_task.apply_async(
+        (smiles, limit, selection.fields, selection.links),
+        {"profile_id": profile_id},
+        task_id=task_id,
+    )
     return {"task_id": task.id}
 
 
@@ -183,17 +276,20 @@ def substructure_search_of(
         ),
     ],
     service: Annotated[MoleculeService, Depends(get_molecule_service)],
+    selection: Annotated[FieldSelection, Depends(get_field_selection)],
     limit: Annotated[
         int,
         Query(
             description="Stop searching after finding this many molecules",
         ),
     ] = 1000,
-):
+) -> TimedORJSONResponse:
     """
     Find all molecules that the given smile IS SUBSTRUCTURE OF, not vice vera.
+
+    fields and links select the fields of the found molecules, the same way as in GET /molecules.
     """
-    return service.get_superstructures(smiles, limit)
+    return TimedORJSONResponse(service.get_superstructures(smiles, limit, selection))
 
 
 @router.post("/upload/", status_code=status.HTTP_201_CREATED)
@@ -208,14 +304,20 @@ def upload_molecules(
     ] = True,
 ):
     """
-    Upload a CSV file containing molecules to the repository.
+    Upload a file containing molecules to the repository.
+
+    Supported formats are CSV (.csv), SD files (.sdf, .sd) and SMILES files (.smi, .smiles),
+    any of them can be gzip (.gz) or zstd (.zst) compressed. Format is detected by the file extension,
+    files without extension are treated as CSV.
 
     The CSV file should have the following columns: smiles,name
 
+    SMILES files should have the smiles string and optionally the name on each line, separated by whitespace.
+
     Lines that have incorrect format, missing smiles string or invalid smiles string are ignored.
     """
 
-    # Uploaded CSV file is not stored on the server, only the molecules are extracted and stored in the memory.
+    # Uploaded file is not stored on the server, it is decompressed and parsed as a stream, row by row.
     if validate_rows:
         res = service.process_csv_file(file)
     else:
@@ -1,9 +1,12 @@
 from typing import Annotated, Literal
 from black.linegen import Optional
-from pydantic import BaseModel, Field, field_validator
-from src.molecules.exception import InvalidSmilesException
-from src.molecules.utils import is_valid_smiles
+from fastapi import Query
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
+from rdkit import Chem
+from src.molecules.exception import InvalidFieldsException
+from src.molecules.utils import get_chem_molecule_from_smiles_or_raise_exception
 from src.schema import Link
+from src.timing import timed
 
 
 class MoleculeRequest(BaseModel):
@@ -16,12 +19,24 @@ class MoleculeRequest(BaseModel):
     ]
     name: Annotated[Optional[str], Field(description="Name of the molecule")]
 
-    @field_validator("smiles")
-    @classmethod
-    def validate_smiles(cls, smiles: str):
-        if not is_valid_smiles(smiles):
-            raise InvalidSmilesException(smiles)
-        return smiles
+    # parsed molecule is kept, so the write pipeline does not parse the same smiles again
+    _mol: Chem.Mol = PrivateAttr(default=None)
+
+    @model_validator(mode="after")
+    def validate_smiles(self):
+        """
+        :raises InvalidSmilesException: if the smiles does not represent a valid molecule
+        """
+        with timed("chem"):
+            self._mol = get_chem_molecule_from_smiles_or_raise_exception(self.smiles)
+        return self
+
+    @property
+    def mol(self) -> Chem.Mol:
+        """
+        RDKit molecule parsed from the smiles during validation
+        """
+        return self._mol
 
     model_config = {
         "json_schema_extra": {
@@ -95,22 +110,94 @@ class MoleculeCollectionResponse(BaseModel):
     """
 
     total: Annotated[int, Field(..., description="Total number of molecules")]
+    total_is_estimate: Annotated[
+        bool,
+        Field(
+            description="True if total is estimated from the database statistics, "
+            "large result sets are not counted exactly"
+        ),
+    ] = False
     page: Annotated[Optional[int], Field(description="Current page number")]
     page_size: Annotated[Optional[int], Field(description="Number of items per page")]
     data: Annotated[list[MoleculeResponse], Field(description="List of molecules")]
     links: Annotated[
         dict[str, Link],
         Field(
-            description="nextPage and previousPage links. If current page is 0, "
-            "previousPage will be empty"
+            description="nextPage and previousPage links. nextPage carries the cursor of the last "
+            "molecule and is missing on the last page"
         ),
     ]
 
 
+# fields of MoleculeResponse that can be selected with the fields query parameter, links are switched separately
+MOLECULE_FIELDS = ("molecule_id", "smiles", "name", "mass", "created_at", "updated_at")
+
+
+class FieldSelection(BaseModel):
+    """
+    Sparse fieldset of the molecule responses, fields of every molecule and whether its links are included.
+
+    Fields are in the order of MOLECULE_FIELDS. Only the columns needed for the response are selected
+    from the database, see columns.
+    """
+
+    fields: tuple[str, ...] = MOLECULE_FIELDS
+    links: bool = True
+
+    @property
+    def columns(self) -> tuple[str, ...]:
+        """
+        Columns to select, the fields and molecule_id and smiles, if the links are built from them
+        """
+        if not self.links:
+            return self.fields
+        return self.fields + tuple(
+            column for column in ("molecule_id", "smiles") if column not in self.fields
+        )
+
+
+def get_field_selection(
+    fields: Annotated[
+        Optional[str],
+        Query(
+            description="Comma separated fields of the molecules, for example molecule_id,smiles, "
+            "all fields by default"
+        ),
+    ] = None,
+    links: Annotated[
+        bool, Query(description="False leaves out the links of every molecule")
+    ] = True,
+) -> FieldSelection:
+    """
+    :raises InvalidFieldsException: if fields is empty or has a field molecules do not have
+    """
+    if fields is None:
+        return FieldSelection(links=links)
+
+    selected = {field.strip() for field in fields.split(",")}
+    if not selected or not selected.issubset(MOLECULE_FIELDS):
+        raise InvalidFieldsException(fields)
+    return FieldSelection(
+        fields=tuple(field for field in MOLECULE_FIELDS if field in selected),
+        links=links,
+    )
+
+
 # list for order_by possible values are "mass" for now, but can be extended in the future
 order_by_values = Literal["mass"]
 order_values = Literal["asc", "desc"]
 
+# columns with min and max filters, min_<column> and max_<column> fields of SearchParams
+RANGE_FILTERED_COLUMNS = (
+    "mass",
+    "logp",
+    "tpsa",
+    "hbd",
+    "hba",
+    "rotatable_bonds",
+    "ring_count",
+)
+
 
 class SearchParams(BaseModel):
     name: Annotated[Optional[str], Field(description="Name of the molecule")]
@@ -124,6 +211,80 @@ class SearchParams(BaseModel):
     order: Annotated[
         Optional[order_values], Field(description="Order ascending or descending")
     ]
+    similarity_threshold: Annotated[
+        Optional[float],
+        Field(
+            description="Minimum trigram similarity of the names found by the name search, "
+            "database default is 0.3",
+            ge=0,
+            le=1,
+        ),
+    ] = None
+    min_logp: Annotated[Optional[float], Field(description="Minimum logP")] = None
+    max_logp: Annotated[Optional[float], Field(description="Maximum logP")] = None
+    min_tpsa: Annotated[
+        Optional[float],
+        Field(description="Minimum topological polar surface area", ge=0),
+    ] = None
+    max_tpsa: Annotated[
+        Optional[float],
+        Field(description="Maximum topological polar surface area", ge=0),
+    ] = None
+    min_hbd: Annotated[
+        Optional[int], Field(description="Minimum number of H-bond donors", ge=0)
+    ] = None
+    max_hbd: Annotated[
+        Optional[int], Field(description="Maximum number of H-bond donors", ge=0)
+    ] = None
+    min_hba: Annotated[
+        Optional[int], Field(description="Minimum number of H-bond acceptors", ge=0)
+    ] = None
+    max_hba: Annotated[
+        Optional[int], Field(description="Maximum number of H-bond acceptors", ge=0)
+    ] = None
+    min_rotatable_bonds: Annotated[
+        Optional[int], Field(description="Minimum number of rotatable bonds", ge=0)
+    ] = None
+    max_rotatable_bonds: Annotated[
+        Optional[int], Field(description="Maximum number of rotatable bonds", ge=0)
+    ] = None
+    min_ring_count: Annotated[
+        Optional[int], Field(description="Minimum number of rings", ge=0)
+    ] = None
+    max_ring_count: Annotated[
+        Optional[int], Field(description="Maximum number of rings", ge=0)
+    ] = None
+    rule_of_five: Annotated[
+        Optional[bool],
+        Field(
+            description="True for molecules passing Lipinski's Rule of Five, at most one violation, "
+            "False for the rest"
+        ),
+    ] = None
+
+
+# SearchParams field -> query parameter name of get_search_params, used to build links
+SEARCH_QUERY_PARAMS = {
+    "name": "name",
+    "min_mass": "minMass",
+    "max_mass": "maxMass",
+    "order_by": "orderBy",
+    "order": "order",
+    "similarity_threshold": "similarityThreshold",
+    "min_logp": "minLogP",
+    "max_logp": "maxLogP",
+    "min_tpsa": "minTpsa",
+    "max_tpsa": "maxTpsa",
+    "min_hbd": "minHbd",
+    "max_hbd": "maxHbd",
+    "min_hba": "minHba",
+    "max_hba": "maxHba",
+    "min_rotatable_bonds": "minRotatableBonds",
+    "max_rotatable_bonds": "maxRotatableBonds",
+    "min_ring_count": "minRingCount",
+    "max_ring_count": "maxRingCount",
+    "rule_of_five": "ruleOfFive",
+}
 
 
 def get_search_params(
@@ -132,6 +293,20 @@ def get_search_params(
     maxMass: Optional[float] = None,
     orderBy: Optional[order_by_values] = None,
     order: Optional[order_values] = None,
+    similarityThreshold: Optional[float] = None,
+    minLogP: Optional[float] = None,
+    maxLogP: Optional[float] = None,
+    minTpsa: Optional[float] = None,
+    maxTpsa: Optional[float] = None,
+    minHbd: Optional[int] = None,
+    maxHbd: Optional[int] = None,
+    minHba: Optional[int] = None,
+    maxHba: Optional[int] = None,
+    minRotatableBonds: Optional[int] = None,
+    maxRotatableBonds: Optional[int] = None,
+    minRingCount: Optional[int] = None,
+    maxRingCount: Optional[int] = None,
+    ruleOfFive: Optional[bool] = None,
 ):
     return SearchParams(
         name=name,
@@ -139,4 +314,18 @@ def get_search_params(
         max_mass=maxMass,
         order_by=orderBy,
         order=order,
+        similarity_threshold=similarityThreshold,
+        min_logp=minLogP,
+        max_logp=maxLogP,
+        min_tpsa=minTpsa,
+        max_tpsa=maxTpsa,
+        min_hbd=minHbd,
+        max_hbd=maxHbd,
+        min_hba=minHba,
+        max_hba=maxHba,
+        min_rotatable_bonds=minRotatableBonds,
+        max_rotatable_bonds=maxRotatableBonds,
+        min_ring_count=minRingCount,
+        max_ring_count=maxRingCount,
+        rule_of_five=ruleOfFive,
     )
@@ -1,38 +1,60 @@
-import csv
-import io
 import logging
+import time
+from collections import Counter
 from functools import lru_cache
-from typing import Annotated
+from typing import Annotated, Callable, Iterator, Optional, Sequence
 
 from fastapi import UploadFile, Depends
+from rdkit import Chem
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 
+from src.cache_tags import (
+    MOLECULES_TAG,
+    invalidate_cache_tags,
+    invalidate_cache_tags_async,
+    molecule_tag,
+)
 from src.exception import UnknownIdentifierException
+from src.metrics import SEARCH_DURATION, SEARCH_HITS, SEARCH_ROWS_SCANNED
+from src.timing import add_time, timed
 from src.molecules.exception import (
     DuplicateSmilesException,
-    InvalidCsvHeaderColumnsException,
     InvalidSmilesException,
 )
+from src.molecules.exporters import (
+    EXPORT_COLUMNS,
+    export_chunks,
+    export_formats,
+)
+from src.molecules.counting import MoleculeCountCache, get_molecule_count_cache
+from src.molecules.pagination import decode_cursor, encode_cursor
+from src.molecules.pipeline import (
+    MoleculeWritePipeline,
+    get_molecule_write_pipeline,
+)
+from src.molecules.readers import read_molecule_rows
 from src.molecules.repository import (
     MoleculeRepository,
     get_molecule_repository,
+    AsyncMoleculeRepository,
+    get_async_molecule_repository,
 )
 from src.molecules.schema import (
+    FieldSelection,
     MoleculeRequest,
     SearchParams,
     get_search_params,
-    MoleculeCollectionResponse,
     MoleculeResponse,
 )
 from src.molecules.utils import (
     get_chem_molecule_from_smiles_or_raise_exception,
-    is_valid_smiles,
     get_chem_service,
 )
-from src.database import get_session_factory
+from src.database import get_session_factory, get_async_session_factory
 from src.molecules import mapper
-from src.schema import MoleculeUpdateRequest, Link
+from src.schema import MoleculeUpdateRequest
 
 logger = logging.getLogger(__name__)
 
@@ -41,23 +63,40 @@ class MoleculeService:
     # required columns in the CSV file
     required_columns = {"smiles", "name"}
 
-    def __init__(self, repository: MoleculeRepository, session_factory: sessionmaker):
+    def __init__(
+        self,
+        repository: MoleculeRepository,
+        session_factory: sessionmaker,
+        write_pipeline: MoleculeWritePipeline = None,
+        count_cache: MoleculeCountCache = None,
+    ):
         self._repository = repository
         self._session_factory = session_factory
+        self._write_pipeline = write_pipeline or get_molecule_write_pipeline()
+        self._count_cache = count_cache or get_molecule_count_cache()
 
-    def find_by_id(self, obj_id: int) -> MoleculeResponse:
+    def find_by_id(self, obj_id: int, selection: FieldSelection = None) -> dict:
         """
         :param obj_id:  molecule id
-        :return: found molecule
+        :param selection: fields and links of the molecule, only the needed columns are selected
+        :return: found molecule as a plain dict shaped like MoleculeResponse, see mapper.molecule_to_dict
         :raises UnknownIdentifierException: if the molecule with the given id does not exist
         """
+        selection = selection or FieldSelection()
 
         with self._session_factory() as session:
-            mol = self._repository.find_by_id(obj_id, session)
+            mol = self._repository.find_row_by_id(session, obj_id, selection.columns)
             if mol is None:
                 raise UnknownIdentifierException(obj_id)
-            ans = mapper.model_to_response(mol)
-            return ans
+            return mapper.molecule_to_dict(mol, selection)
+
+    def _invalidate_caches(self, *tags: str) -> None:
+        """
+        Called after a committed write, invalidates the cached totals and the cached responses
+        of the molecules collection and of the given tags
+        """
+        self._count_cache.invalidate()
+        invalidate_cache_tags(MOLECULES_TAG, *tags)
 
     def save(self, molecule_request: MoleculeRequest) -> MoleculeResponse:
         """
@@ -73,10 +112,16 @@ class MoleculeService:
             # I have removed the filter method from the repository, and I am relying on the IntegrityError,
             # Think this will work just fine.
             try:
-                mol_json = mapper.request_to_model_json(molecule_request)
+                # smiles was already parsed while validating the request, pipeline reuses that molecule
+                mol_json = self._write_pipeline.to_model_json(
+                    molecule_request.smiles,
+                    molecule_request.name,
+                    molecule_request.mol,
+                )
                 mol = self._repository.save(session, mol_json)
                 session.flush()  # This will trigger the IntegrityError if the smiles is not unique
                 session.commit()
+                self._invalidate_caches()
                 return mapper.model_to_response(mol)
             except IntegrityError as e:
                 session.rollback()  # Rollback in case of error
@@ -103,53 +148,87 @@ class MoleculeService:
 
             mol.name = molecule_request.name
             session.commit()
+            # name search totals depend on the names
+            self._invalidate_caches(molecule_tag(obj_id))
             return mapper.model_to_response(mol)
 
     def find_all(
-        self, page: int = 0, page_size: int = 1000, search_params: SearchParams = None
-    ) -> MoleculeCollectionResponse:
+        self,
+        page: int = 0,
+        page_size: int = 1000,
+        search_params: SearchParams = None,
+        cursor: Optional[str] = None,
+        selection: FieldSelection = None,
+    ) -> dict:
         """
         Find all molecules in the database. Can be paginated. Default page size is 1000.
 
+        If cursor from the next_page link is given, rows after it are returned and page is only echoed back,
+        this way deep pages are as cheap as the first one.
+
         :param search_params: Search parameters
         :param page: Zero indexed page number, default is 0
         :param page_size: Items per page, default is 1000
-        :return: List of all molecules
+        :param cursor: opaque cursor from the next_page link of the previous page
+        :param selection: fields and links of the molecules, only the needed columns are selected
+        :return: page of molecules as a plain dict shaped like MoleculeCollectionResponse,
+            rows are not validated by pydantic, see mapper.molecule_to_dict
+        :raises InvalidCursorException: if the cursor is malformed or issued for other search params
         """
+        search_params = search_params or get_search_params()
+        decoded_cursor = decode_cursor(search_params, cursor)
 
         with self._session_factory() as session:
             molecules = self._repository.find_all(
-                session, page, page_size, search_params
+                session,
+                page,
+                page_size,
+                search_params,
+                decoded_cursor,
+                selection.columns if selection else None,
             )
 
-            data = [mapper.model_to_response(mol) for mol in molecules]
-
-            res = MoleculeCollectionResponse.model_validate(
-                {
-                    "total": len(data),
-                    "page": page,
-                    "page_size": page_size,
-                    "data": data,
-                    "links": {
-                        "next_page": Link.model_validate(
-                            {
-                                "href": f"/molecules?page={page + 1}&pageSize={page_size}",
-                                "rel": "nextPage",
-                                "type": "GET",
-                            }
-                        ),
-                        "prev_page": Link.model_validate(
-                            {
-                                "href": f"/molecules?page={max(0, page - 1)}&pageSize={page_size}",
-                                "rel": "prevPage",
-                                "type": "GET",
-                            }
-                        ),
-                    },
-                }
+            key = self._count_cache.key(search_params)
+            cached_total = self._count_cache.get(key)
+            if cached_total is None:
+                total, is_estimate = self._count(session, search_params)
+                self._count_cache.set(key, total, is_estimate)
+            else:
+                total, is_estimate = cached_total
+
+            return _collection_response(
+                molecules, page, page_size, search_params, total, is_estimate, selection
             )
 
-            return res
+    def _count(self, session, search_params: SearchParams) -> tuple[int, bool]:
+        """
+        Exact count if the planner expects a few matches, otherwise the planner estimate
+
+        :return: total and whether it is an estimate
+        """
+        estimate = self._repository.estimate_count(session, search_params)
+        if estimate > self._count_cache.EXACT_COUNT_LIMIT:
+            return estimate, True
+        return self._repository.count(session, search_params), False
+
+    def export(
+        self, export_format: export_formats, search_params: SearchParams
+    ) -> Iterator[bytes]:
+        """
+        Export all the molecules matching the search params, encoded in the given format.
+
+        This is a generator, the session stays open while it is consumed, rows are read from one server-side
+        cursor and encoded chunk by chunk, so the whole dataset is never held in memory.
+
+        :param export_format: csv, ndjson or parquet
+        :param search_params: same filters as find_all
+        :return: iterator of encoded bytes
+        """
+        with self._session_factory() as session:
+            partitions = self._repository.stream_all(
+                session, EXPORT_COLUMNS, search_params
+            )
+            yield from export_chunks(export_format, partitions)
 
     def delete(self, obj_id: int) -> bool:
         """
@@ -165,105 +244,193 @@ class MoleculeService:
                 raise UnknownIdentifierException(obj_id)
             ans = self._repository.delete(session, obj_id)
             session.commit()
+            self._invalidate_caches(molecule_tag(obj_id))
             return ans
 
+    def backfill_descriptors(self, chunk_size: int = 1000) -> int:
+        """
+        Compute the write pipeline columns, descriptors included, for molecules that were saved before
+        those columns existed. Molecules are processed chunk by chunk, every chunk is committed,
+        so the backfill can be stopped and started again, it continues where it stopped.
+
+        Binary molecule is used if it is stored, otherwise smiles is parsed.
+
+        :param chunk_size: molecules updated per transaction
+        :return: number of updated molecules
+        """
+        updated = 0
+        after_id = 0
+        while True:
+            with self._session_factory() as session:
+                rows = self._repository.find_without_descriptors(
+                    session, after_id, chunk_size
+                )
+                if not rows:
+                    return updated
+
+                data = []
+                for row in rows:
+                    try:
+                        mol = (
+                            Chem.Mol(row.mol_pickle)
+                            if row.mol_pickle
+                            else get_chem_molecule_from_smiles_or_raise_exception(
+                                row.smiles
+                            )
+                        )
+                    except InvalidSmilesException as e:
+                        logger.warning(
+                            f"Molecule {row.molecule_id} has invalid smiles {e.smiles}, skipped"
+                        )
+                        continue
+                    data.append(
+                        {
+                            "molecule_id": row.molecule_id,
+                            **self._write_pipeline.derive(mol),
+                        }
+                    )
+
+                updated += self._repository.bulk_update(session, data)
+                session.commit()
+                after_id = rows[-1].molecule_id
+            # descriptor filters match more molecules now, and masses of old rows are corrected
+            self._invalidate_caches(
+                *(molecule_tag(molecule["molecule_id"]) for molecule in data)
+            )
+
     def get_substructures(
-        self, smiles: str, limit: int = 1000
-    ) -> MoleculeCollectionResponse:
+        self, smiles: str, limit: int = 1000, selection: FieldSelection = None
+    ) -> dict:
         """
         Find all molecules that are substructures of the given smiles.
 
         :param limit:
         :param smiles: smiles string
-        :return: List of molecules that are substructures of the given smiles
+        :param selection: fields and links of the found molecules
+        :return: List of molecules that are substructures of the given smiles, a plain dict shaped like
+            MoleculeCollectionResponse
         :raises InvalidSmilesException: if the smiles does not represent a valid molecule
         """
 
-        mol = get_chem_molecule_from_smiles_or_raise_exception(smiles)
-
-        data = []
-        find_all = self.__iterate_on_find_all()
-        count = 0
-        for molecule in find_all:
-            if mol.HasSubstructMatch(get_chem_service().get_chem(molecule.smiles)):
-                data.append(mapper.model_to_response(molecule))
-                count += 1
-                if limit is not None and count >= limit:
-                    break
-
-        res = MoleculeCollectionResponse.model_validate(
-            {
-                "total": len(data),
-                "page": 0,
-                "page_size": limit,
-                "data": data,
-                "links": {},
-            }
+        with timed("chem"):
+            mol = get_chem_molecule_from_smiles_or_raise_exception(smiles)
+        chem_service = get_chem_service()
+        return self.__search(
+            "substructures",
+            lambda molecule, lookups: mol.HasSubstructMatch(
+                chem_service.get_chem(molecule.smiles, lookups)
+            ),
+            limit,
+            selection,
         )
 
-        return res
-
     def get_superstructures(
-        self, smiles: str, limit: int = 1000
-    ) -> MoleculeCollectionResponse:
+        self, smiles: str, limit: int = 1000, selection: FieldSelection = None
+    ) -> dict:
         """
         Find all the molecules that this molecule is a substructure of.
 
         :param limit: stop searching after finding this many molecules
         :param smiles:
-        :return:  List of molecules that this molecule is a substructure of.
+        :param selection: fields and links of the found molecules
+        :return:  List of molecules that this molecule is a substructure of, a plain dict shaped like
+            MoleculeCollectionResponse
         :raises InvalidSmilesException: if the smiles does not represent a valid molecule
         """
 
-        mol = get_chem_molecule_from_smiles_or_raise_exception(smiles)
-
-        data = []
+        with timed("chem"):
+            mol = get_chem_molecule_from_smiles_or_raise_exception(smiles)
+        chem_service = get_chem_service()
+        return self.__search(
+            "superstructures",
+            lambda molecule, lookups: chem_service.get_chem(
+                molecule.smiles, lookups
+            ).HasSubstructMatch(mol),
+            limit,
+            selection,
+        )
 
-        find_all = self.__iterate_on_find_all()
-        count = 0
+    def __search(
+        self,
+        search: str,
+        matches: Callable,
+        limit: Optional[int],
+        selection: Optional[FieldSelection],
+    ) -> dict:
+        """
+        Scan all the molecules and return the ones that match, used by the substructure searches.
 
-        for molecule in find_all:
-            if get_chem_service().get_chem(molecule.smiles).HasSubstructMatch(mol):
-                data.append(mapper.model_to_response(molecule))
-                count += 1
-                if limit is not None and count >= limit:
-                    break
+        Scanned rows, hits and duration are recorded in the search metrics, see src/metrics.py, ChemService
+        lookups are counted locally and recorded once per search too.
 
-        res = MoleculeCollectionResponse.model_validate(
-            {
-                "total": len(data),
-                "page": 0,
-                "page_size": limit,
-                "data": data,
-                "links": {},
-            }
-        )
+        :param search: name of the search in the metrics
+        :param matches: takes a molecule row and the ChemService lookups of the search, returns True if it is a hit
+        :param limit: stop searching after finding this many molecules
+        :param selection: fields and links of the hits, smiles is selected anyway, it is matched
+        """
+        selection = selection or FieldSelection()
 
-        return res
+        data = []
+        scanned = 0
+        # parsing and matching, reported as the chem phase, the rest is reading rows and mapping hits
+        matching = 0
+        lookups = Counter()
+        started = time.perf_counter()
+        try:
+            for molecule in self.__iterate_on_find_all(
+                columns=(*selection.columns, "smiles")
+            ):
+                scanned += 1
+                matching_started = time.perf_counter()
+                is_hit = matches(molecule, lookups)
+                matching += time.perf_counter() - matching_started
+                if is_hit:
+                    data.append(mapper.molecule_to_dict(molecule, selection))
+                    if limit is not None and len(data) >= limit:
+                        break
+        finally:
+            add_time("chem", matching)
+            SEARCH_DURATION.labels(search).observe(time.perf_counter() - started)
+            SEARCH_ROWS_SCANNED.labels(search).inc(scanned)
+            SEARCH_HITS.labels(search).inc(len(data))
+            get_chem_service().record_lookups(lookups)
+
+        return {
+            "total": len(data),
+            "total_is_estimate": False,
+            "page": 0,
+            "page_size": limit,
+            "data": data,
+            "links": {},
+        }
 
     def process_csv_file(self, file: UploadFile) -> int:
         """
-        Process a CSV file and add molecules to the database. The CSV file must have the following columns:
+        Process an uploaded file and add molecules to the database. CSV files must have the following columns:
 
         - smiles
         - name
 
+        SDF and SMILES files are supported as well, and any of them can be gzip or zstd compressed,
+        see src/molecules/readers.py. The file is parsed as a stream, row by row.
+
         Lines that have incorrect format, missing smiles string or invalid smiles string are ignored, and the valid
         molecules are added to the database.
 
         :return: Number of molecules added successfully
+        :raises UnsupportedFileFormatException: if the file format is not supported
+        :raises InvalidCsvHeaderColumnsException: if the CSV header misses the required columns
         """
 
-        csv_reader = csv.DictReader(io.TextIOWrapper(file.file, encoding="utf-8"))
-
-        self.__validate_csv_header_columns(set(csv_reader.fieldnames))
+        rows = read_molecule_rows(file.file, file.filename, self.required_columns)
 
         number_of_molecules_added = 0
 
-        for row in csv_reader:
+        for row in rows:
             try:
-                if not is_valid_smiles(row["smiles"]):
+                if not row["smiles"]:
                     raise InvalidSmilesException(row["smiles"])
+                # smiles is parsed once here, while validating the request, save reuses the parsed molecule
                 self.save(MoleculeRequest(smiles=row["smiles"], name=row["name"]))
                 number_of_molecules_added += 1
             except InvalidSmilesException as e:
@@ -283,43 +450,47 @@ class MoleculeService:
 
     def bulk_insert_from_file(self, file: UploadFile) -> int:
         """
-        Bulk insert molecules from a CSV file. Similar to process_csv_file, but no rows are
-        validated and there is no
+        Bulk insert molecules from an uploaded file. Similar to process_csv_file, supports the same formats,
+        but rows are inserted in chunks of 500 and duplicates are not checked one by one.
+
+        Every row still goes through the write pipeline, which parses the smiles once and computes the
+        stored columns, rows with smiles that can not be parsed are skipped.
 
         //TODO this method is written in a rush, I will test adn revise many things, but works
         :param file:
         :return:
         """
 
-        csv_reader = csv.DictReader(io.TextIOWrapper(file.file, encoding="utf-8"))
-        self.__validate_csv_header_columns(set(csv_reader.fieldnames))
+        rows = read_molecule_rows(file.file, file.filename, self.required_columns)
         molecules = []
         added_molecules = 0
-        for row in csv_reader:
-            molecules.append({"smiles": row["smiles"], "name": row["name"]})
+        for row in rows:
+            try:
+                molecules.append(
+                    self._write_pipeline.to_model_json(row["smiles"], row["name"])
+                )
+            except InvalidSmilesException as e:
+                logger.warning(
+                    f"Encountered invalid SMILES string: {e.smiles} in row: {row}"
+                )
+                continue
             if len(molecules) == 500:
                 with self._session_factory() as session:
                     res = self._repository.bulk_insert(session, molecules)
                     session.commit()
+                    self._invalidate_caches()
                     added_molecules += res
                     molecules = []
         with self._session_factory() as session:
             res = self._repository.bulk_insert(session, molecules)
             session.commit()
+            self._invalidate_caches()
             added_molecules += res
         return added_molecules
 
-    def __validate_csv_header_columns(self, columns: set[str]) -> None:
-        """
-        :param columns:
-        :return:
-        :raises InvalidCsvHeaderColumnsException:
-        """
-        missing_columns = self.required_columns - columns
-        if missing_columns:
-            raise InvalidCsvHeaderColumnsException(missing_columns)
-
-    def __iterate_on_find_all(self, page_size: int = 100) -> MoleculeResponse:
+    def __iterate_on_find_all(
+        self, page_size: int = 100, columns: Sequence[str] = None
+    ) -> Iterator:
         """
         This is a helper method that will be used in substructure search methods, or other search methods implemented
         int the future.
@@ -331,23 +502,55 @@ class MoleculeService:
         relevant when planning for performance. At this point, I thought it would
         be too much if I move it to the settings or some global attribute.
 
+        Chunks are fetched by molecule_id keyset, so late chunks are as cheap as the first one.
+
         :param page_size: Number of items to fetch at a time, default is 100
+        :param columns: names of the columns to select, see MoleculeRepository.find_all
         """
 
         with self._session_factory() as session:
-            page = 0
+            cursor = None
             while True:
                 chunk = self._repository.find_all(
                     session=session,
-                    page=page,
                     page_size=page_size,
                     search_params=get_search_params(),
+                    cursor=cursor,
+                    columns=columns,
                 )
                 if not chunk:
                     break
                 for molecule in chunk:
                     yield molecule
-                page += 1
+                cursor = {"id": chunk[-1].molecule_id}
+
+
+def _collection_response(
+    molecules,
+    page: int,
+    page_size: int,
+    search_params: SearchParams,
+    total: int,
+    total_is_estimate: bool,
+    selection: Optional[FieldSelection],
+) -> dict:
+    """
+    Full page means there might be more rows, so the next_page link gets the cursor of the last row
+    """
+    next_cursor = None
+    if molecules and len(molecules) == page_size:
+        next_cursor = encode_cursor(search_params, molecules[-1])
+
+    return mapper.models_to_collection_dict(
+        molecules,
+        page,
+        page_size,
+        search_params,
+        next_cursor,
+        total,
+        total_is_estimate,
+        selection,
+    )
 
 
 @lru_cache
@@ -356,3 +559,171 @@ def get_molecule_service(
     session_factory: Annotated[sessionmaker, Depends(get_session_factory)],
 ):
     return MoleculeService(repository, session_factory)
+
+
+class AsyncMoleculeService:
+    """
+    Async variant of the CRUD methods of MoleculeService, used by the async request handlers.
+
+    Searches, uploads and exports are CPU bound or streamed, they stay in MoleculeService and run in the threadpool.
+    """
+
+    def __init__(
+        self,
+        repository: AsyncMoleculeRepository,
+        session_factory: async_sessionmaker,
+        write_pipeline: MoleculeWritePipeline = None,
+        count_cache: MoleculeCountCache = None,
+    ):
+        self._repository = repository
+        self._session_factory = session_factory
+        self._write_pipeline = write_pipeline or get_molecule_write_pipeline()
+        self._count_cache = count_cache or get_molecule_count_cache()
+
+    async def find_by_id(self, obj_id: int, selection: FieldSelection = None) -> dict:
+        """
+        Same as MoleculeService.find_by_id
+
+        :raises UnknownIdentifierException: if the molecule with the given id does not exist
+        """
+        selection = selection or FieldSelection()
+
+        async with self._session_factory() as session:
+            mol = await self._repository.find_row_by_id(
+                session, obj_id, selection.columns
+            )
+            if mol is None:
+                raise UnknownIdentifierException(obj_id)
+            return mapper.molecule_to_dict(mol, selection)
+
+    async def _invalidate_caches(self, *tags: str) -> None:
+        """
+        Called after a committed write, invalidates the cached totals and the cached responses
+        of the molecules collection and of the given tags
+        """
+        await self._count_cache.invalidate_async()
+        await invalidate_cache_tags_async(MOLECULES_TAG, *tags)
+
+    async def save(self, molecule_request: MoleculeRequest) -> MoleculeResponse:
+        """
+        Same as MoleculeService.save
+
+        :param molecule_request: Molecule data
+        :return: Saved molecule
+        :raises DuplicateSmilesException: if the smiles is not unique
+        """
+        async with self._session_factory() as session:
+            try:
+                mol_json = self._write_pipeline.to_model_json(
+                    molecule_request.smiles,
+                    molecule_request.name,
+                    molecule_request.mol,
+                )
+                mol = await self._repository.save(session, mol_json)
+                await session.flush()
+                await session.commit()
+                await self._invalidate_caches()
+            except IntegrityError as e:
+                await session.rollback()
+                if "unique constraint" in str(e).lower():
+                    raise DuplicateSmilesException(molecule_request.smiles) from e
+                raise e
+            # created_at and updated_at are generated by the database, they have to be loaded explicitly
+            await session.refresh(mol)
+            return mapper.model_to_response(mol)
+
+    async def update(
+        self, obj_id: int, molecule_request: MoleculeUpdateRequest
+    ) -> MoleculeResponse:
+        """
+        :param obj_id: Identifier of the molecule to be updated
+        :param molecule_request: New data for the molecule
+        :return: Updated molecule
+        :raises UnknownIdentifierException: if the molecule with the given id does not exist
+        """
+        async with self._session_factory() as session:
+            mol = await self._repository.find_by_id(obj_id, session)
+            if mol is None:
+                raise UnknownIdentifierException(obj_id)
+
+            mol.name = molecule_request.name
+            await session.commit()
+            await self._invalidate_caches(molecule_tag(obj_id))
+            await session.refresh(mol)
+            return mapper.model_to_response(mol)
+
+    async def find_all(
+        self,
+        page: int = 0,
+        page_size: int = 1000,
+        search_params: SearchParams = None,
+        cursor: Optional[str] = None,
+        selection: FieldSelection = None,
+    ) -> dict:
+        """
+        Same as MoleculeService.find_all
+
+        :param search_params: Search parameters
+        :param page: Zero indexed page number, default is 0
+        :param page_size: Items per page, default is 1000
+        :param cursor: opaque cursor from the next_page link of the previous page
+        :param selection: fields and links of the molecules
+        """
+        search_params = search_params or get_search_params()
+        decoded_cursor = decode_cursor(search_params, cursor)
+
+        async with self._session_factory() as session:
+            molecules = await self._repository.find_all(
+                session,
+                page,
+                page_size,
+                search_params,
+                decoded_cursor,
+                selection.columns if selection else None,
+            )
+
+            key = await self._count_cache.key_async(search_params)
+            cached_total = await self._count_cache.get_async(key)
+            if cached_total is None:
+                total, is_estimate = await self._count(session, search_params)
+                await self._count_cache.set_async(key, total, is_estimate)
+            else:
+                total, is_estimate = cached_total
+
+            return _collection_response(
+                molecules, page, page_size, search_params, total, is_estimate, selection
+            )
+
+    async def _count(self, session, search_params: SearchParams) -> tuple[int, bool]:
+        """
+        Same as MoleculeService._count
+        """
+        estimate = await self._repository.estimate_count(session, search_params)
+        if estimate > self._count_cache.EXACT_COUNT_LIMIT:
+            return estimate, True
+        return await self._repository.count(session, search_params), False
+
+    async def delete(self, obj_id: int) -> bool:
+        """
+        :param obj_id: Identifier of the molecule to be deleted
+        :return: True
+        :raises UnknownIdentifierException: if the molecule with the given id does not exist
+        """
+        async with self._session_factory() as session:
+            mol = await self._repository.find_by_id(obj_id, session)
+            if mol is None:
+                raise UnknownIdentifierException(obj_id)
+            ans = await self._repository.delete(session, obj_id)
+            await session.commit()
+            await self._invalidate_caches(molecule_tag(obj_id))
+            return ans
+
+
+@lru_cache
+def get_async_molecule_service(
+    repository: Annotated[
+        AsyncMoleculeRepository, Depends(get_async_molecule_repository)
+    ],
+    session_factory: Annotated[async_sessionmaker, Depends(get_async_session_factory)],
+):
+    return AsyncMoleculeService(repository, session_factory)
@@ -0,0 +1,113 @@
+"""
+Benchmark of the cache codecs, size and encode/decode time of cached GET /molecules pages.
+
+Pages are read from the database with MoleculeRepository.find_all and serialized the way the endpoint does,
+then wrapped the way CachingMiddleware stores them. Every codec is measured on the same entries,
+with --redis the entries are also written to redis and MEMORY USAGE is reported. Run it against
+a development database and redis, for example:
+
+    ENVIRONMENT=DEV python -m src.molecules.tests.benchmarks.cache_codecs --page-sizes 10 100 1000 --redis
+"""
+
+import argparse
+import statistics
+import time
+from typing import Optional
+
+import msgpack
+from redis.exceptions import ResponseError
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from src.cache_codecs import RawCodec, SizeTieredCodec, ZstdCodec
+from src.config import get_settings
+from src.middleware import encode_cached_response
+from src.molecules.mapper import models_to_collection_response
+from src.molecules.repository import MoleculeRepository
+from src.molecules.schema import get_search_params
+from src.redis_client import get_redis_client
+
+CODECS = {
+    "raw": RawCodec(),
+    "zstd-1": ZstdCodec(level=1),
+    "zstd-3": ZstdCodec(level=3),
+    "zstd-9": ZstdCodec(level=9),
+}
+
+
+def read_page(session_factory, page_size: int) -> tuple[bytes, dict]:
+    """
+    :return: the cached entry of the first page and the response as a dict
+    """
+    search_params = get_search_params()
+    with session_factory() as session:
+        molecules = MoleculeRepository().find_all(session, 0, page_size, search_params)
+    response = models_to_collection_response(molecules, 0, page_size, search_params)
+    body = response.model_dump_json().encode()
+    entry = encode_cached_response(200, [(b"content-type", b"application/json")], body)
+    return entry, response.model_dump(mode="json")
+
+
+def measure(function, value, repeat: int) -> float:
+    """
+    :return: median microseconds of one call
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(value)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return statistics.median(timings)
+
+
+def redis_memory_usage(redis_client, key: str, value: bytes) -> Optional[int]:
+    """
+    :return: bytes used by the key in redis, None if the server does not support MEMORY USAGE
+    """
+    redis_client.set(key, value, ex=60)
+    try:
+        return redis_client.memory_usage(key)
+    except ResponseError:
+        return None
+    finally:
+        redis_client.delete(key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--redis", action="store_true")
+    args = parser.parse_args()
+
+    session_factory = sessionmaker(bind=create_engine(get_settings().database_url))
+    redis_client = get_redis_client() if args.redis else None
+
+    for page_size in args.page_sizes:
+        entry, response = read_page(session_factory, page_size)
+        print(f"page size {page_size}: {len(entry)} bytes")
+
+        # msgpack of the response dict, for comparison with the serialized JSON
+        packed = msgpack.packb(response)
+        print(f"  {'msgpack':8} {len(packed):>9} bytes")
+
+        for name, codec in CODECS.items():
+            encoded = codec.encode(entry)
+            line = (
+                f"  {name:8} {len(encoded):>9} bytes {len(entry) / len(encoded):5.1f}x"
+                f"  encode {measure(codec.encode, entry, args.repeat):8.1f}us"
+                f"  decode {measure(codec.decode, encoded, args.repeat):8.1f}us"
+            )
+            if redis_client is not None:
+                usage = redis_memory_usage(
+                    redis_client, f"benchmark:{name}", codec.tag + encoded
+                )
+                line += f"  redis {usage if usage is not None else 'n/a'} bytes"
+            print(line)
+
+        chosen = SizeTieredCodec().encode(entry)[:1]
+        print(f"  stored by SizeTieredCodec as {chosen.decode()}")
+
+
+if __name__ == "__main__":
+    main()
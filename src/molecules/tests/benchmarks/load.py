@@ -0,0 +1,391 @@
+"""
+Load test of the web tier, sustainable requests per second with and without the response cache.
+
+Every worker is an async HTTP client that sends one request after another, --concurrency workers run for
+--duration seconds, every request picks an operation of the mix at random, weighted like WORKLOAD_MIX:
+
+- list: a page of GET /molecules, random page size and order
+- detail: GET /molecules/{molecule_id} of a random existing molecule
+- name_search: GET /molecules with the name of a random molecule, one character dropped
+- upload: POST /molecules/upload/ of a small CSV with new molecules
+- search_task: substructure search task, then GET /tasks/{task_id} every --poll-interval until it is done
+
+The search task is reported as search_submit and task_poll requests, and search_task_completed, the time until
+the result was there. The report has requests per second, latency percentiles and error rate of every operation,
+responses with status 400 and above, timeouts, failed tasks and uploads that did not add every molecule are errors.
+
+The same mix runs with the cache against --base-url, and without it against --uncached-base-url if given,
+a server started with RESPONSE_CACHE_ENABLED=false, it has no CachingMiddleware, nothing is read from or written to
+the response cache. Cached responses carry an ETag, the harness checks that every server is in its mode first.
+
+Molecule ids and names are read from the API before the run, the database should not be empty, the nginx of
+docker-compose.yml listens on port 80, its web_uncached service of the benchmark profile on 8001, for example:
+
+    docker compose --profile benchmark up -d
+    python -m src.molecules.tests.benchmarks.load --base-url http://localhost \\
+        --uncached-base-url http://localhost:8001 --concurrency 64 --duration 60 \\
+        --mix list=40 detail=30 name_search=15 search_task=10 upload=5 --output load.json
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Callable, Optional
+
+import httpx
+
+from src.molecules.tests.drug_like import generate_drug_like_molecules
+
+WORKLOAD_MIX = {
+    "list": 40,
+    "detail": 30,
+    "name_search": 15,
+    "search_task": 10,
+    "upload": 5,
+}
+
+SEARCH_QUERIES = [
+    "CC(=O)Nc1ccc(O)cc1",
+    "CN1CCN(CC1)c1ccc(cc1)C(=O)Nc1ccccc1",
+    "CC(C)Cc1ccc(cc1)C(C)C(=O)O",
+]
+UPLOAD_SIZE = 10
+# small generated molecules repeat between seeds, a third of them is already in a catalog of 200k molecules,
+# uploads take the longer SMILES strings only, they are practically never generated twice
+UPLOAD_MIN_SMILES_LENGTH = 50
+TASK_TIMEOUT_SECONDS = 60
+
+
+class Recorder:
+    """
+    Latencies and errors of every operation
+    """
+
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    def record(self, operation: str, seconds: float, is_error: bool) -> None:
+        self.latencies[operation].append(seconds * 1000)
+        if is_error:
+            self.errors[operation] += 1
+
+    async def request(
+        self,
+        operation: str,
+        client: httpx.AsyncClient,
+        method: str,
+        url: str,
+        is_error: Callable[[httpx.Response], bool] = None,
+        **kwargs,
+    ) -> Optional[httpx.Response]:
+        """
+        :param is_error: tells if the response is an error, by default responses with status 400 and above are
+        :return: the response, None if the request failed without one
+        """
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.record(operation, time.perf_counter() - started, True)
+            return None
+        elapsed = time.perf_counter() - started
+        self.record(
+            operation,
+            elapsed,
+            response.status_code >= 400
+            or (is_error is not None and is_error(response)),
+        )
+        return response
+
+    def report(self, duration: float) -> dict[str, dict]:
+        report = {}
+        everything = []
+        for operation in sorted(self.latencies):
+            latencies = self.latencies[operation]
+            everything.extend(latencies)
+            report[operation] = summarize(latencies, self.errors[operation], duration)
+        report["total"] = summarize(everything, sum(self.errors.values()), duration)
+        return report
+
+
+def percentile(latencies: list[float], fraction: float) -> float:
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def summarize(latencies: list[float], errors: int, duration: float) -> dict:
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"requests": 0, "errors": 0}
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": errors / len(latencies),
+        "rps": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": latencies[-1],
+    }
+
+
+class Workload:
+    """
+    Operations of the mix, every one of them sends its requests through the recorder
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        recorder: Recorder,
+        molecules: list[dict],
+        rng: random.Random,
+        poll_interval: float,
+        upload_seed: int,
+    ):
+        """
+        :param rng: picks the operations and their parameters, the same seed gives the same requests in every mode
+        :param upload_seed: seed of the uploaded molecules, it has to differ between the runs,
+            molecules uploaded again are duplicates, nothing would be written
+        """
+        self.client = client
+        self.recorder = recorder
+        self.molecules = molecules
+        self.rng = rng
+        self.poll_interval = poll_interval
+        self.new_molecules = (
+            molecule
+            for molecule in generate_drug_like_molecules(upload_seed)
+            if len(molecule[0]) >= UPLOAD_MIN_SMILES_LENGTH
+        )
+
+    async def get(self, operation: str, url: str, **params) -> Optional[httpx.Response]:
+        return await self.recorder.request(
+            operation, self.client, "GET", url, params=params
+        )
+
+    async def list(self) -> None:
+        params = {
+            "page": self.rng.randrange(5),
+            "pageSize": self.rng.choice([10, 20, 50]),
+        }
+        if self.rng.random() < 0.3:
+            params.update(orderBy="mass", order=self.rng.choice(["asc", "desc"]))
+        await self.get("list", "/molecules/", **params)
+
+    async def detail(self) -> None:
+        molecule = self.rng.choice(self.molecules)
+        await self.get("detail", f"/molecules/{molecule['molecule_id']}")
+
+    async def name_search(self) -> None:
+        name = self.rng.choice(self.molecules)["name"]
+        if len(name) > 3:
+            position = self.rng.randrange(len(name))
+            name = name[:position] + name[position:][1:]
+        await self.get("name_search", "/molecules/", name=name, pageSize=20)
+
+    async def upload(self) -> None:
+        file = io.StringIO()
+        writer = csv.writer(file)
+        writer.writerow(["smiles", "name"])
+        for _ in range(UPLOAD_SIZE):
+            writer.writerow(next(self.new_molecules))
+        await self.recorder.request(
+            "upload",
+            self.client,
+            "POST",
+            "/molecules/upload/",
+            # duplicates and invalid rows are skipped, the response is 201 even if nothing was added
+            is_error=lambda response: response.json()["number_of_molecules_added"]
+            < UPLOAD_SIZE,
+            files={"file": ("molecules.csv", file.getvalue(), "text/csv")},
+        )
+
+    async def search_task(self) -> None:
+        started = time.perf_counter()
+        response = await self.get(
+            "search_submit",
+            "/molecules/search/substructures/",
+            smiles=self.rng.choice(SEARCH_QUERIES),
+            limit=100,
+        )
+        if response is None or response.status_code >= 400:
+            return
+
+        task_id = response.json()["task_id"]
+        status = None
+        while time.perf_counter() - started < TASK_TIMEOUT_SECONDS:
+            await asyncio.sleep(self.poll_interval)
+            response = await self.recorder.request(
+                "task_poll", self.client, "GET", f"/tasks/{task_id}"
+            )
+            if response is not None and response.status_code == 200:
+                status = response.json()["status"]
+                if status in ("SUCCESS", "FAILURE"):
+                    break
+        self.recorder.record(
+            "search_task_completed", time.perf_counter() - started, status != "SUCCESS"
+        )
+
+
+async def worker(workload: Workload, mix: dict[str, int], deadline: float) -> None:
+    operations, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        operation = workload.rng.choices(operations, weights)[0]
+        await getattr(workload, operation)()
+
+
+async def read_molecules(client: httpx.AsyncClient) -> list[dict]:
+    response = await client.get(
+        "/molecules/",
+        params={"pageSize": 1000, "fields": "molecule_id,name", "links": "false"},
+    )
+    response.raise_for_status()
+    return response.json()["data"]
+
+
+async def check_cache_mode(client: httpx.AsyncClient, cache: bool) -> None:
+    """
+    Responses of CachingMiddleware carry an ETag, misses too, a server in the other mode would measure that one
+    """
+    response = await client.get("/molecules/", params={"pageSize": 1})
+    response.raise_for_status()
+    if ("etag" in response.headers) != cache:
+        raise SystemExit(
+            f"the response cache of {client.base_url} is {'off' if cache else 'on'}, "
+            f"expected it {'on' if cache else 'off'}, see RESPONSE_CACHE_ENABLED"
+        )
+
+
+async def run(args, base_url: str, cache: bool) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=args.timeout
+    ) as client:
+        await check_cache_mode(client, cache)
+        molecules = await read_molecules(client)
+        if not molecules:
+            raise SystemExit(
+                "there are no molecules to request, populate the database first"
+            )
+
+        # molecules uploaded by the earlier runs, or by the other mode, must not be uploaded again
+        upload_nonce = random.SystemRandom().randrange(2**32)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(
+            *(
+                worker(
+                    Workload(
+                        client,
+                        recorder,
+                        molecules,
+                        random.Random(args.seed + i),
+                        args.poll_interval,
+                        upload_seed=upload_nonce + i,
+                    ),
+                    args.mix,
+                    deadline,
+                )
+                for i in range(args.concurrency)
+            )
+        )
+        return recorder.report(time.perf_counter() - started)
+
+
+def print_report(mode: str, report: dict[str, dict]) -> None:
+    print(f"cache {mode}")
+    print(
+        f"  {'operation':<22} {'requests':>9} {'rps':>8} {'errors':>7} "
+        f"{'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+    )
+    for operation, summary in report.items():
+        if not summary["requests"]:
+            continue
+        print(
+            f"  {operation:<22} {summary['requests']:>9} {summary['rps']:>8.1f} "
+            f"{summary['error_rate']:>7.1%} {summary['p50_ms']:>6.1f}ms {summary['p95_ms']:>6.1f}ms "
+            f"{summary['p99_ms']:>6.1f}ms {summary['max_ms']:>6.1f}ms"
+        )
+
+
+def mix_entry(value: str) -> tuple[str, int]:
+    """
+    Type of the --mix values, argparse reports the errors as usage errors
+
+    :return: operation and its weight
+    """
+    operation, _, weight = value.partition("=")
+    if operation not in WORKLOAD_MIX:
+        raise argparse.ArgumentTypeError(
+            f"unknown operation {operation}, one of {', '.join(WORKLOAD_MIX)}"
+        )
+    if not weight.isdigit():
+        raise argparse.ArgumentTypeError(
+            f"weight of {operation} must be a non-negative integer, got {weight!r}"
+        )
+    return operation, int(weight)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--base-url", default="http://localhost", help="server with the response cache"
+    )
+    parser.add_argument(
+        "--uncached-base-url",
+        help="server with RESPONSE_CACHE_ENABLED=false, the mix runs without the cache there too",
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds of every run"
+    )
+    parser.add_argument(
+        "--mix",
+        nargs="+",
+        type=mix_entry,
+        default=list(WORKLOAD_MIX.items()),
+        help="operation=weight pairs",
+    )
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="seconds of one request"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the reports as JSON")
+    args = parser.parse_args()
+    args.mix = dict(args.mix)
+    if not any(args.mix.values()):
+        parser.error("at least one operation of --mix needs a positive weight")
+
+    base_urls = {"on": args.base_url}
+    if args.uncached_base_url:
+        base_urls["off"] = args.uncached_base_url
+    reports = {}
+    for mode, base_url in base_urls.items():
+        reports[mode] = asyncio.run(run(args, base_url, cache=mode == "on"))
+        print_report(mode, reports[mode])
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "base_urls": base_urls,
+                    "concurrency": args.concurrency,
+                    "duration": args.duration,
+                    "mix": args.mix,
+                    "reports": reports,
+                },
+                file,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
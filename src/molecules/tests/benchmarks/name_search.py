@@ -0,0 +1,147 @@
+"""
+Benchmark of the fuzzy name search of GET /molecules, GiST trigram index against GIN trigram index.
+
+GiST index can return rows ordered by the distance operator (name <-> :name), so the top page
+is read from the index and the scan stops there. GIN index only answers name % :name, every match is
+fetched and sorted by distance, which gets slow when a short or common name matches many rows.
+
+The script drops molecules_name_pg_trgm_idx and builds it again with every index type, it leaves a GiST index
+behind, like the migration does. Run it against a development database only, for example:
+
+    ENVIRONMENT=DEV python -m src.molecules.tests.benchmarks.name_search --queries 200 --threshold 0.3
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from src.config import get_settings
+from src.molecules.repository import MoleculeRepository, _find_all_statement
+from src.molecules.schema import get_search_params
+from src.repository import Explain
+
+INDEX_NAME = "molecules_name_pg_trgm_idx"
+
+INDEX_DEFINITIONS = {
+    "gist": f"CREATE INDEX {INDEX_NAME} ON molecules USING gist (name gist_trgm_ops);",
+    "gin": f"CREATE INDEX {INDEX_NAME} ON molecules USING gin (name gin_trgm_ops);",
+}
+
+
+def sample_query_names(session, n: int) -> list[str]:
+    """
+    Names of random molecules with a typo, searches should find the molecule and its lookalikes
+    """
+    names = session.execute(
+        text(
+            "SELECT name FROM molecules TABLESAMPLE SYSTEM (1) WHERE name IS NOT NULL LIMIT :n"
+        ),
+        {"n": n},
+    ).scalars()
+    queries = []
+    for name in names:
+        if len(name) > 3:
+            # one character is dropped
+            position = random.randrange(len(name))
+            name = name[:position] + name[position:][1:]
+        queries.append(name)
+    return queries
+
+
+def rebuild_index(engine, index_type: str) -> None:
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME};"))
+        started = time.perf_counter()
+        conn.execute(text(INDEX_DEFINITIONS[index_type]))
+        print(f"{index_type}: index built in {time.perf_counter() - started:.1f}s")
+        conn.execute(text("ANALYZE molecules;"))
+
+
+def run_queries(
+    session_factory, queries: list[str], page_size: int, threshold
+) -> list[float]:
+    """
+    Runs every query through MoleculeRepository.find_all, the way GET /molecules does
+
+    :return: milliseconds of every query
+    """
+    repository = MoleculeRepository()
+    timings = []
+    for name in queries:
+        search_params = get_search_params(name=name, similarityThreshold=threshold)
+        with session_factory() as session:
+            started = time.perf_counter()
+            repository.find_all(session, 0, page_size, search_params)
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def print_plan(session_factory, name: str, page_size: int, threshold) -> None:
+    search_params = get_search_params(name=name, similarityThreshold=threshold)
+    with session_factory() as session:
+        if threshold is not None:
+            session.execute(
+                text("SELECT set_config('pg_trgm.similarity_threshold', :t, true)"),
+                {"t": str(threshold)},
+            )
+        plan = session.execute(
+            Explain(_find_all_statement(0, page_size, search_params))
+        ).scalar_one()
+    node, nodes = plan[0]["Plan"], []
+    while node is not None:
+        nodes.append(node["Node Type"])
+        node = node.get("Plans", [None])[0]
+    print(f"  plan: {' -> '.join(nodes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument("--index", choices=["gist", "gin", "both"], default="both")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    engine = create_engine(get_settings().database_url)
+    session_factory = sessionmaker(bind=engine)
+
+    with session_factory() as session:
+        rows = session.execute(text("SELECT count(*) FROM molecules")).scalar_one()
+        queries = sample_query_names(session, args.queries)
+    print(f"{rows} molecules, {len(queries)} queries, page size {args.page_size}")
+
+    index_types = ["gist", "gin"] if args.index == "both" else [args.index]
+    # GiST goes last, so the database is left with the index the application expects
+    index_types.sort(key=lambda index_type: index_type == "gist")
+
+    current_index_type = None
+    try:
+        for index_type in index_types:
+            rebuild_index(engine, index_type)
+            if queries:
+                print_plan(session_factory, queries[0], args.page_size, args.threshold)
+            # first round warms up the buffer cache
+            run_queries(session_factory, queries, args.page_size, args.threshold)
+            timings = sorted(
+                run_queries(session_factory, queries, args.page_size, args.threshold)
+            )
+            if timings:
+                p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+                print(
+                    f"  median {statistics.median(timings):.2f}ms, "
+                    f"p95 {p95:.2f}ms, max {timings[-1]:.2f}ms"
+                )
+            current_index_type = index_type
+    finally:
+        if current_index_type != "gist":
+            rebuild_index(engine, "gist")
+
+
+if __name__ == "__main__":
+    main()
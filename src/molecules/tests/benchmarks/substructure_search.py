@@ -0,0 +1,266 @@
+"""
+Benchmark of the substructure searches at catalog scale, MoleculeService.get_substructures and get_superstructures.
+
+The molecules table is emptied and filled with generated drug-like molecules up to every catalog size in turn,
+10k, 100k, 1M and 5M by default, the catalog grows from one size to the next, so the biggest one is inserted once.
+Molecules are generated from the seed, every run searches the same catalogs. The row count is checked after every
+size step, the benchmark stops if the catalog is not complete. Every query of QUERY_PANEL scans the whole catalog,
+unless --limit stops it earlier, it is run once to warm up, then --repeat times, and the report has:
+
+- throughput: scanned molecules per second at the median latency, the rows the search actually scanned
+- p50 and p95 latency in milliseconds
+- hits and selectivity, the share of the scanned molecules that matched
+- peak RSS of the process so far in megabytes
+
+Catalogs bigger than the ChemService cache parse the smiles of every scanned row again, expect a drop of
+the throughput there.
+
+Results are written as JSON to --output, with --compare the p50 latencies are compared to the results of an earlier
+run and the script exits with 1 if any of them got slower by more than --tolerance. Run it against a development
+database only, the molecules are deleted, for example:
+
+    ENVIRONMENT=DEV python -m src.molecules.tests.benchmarks.substructure_search --sizes 10000 100000 \\
+        --output substructure_search.json --compare previous.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterator, Optional
+
+import rdkit
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from src.config import get_settings
+from src.molecules.pipeline import get_molecule_write_pipeline
+from src.molecules.repository import MoleculeRepository
+from src.molecules.service import MoleculeService
+from src.molecules.tests.drug_like import generate_drug_like_molecules
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+
+# search, smiles, expected selectivity, low selectivity queries match a big share of the catalog,
+# shares in the comments were measured on the first 20k molecules of seed 42, see src/molecules/tests/drug_like.py
+QUERY_PANEL = [
+    ("superstructures", "c1ccccc1", "low"),  # benzene, 73%
+    ("superstructures", "C(=O)N", "low"),  # amide, 47%
+    ("superstructures", "c1ccc2[nH]ccc2c1", "high"),  # indole, 11%
+    ("superstructures", "FC(F)(F)c1ccccc1", "high"),  # 2%
+    ("substructures", "CC(=O)Nc1ccc(O)cc1", "high"),  # paracetamol, 0.04%
+    (
+        "substructures",
+        "Cc1ccc(NC(=O)c2ccc(CN3CCN(C)CC3)cc2)cc1Nc1nccc(-c2cccnc2)n1",
+        "high",
+    ),  # imatinib, 0.2%
+]
+
+INSERT_CHUNK_SIZE = 10_000
+
+
+def _to_row(molecule: tuple[str, str]) -> dict:
+    return get_molecule_write_pipeline().to_model_json(*molecule)
+
+
+def grow_catalog(
+    session_factory, molecules: Iterator[tuple[str, str]], amount: int, pool
+) -> None:
+    """
+    Insert the next amount molecules, the rows are computed by the write pipeline in the worker processes
+    """
+    repository = MoleculeRepository()
+    inserted = 0
+    while inserted < amount:
+        chunk = list(islice(molecules, min(INSERT_CHUNK_SIZE, amount - inserted)))
+        rows = pool.map(_to_row, chunk, chunksize=500)
+        with session_factory() as session:
+            repository.bulk_insert(session, rows)
+            session.commit()
+        inserted += len(rows)
+        print(f"  inserted {inserted}/{amount}", end="\r", flush=True)
+    print()
+
+
+def percentile(timings: list[float], fraction: float) -> float:
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def peak_rss_megabytes() -> float:
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def rows_scanned(search: str) -> float:
+    return (
+        REGISTRY.get_sample_value(
+            "molecule_search_rows_scanned_total", {"search": search}
+        )
+        or 0
+    )
+
+
+def run_query(
+    service: MoleculeService,
+    search: str,
+    smiles: str,
+    repeat: int,
+    limit: Optional[int],
+) -> tuple[list[float], int, int]:
+    """
+    :return: milliseconds of every run after the warm up, the number of hits and of the scanned rows,
+        every run scans the same rows
+    """
+    method = (
+        service.get_substructures
+        if search == "substructures"
+        else service.get_superstructures
+    )
+    scanned = rows_scanned(search)
+    hits = method(smiles, limit)["total"]
+    scanned = int(rows_scanned(search) - scanned)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        method(smiles, limit)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings, hits, scanned
+
+
+def get_version() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> bool:
+    """
+    Print the p50 change of every measurement that is in the baseline too
+
+    :return: True if none of them got slower by more than tolerance
+    """
+    with open(baseline_path) as file:
+        baseline = {
+            (result["catalog_size"], result["search"], result["smiles"]): result
+            for result in json.load(file)["results"]
+        }
+    passed = True
+    for result in results:
+        previous = baseline.get(
+            (result["catalog_size"], result["search"], result["smiles"])
+        )
+        if previous is None:
+            continue
+        change = result["p50_ms"] / previous["p50_ms"] - 1
+        regressed = change > tolerance
+        passed = passed and not regressed
+        print(
+            f"{result['catalog_size']:>9} {result['search']:<15} {result['smiles']:<24} "
+            f"p50 {previous['p50_ms']:.1f}ms -> {result['p50_ms']:.1f}ms ({change:+.0%})"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--limit", type=int, default=None, help="stop a search after this many hits"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--output", default="substructure_search.json")
+    parser.add_argument("--compare", help="results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    engine = create_engine(get_settings().database_url)
+    session_factory = sessionmaker(bind=engine)
+    service = MoleculeService(MoleculeRepository(), session_factory)
+
+    with engine.begin() as conn:
+        conn.execute(text("TRUNCATE molecules RESTART IDENTITY CASCADE;"))
+
+    molecules = generate_drug_like_molecules(args.seed)
+    results = []
+    catalog_size = 0
+    with multiprocessing.Pool(args.workers) as pool:
+        for size in sorted(args.sizes):
+            print(f"catalog of {size} molecules")
+            grow_catalog(session_factory, molecules, size - catalog_size, pool)
+            catalog_size = size
+            with engine.begin() as conn:
+                # bulk_insert logs a failed chunk and goes on, the catalog would be smaller than reported
+                count = conn.execute(text("SELECT count(*) FROM molecules;")).scalar()
+                if count != size:
+                    sys.exit(
+                        f"the catalog has {count} molecules instead of {size}, inserting failed, see the log"
+                    )
+                conn.execute(text("ANALYZE molecules;"))
+
+            for search, smiles, selectivity in QUERY_PANEL:
+                timings, hits, scanned = run_query(
+                    service, search, smiles, args.repeat, args.limit
+                )
+                p50 = statistics.median(timings)
+                result = {
+                    "catalog_size": size,
+                    "search": search,
+                    "smiles": smiles,
+                    "expected_selectivity": selectivity,
+                    "hits": hits,
+                    "scanned": scanned,
+                    "selectivity": hits / scanned,
+                    "p50_ms": p50,
+                    "p95_ms": percentile(timings, 0.95),
+                    "throughput": scanned / (p50 / 1000),
+                    "peak_rss_mb": peak_rss_megabytes(),
+                }
+                results.append(result)
+                print(
+                    f"  {search:<15} {smiles:<24} {hits:>8} hits of {scanned}, p50 {p50:.1f}ms, "
+                    f"p95 {result['p95_ms']:.1f}ms, {result['throughput']:.0f} molecules/s, "
+                    f"peak RSS {result['peak_rss_mb']:.0f}MB"
+                )
+
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "version": get_version(),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "rdkit": rdkit.__version__,
+                "seed": args.seed,
+                "repeat": args.repeat,
+                "limit": args.limit,
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+    print(f"results written to {args.output}")
+
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Seeded generator of drug-like molecules and of drugs composed of them, test data for the benchmarks.
+
+Molecules are assembled from fragments as SMILES strings, without RDKit, so millions of them are generated in
+seconds. A molecule is one to four ring systems, aromatic, heteroaromatic, saturated and fused ones, joined
+by linkers like amides, ethers and sulfonamides, with functional groups on the free positions. Sizes are roughly
+the ones of real drugs, most molecules weigh 200 to 500 g/mol, and different queries match very different
+shares of them, unlike the alkanes of generate_large_csv_file, which all match C.
+
+The same seed generates the same molecules in the same order. Every SMILES string is generated once, but the same
+molecule written in a different way can repeat, the smiles column is unique, the canonical one is not.
+
+Molecules are written as CSV, SMILES or SD file, by the extension, optionally gzip or zstd compressed, every format
+POST /molecules/upload/ reads. Drugs are written as drugs.csv and drug_molecule.csv, with the columns of the tables,
+molecule ids are the line numbers of the molecules file, as they are after uploading it to an empty table.
+The files are copied with the column lists, the order of the table columns may differ, and the drug ids are given,
+so the sequence of drugs.drug_id is moved past them afterwards, the drugs created through the API would collide
+with them otherwise. For example:
+
+    python -m src.molecules.tests.drug_like --molecules 1000000 --drugs 10000 --output molecules.csv.zst
+    curl -F file=@molecules.csv.zst "http://localhost/molecules/upload/?validate_rows=false"
+    psql -c "\\copy drugs(drug_id,name,description) FROM drugs.csv CSV HEADER" \\
+        -c "\\copy drug_molecule(drug_id,molecule_id,quantity,quantity_unit) FROM drug_molecule.csv CSV HEADER" \\
+        -c "SELECT setval('drugs_drug_id_seq', (SELECT max(drug_id) FROM drugs))"
+"""
+
+import argparse
+import csv
+import gzip
+import multiprocessing
+import os
+import random
+from bisect import bisect
+from itertools import accumulate, islice
+from typing import IO, Iterator
+
+import zstandard
+from rdkit import Chem, RDLogger
+
+# ring systems, "*" is a free position on a carbon, "&" on a nitrogen, 1 and 2 are the ring bond digits,
+# they are renumbered for every ring system of the molecule, the first atom bonds to the previous fragment
+RING_SYSTEMS = [
+    ("c1cc*cc*c1", 12),  # benzene
+    ("c1ccc*cn1", 5),  # pyridine
+    ("c1nc*ncc1", 2),  # pyrimidine
+    ("c1ccc*s1", 2),  # thiophene
+    ("c1ccc*o1", 1),  # furan
+    ("c1cc*n[nH]1", 1),  # pyrazole
+    ("c1cnc*[nH]1", 1),  # imidazole
+    ("c1nc*cs1", 1),  # thiazole
+    ("C1CCC*CC1", 3),  # cyclohexane
+    ("C1CC1", 1),  # cyclopropane
+    ("C1CCN&CC1", 4),  # piperidine
+    ("N1CCN&CC1", 4),  # piperazine
+    ("N1CCOCC1", 3),  # morpholine
+    ("N1CCCC1", 2),  # pyrrolidine
+    ("C1CCOC1", 1),  # tetrahydrofuran
+    ("c1ccc2[nH]cc*c2c1", 2),  # indole
+    ("c1ccc2ncc*cc2c1", 2),  # quinoline
+    ("c1ccc2cc*ccc2c1", 1),  # naphthalene
+    ("c1ccc2[nH]c*nc2c1", 1),  # benzimidazole
+    ("c1ccc2oc*nc2c1", 1),  # benzoxazole
+]
+
+# bonded to an atom of a ring system, carbon positions take all of them, nitrogen positions the ones marked True
+SUBSTITUENTS = [
+    ("C", 10, True),
+    ("F", 8, False),
+    ("Cl", 6, False),
+    ("OC", 6, False),
+    ("C(=O)N", 4, False),
+    ("C(=O)O", 3, False),
+    ("C(F)(F)F", 3, False),
+    ("O", 3, False),
+    ("N", 2, False),
+    ("C#N", 2, False),
+    ("Br", 2, False),
+    ("CC", 3, True),
+    ("C(C)C", 2, True),
+    ("C(=O)C", 3, True),
+    ("C(=O)OC", 2, True),
+    ("S(=O)(=O)C", 2, True),
+    ("CCO", 1, True),
+    ("N(C)C", 1, False),
+    ("NC(=O)C", 2, False),
+    ("S(=O)(=O)N", 1, False),
+    ("[N+](=O)[O-]", 1, False),
+]
+
+# between two ring systems, "" is a direct bond
+LINKERS = [
+    ("", 6),
+    ("C", 5),
+    ("C(=O)N", 5),
+    ("NC(=O)", 4),
+    ("O", 3),
+    ("N", 3),
+    ("CC", 2),
+    ("OC", 2),
+    ("CN", 2),
+    ("S(=O)(=O)N", 2),
+    ("C(=O)", 2),
+    ("NC(=O)N", 1),
+    ("CCN", 1),
+    ("C=C", 1),
+]
+
+# before the first ring system
+CAPS = [
+    ("", 8),
+    ("C", 3),
+    ("CO", 2),
+    ("CC(C)", 1),
+    ("CC(=O)N", 2),
+    ("OC(=O)C", 1),
+    ("CN(C)C", 1),
+    ("CCCC", 1),
+    ("N#C", 1),
+    ("CS(=O)(=O)N", 1),
+    ("OCC", 1),
+]
+
+RING_SYSTEM_COUNTS = [(1, 2), (2, 5), (3, 5), (4, 2)]
+SUBSTITUTION_PROBABILITY = 0.5
+
+NAME_SYLLABLES = [
+    "a",
+    "be",
+    "ce",
+    "di",
+    "flu",
+    "ga",
+    "lo",
+    "me",
+    "ni",
+    "pra",
+    "qui",
+    "ro",
+    "sa",
+    "te",
+    "va",
+    "zo",
+]
+NAME_SUFFIXES = [
+    "azole",
+    "olol",
+    "pril",
+    "statin",
+    "vir",
+    "azepam",
+    "oxacin",
+    "tinib",
+    "dipine",
+    "sartan",
+    "mycin",
+]
+DOSAGE_FORMS = ["tablets", "capsules", "syrup", "injection", "cream", "drops"]
+
+# quantity unit as stored in drug_molecule.quantity_unit, weight, range of the quantity as powers of ten
+QUANTITIES = [("MASS", 6, (-3, 0)), ("VOLUME", 2, (0, 2.7)), ("MOLAR", 1, (-4, -1))]
+
+
+def _weighted(items) -> tuple[list, list, float]:
+    """
+    :return: the items, their cumulative weights and the total weight, for DrugLikeGenerator._choice
+    """
+    cumulative_weights = list(accumulate(item[1] for item in items))
+    return [item[0] for item in items], cumulative_weights, cumulative_weights[-1]
+
+
+def _compile_ring_system(
+    template: str, max_depth: int
+) -> tuple[list[str], list[list[str]]]:
+    """
+    :return: kinds of the free positions, "*" or "&", and for every depth the text between them,
+        with the ring bond digits of that depth
+    """
+    kinds = [char for char in template if char in "*&"]
+    pieces = []
+    for depth in range(max_depth):
+        text = template.translate(
+            str.maketrans({"1": str(2 * depth + 1), "2": str(2 * depth + 2)})
+        )
+        pieces.append(text.replace("&", "*").split("*"))
+    return kinds, pieces
+
+
+class DrugLikeGenerator:
+    """
+    Draws the fragments from the weighted lists above, with one random.Random, see the module docstring
+    """
+
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        max_depth = max(count for count, _ in RING_SYSTEM_COUNTS)
+        self.ring_systems = _weighted(
+            [
+                (_compile_ring_system(template, max_depth), weight)
+                for template, weight in RING_SYSTEMS
+            ]
+        )
+        self.substituents = {
+            "*": _weighted(SUBSTITUENTS),
+            "&": _weighted(
+                [substituent for substituent in SUBSTITUENTS if substituent[2]]
+            ),
+        }
+        self.linkers = _weighted(LINKERS)
+        self.caps = _weighted(CAPS)
+        self.ring_system_counts = _weighted(RING_SYSTEM_COUNTS)
+
+    def _choice(self, weighted: tuple[list, list, float]):
+        # what random.choices does for one item, without the overhead of the call
+        items, cumulative_weights, total = weighted
+        return items[bisect(cumulative_weights, self.rng.random() * total)]
+
+    def smiles(self) -> str:
+        count = self._choice(self.ring_system_counts)
+        return self._choice(self.caps) + self._ring_system(0, count)
+
+    def _ring_system(self, depth: int, count: int) -> str:
+        """
+        :param depth: number of the ring system in the molecule, sets its ring bond digits
+        :param count: number of ring systems from this one on
+        """
+        kinds, pieces = self._choice(self.ring_systems)
+        pieces = pieces[depth]
+        # the rest of the molecule hangs on one of the free positions, a ring system without them ends the molecule
+        next_position = (
+            int(self.rng.random() * len(kinds)) if count > 1 and kinds else None
+        )
+
+        parts = [pieces[0]]
+        for i, kind in enumerate(kinds):
+            if i == next_position:
+                linker = self._choice(self.linkers)
+                parts.append(f"({linker}{self._ring_system(depth + 1, count - 1)})")
+            elif self.rng.random() < SUBSTITUTION_PROBABILITY:
+                parts.append(f"({self._choice(self.substituents[kind])})")
+            parts.append(pieces[i + 1])
+        return "".join(parts)
+
+    def name(self) -> str:
+        syllables = self.rng.choices(NAME_SYLLABLES, k=self.rng.randint(1, 3))
+        return "".join(syllables).capitalize() + self.rng.choice(NAME_SUFFIXES)
+
+
+def generate_drug_like_molecules(seed: int = 42) -> Iterator[tuple[str, str]]:
+    """
+    Endless stream of (smiles, name) of distinct drug-like SMILES strings
+
+    :param seed: the same seed generates the same molecules in the same order
+    """
+    generator = DrugLikeGenerator(seed)
+    # hashes instead of the strings, millions of them fit in memory
+    seen = set()
+    while True:
+        smiles = generator.smiles()
+        key = hash(smiles)
+        if key not in seen:
+            seen.add(key)
+            yield smiles, generator.name()
+
+
+def generate_drugs(
+    n_drugs: int, n_molecules: int, seed: int = 42
+) -> Iterator[tuple[dict, list[dict]]]:
+    """
+    Drugs of one to four molecules of 1..n_molecules, with quantities in the units real drugs use
+
+    :return: rows of the drugs table and of the drug_molecule table of every drug
+    """
+    rng = random.Random(seed)
+    generator = DrugLikeGenerator(seed)
+    units = [quantity[0] for quantity in QUANTITIES]
+    weights = [quantity[1] for quantity in QUANTITIES]
+    ranges = {quantity[0]: quantity[2] for quantity in QUANTITIES}
+    for drug_id in range(1, n_drugs + 1):
+        components = rng.sample(
+            range(1, n_molecules + 1),
+            min(n_molecules, rng.choices([1, 2, 3, 4], [5, 3, 2, 1])[0]),
+        )
+        form = rng.choice(DOSAGE_FORMS)
+        drug = {
+            "drug_id": drug_id,
+            "name": f"{generator.name()} {form}",
+            "description": f"{len(components)} component {form}",
+        }
+        drug_molecules = []
+        for molecule_id in components:
+            unit = rng.choices(units, weights)[0]
+            drug_molecules.append(
+                {
+                    "drug_id": drug_id,
+                    "molecule_id": molecule_id,
+                    "quantity": float(f"{10 ** rng.uniform(*ranges[unit]):.3g}"),
+                    "quantity_unit": unit,
+                }
+            )
+        yield drug, drug_molecules
+
+
+def open_for_writing(path: str) -> IO[str]:
+    """
+    Text file, gzip or zstd compressed if the path ends with .gz or .zst
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt")
+    if path.endswith(".zst"):
+        return zstandard.open(path, "wt")
+    return open(path, "w", newline="")
+
+
+def _to_sd_record(molecule: tuple[str, str]) -> str:
+    mol = Chem.MolFromSmiles(molecule[0])
+    mol.SetProp("_Name", molecule[1])
+    return f"{Chem.MolToMolBlock(mol)}$$$$\n"
+
+
+def _init_sd_worker() -> None:
+    RDLogger.DisableLog("rdApp.*")
+
+
+def write_molecules(path: str, n_molecules: int, seed: int = 42) -> None:
+    """
+    :param path: .csv, .smi or .sdf file, optionally with .gz or .zst at the end
+    """
+    molecules = islice(generate_drug_like_molecules(seed), n_molecules)
+    extension = os.path.splitext(path.removesuffix(".gz").removesuffix(".zst"))[1]
+    with open_for_writing(path) as file:
+        if extension == ".csv":
+            writer = csv.writer(file)
+            writer.writerow(["smiles", "name"])
+            writer.writerows(molecules)
+        elif extension in (".smi", ".smiles"):
+            file.write("smiles name\n")
+            file.writelines(f"{smiles} {name}\n" for smiles, name in molecules)
+        elif extension in (".sdf", ".sd"):
+            # mol blocks are the slow part, they are made in the worker processes, in the order of the molecules
+            with multiprocessing.Pool(initializer=_init_sd_worker) as pool:
+                file.writelines(pool.imap(_to_sd_record, molecules, chunksize=1000))
+        else:
+            raise ValueError(f"unsupported file {path}")
+
+
+def write_drugs(
+    drugs_path: str,
+    drug_molecule_path: str,
+    n_drugs: int,
+    n_molecules: int,
+    seed: int = 42,
+) -> None:
+    with open_for_writing(drugs_path) as drugs_file, open_for_writing(
+        drug_molecule_path
+    ) as drug_molecule_file:
+        drugs = csv.DictWriter(drugs_file, ["drug_id", "name", "description"])
+        drug_molecules = csv.DictWriter(
+            drug_molecule_file,
+            ["drug_id", "molecule_id", "quantity", "quantity_unit"],
+        )
+        drugs.writeheader()
+        drug_molecules.writeheader()
+        for drug, components in generate_drugs(n_drugs, n_molecules, seed):
+            drugs.writerow(drug)
+            drug_molecules.writerows(components)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--molecules", type=int, default=100_000)
+    parser.add_argument("--drugs", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="drug_like.csv")
+    parser.add_argument("--drugs-output", default="drugs.csv")
+    parser.add_argument("--drug-molecule-output", default="drug_molecule.csv")
+    args = parser.parse_args()
+
+    write_molecules(args.output, args.molecules, args.seed)
+    if args.drugs:
+        write_drugs(
+            args.drugs_output,
+            args.drug_molecule_output,
+            args.drugs,
+            args.molecules,
+            args.seed,
+        )
+
+
+if __name__ == "__main__":
+    main()
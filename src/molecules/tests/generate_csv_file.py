@@ -1,3 +1,8 @@
+import gzip
+
+import zstandard
+from rdkit import Chem
+
 from src.molecules.tests.testing_utils import alkanes
 
 # import csv writer
@@ -31,10 +36,34 @@ def generate_csv_file_alkanes_decane_and_nonane_have_invalid_smiles():
                 writer.writerow([molecule["name"], molecule["smiles"]])
 
 
+def generate_smi_file_alkanes_gzip():
+    with gzip.open("alkanes.smi.gz", mode="wt") as file:
+        file.write("smiles name\n")
+        for molecule in alkanes.values():
+            file.write(f"{molecule['smiles']} {molecule['name']}\n")
+
+
+def generate_sdf_file_alkanes_zstd_decane_is_broken():
+    """
+    Every alkane is written as a separate SD record, decane record is corrupted, so RDKit can not parse it.
+    """
+    with open("alkanes.sdf.zst", mode="wb") as raw_file:
+        with zstandard.ZstdCompressor().stream_writer(raw_file) as file:
+            for molecule in alkanes.values():
+                mol = Chem.MolFromSmiles(molecule["smiles"])
+                mol.SetProp("_Name", molecule["name"])
+                block = Chem.MolToMolBlock(mol)
+                if molecule["name"] == "Decane":
+                    block = block.replace("V2000", "V9999")
+                file.write(f"{block}$$$$\n".encode())
+
+
 def generate_testing_files():
     generate_csv_file_alkanes()
     generate_csv_file_invalid_header()
     generate_csv_file_alkanes_decane_and_nonane_have_invalid_smiles()
+    generate_smi_file_alkanes_gzip()
+    generate_sdf_file_alkanes_zstd_decane_is_broken()
 
 
 def generate_large_csv_file(n_of_alkanes=500):
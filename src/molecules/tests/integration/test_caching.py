@@ -1,24 +1,49 @@
+import asyncio
+import json
 import random
+import time
 import pytest
 import redis
+import redis.exceptions as redis_errors
+from unittest import mock
+
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from starlette.responses import StreamingResponse
 from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
-from src.caching_service import RedisCacheServiceSingleton
+from src.cache_codecs import SizeTieredCodec
+from src.cache_tags import tags_for_path
+from src.caching_service import AsyncRedisCacheService, RedisCacheServiceSingleton
 from src.config import get_test_settings
 from src.database import Base
+from src.local_cache import LocalLRUCache
 from src.main import app
+from src.redis_client import get_async_redis_client
+from src.middleware import (
+    CachingMiddleware,
+    decode_cached_response,
+    encode_cached_response,
+    etag_matches,
+    register_middlewares,
+)
 from src.molecules.repository import MoleculeRepository
 from src.molecules.schema import MoleculeRequest
-from src.molecules.service import get_molecule_service, MoleculeService
+from src.molecules.service import (
+    AsyncMoleculeService,
+    get_molecule_service,
+    MoleculeService,
+)
 from src.molecules.tests.testing_utils import (
     alkane_request_jsons,
     validate_response_dict_for_ith_alkane,
 )
 from src.molecules.tests.testing_utils_for_caching import (
-    assert_set_json_called_with_url,
+    assert_cache_set_called_with_url,
     assert_key_exists_in_cache,
     get_key_from_url_queries,
+    get_test_async_redis_client,
 )
 
 engine = create_engine(
@@ -30,7 +55,10 @@ client = TestClient(app)
 redis_test_client = redis.Redis(
     host=get_test_settings().REDIS_HOST, port=get_test_settings().REDIS_PORT
 )
-RedisCacheServiceSingleton.create(redis_test_client)
+# this instance is used by every test module, it is the last one created when the tests are collected
+RedisCacheServiceSingleton.create(
+    redis_test_client, async_redis_client_factory=get_test_async_redis_client
+)
 redis = RedisCacheServiceSingleton.get_instance()
 molecule_service = MoleculeService(molecule_repository, session_factory)
 app.dependency_overrides[get_molecule_service] = lambda: molecule_service
@@ -45,6 +73,7 @@ def init_db():
     """
 
     redis_test_client.flushdb()
+    redis.local_cache.clear()
     Base.metadata.drop_all(engine)
     Base.metadata.create_all(engine)
     #
@@ -61,6 +90,7 @@ def init_db():
         molecule_service.save(MoleculeRequest.model_validate(alkane_request_jsons[i]))
     yield
     redis_test_client.flushdb()
+    redis.local_cache.clear()
 
 
 @pytest.mark.parametrize("idx", [random.randint(1, 10) for _ in range(5)])
@@ -69,18 +99,18 @@ def test_get_molecule_by_id_mock(idx, init_db):
     Test the GET /molecules/{molecule_id} endpoint.
     """
 
-    # This is the first request, there is no cache and the set_json method should be called
-    assert_set_json_called_with_url(
-        client, redis, url=f"/molecules/{idx}", should_be_called=True
+    # This is the first request, there is no cache and the set_tagged_bytes method should be called
+    assert_cache_set_called_with_url(
+        client, url=f"/molecules/{idx}", should_be_called=True
     )
 
     # now make a request to the same endpoint, that actually caches the data
     request = client.get(f"/molecules/{idx}")
     assert request.status_code == 200
 
-    # The set_json method should not be called because the cache is already set
-    assert_set_json_called_with_url(
-        client, redis, url=f"/molecules/{idx}", should_be_called=False
+    # The set_tagged_bytes method should not be called because the cache is already set
+    assert_cache_set_called_with_url(
+        client, url=f"/molecules/{idx}", should_be_called=False
     )
 
 
@@ -94,7 +124,7 @@ def test_get_molecule_by_id(idx, init_db):
     assert request.status_code == 200
     assert validate_response_dict_for_ith_alkane(request.json(), idx)
 
-    # This should have triggered the set_json method and the cache should be set
+    # This should have triggered the set_tagged_bytes method and the cache should be set
     assert_key_exists_in_cache(redis, f"/molecules/{idx}", should_exist=True)
 
     # Now make the same request again, this time the cache should be hit
@@ -138,7 +168,7 @@ def test_find_all_mock(page, pageSize, name, minMass, maxMass, orderBy, order, i
 
     assert response.status_code == 200
 
-    # This should have triggered the set_json method and the cache should be set
+    # This should have triggered the set_tagged_bytes method and the cache should be set
     assert_key_exists_in_cache(redis, key, should_exist=True)
     #
     response2 = client.get(key)
@@ -165,7 +195,7 @@ def test_find_all_mock(page, pageSize, name, minMass, maxMass, orderBy, order, i
 #     response = client.get(key)
 #     assert response.status_code == 200
 #
-#     # This should have triggered the set_json method and the cache should be set
+#     # This should have triggered the set_tagged_bytes method and the cache should be set
 #     assert_key_exists_in_cache(redis, key, should_exist=True)
 #
 #     response2 = client.get(key)
@@ -192,7 +222,7 @@ def test_find_all_mock(page, pageSize, name, minMass, maxMass, orderBy, order, i
 #     response = client.get(key)
 #     assert response.status_code == 200
 #
-#     # This should have triggered the set_json method and the cache should be set
+#     # This should have triggered the set_tagged_bytes method and the cache should be set
 #     assert_key_exists_in_cache(redis, key, should_exist=True)
 #
 #     response2 = client.get(key)
@@ -211,8 +241,8 @@ def test_no_cache_header_mock(idx, init_db):
     # Initially the cache should not have the key
     assert_key_exists_in_cache(redis, "/molecules/", should_exist=False)
 
-    assert_set_json_called_with_url(
-        client, redis, url=f"/molecules/{idx}", should_be_called=True
+    assert_cache_set_called_with_url(
+        client, url=f"/molecules/{idx}", should_be_called=True
     )
 
     # make a request to the endpoint
@@ -220,15 +250,504 @@ def test_no_cache_header_mock(idx, init_db):
     assert request.status_code == 200
 
     #     now when i make a casual request to the endpoint, the cache should be hit
-    assert_set_json_called_with_url(
-        client, redis, url=f"/molecules/{idx}", should_be_called=False
+    assert_cache_set_called_with_url(
+        client, url=f"/molecules/{idx}", should_be_called=False
     )
 
     #     but is i make a request with no-cache header, the cache should be invalidated
-    assert_set_json_called_with_url(
+    assert_cache_set_called_with_url(
         client,
-        redis,
         url=f"/molecules/{idx}",
         should_be_called=True,
         headers={"cache-control": "no-cache"},
     )
+
+
+def streaming_app(chunks: list[bytes], max_body_size: int):
+    """
+    App with one streaming endpoint behind the caching middleware, streaming responses have no content-length
+    """
+    streaming = FastAPI()
+
+    @streaming.get("/molecules/stream")
+    def stream():
+        return StreamingResponse(iter(chunks), media_type="text/plain")
+
+    streaming.add_middleware(CachingMiddleware, max_body_size=max_body_size)
+    return streaming
+
+
+def test_streamed_response_is_replayed_byte_for_byte(init_db):
+    chunks = [b"first,", b"second,", b"third"]
+    streaming_client = TestClient(streaming_app(chunks, max_body_size=100))
+
+    response = streaming_client.get("/molecules/stream?b=2&a=1")
+    assert response.content == b"".join(chunks)
+    assert_key_exists_in_cache(redis, "/molecules/stream?a=1&b=2", should_exist=True)
+
+    with mock.patch.object(AsyncRedisCacheService, "set_tagged_bytes") as mock_set:
+        cached = streaming_client.get("/molecules/stream?a=1&b=2")
+        mock_set.assert_not_called()
+    assert cached.content == response.content
+    assert cached.headers["content-type"] == response.headers["content-type"]
+    assert cached.headers["content-length"] == str(len(response.content))
+
+
+def test_streamed_response_over_size_cap_is_not_cached(init_db):
+    chunks = [b"x" * 6, b"y" * 6, b"z" * 6]
+    streaming_client = TestClient(streaming_app(chunks, max_body_size=10))
+
+    response = streaming_client.get("/molecules/stream")
+    assert response.content == b"".join(chunks)
+    assert_key_exists_in_cache(redis, "/molecules/stream", should_exist=False)
+
+
+def test_list_is_invalidated_after_post(init_db):
+    first = client.get("/molecules/?pageSize=100")
+    assert first.json()["total"] == 10
+
+    response = client.post("/molecules/", json=alkane_request_jsons[11])
+    assert response.status_code == 201
+    assert_key_exists_in_cache(redis, "/molecules/?pageSize=100", should_exist=False)
+
+    second = client.get("/molecules/?pageSize=100")
+    assert second.json()["total"] == 11
+
+
+@pytest.mark.parametrize("idx", [random.randint(1, 10) for _ in range(3)])
+def test_molecule_is_invalidated_after_patch_and_delete(idx, init_db):
+    client.get(f"/molecules/{idx}")
+    client.get(f"/molecules/{idx % 10 + 1}")
+
+    response = client.patch(f"/molecules/{idx}/", json={"name": "Renamed"})
+    assert response.status_code == 200
+    assert client.get(f"/molecules/{idx}").json()["name"] == "Renamed"
+    # other molecules keep their cached responses
+    assert_key_exists_in_cache(redis, f"/molecules/{idx % 10 + 1}", should_exist=True)
+
+    assert client.delete(f"/molecules/{idx}/").status_code == 200
+    assert client.get(f"/molecules/{idx}").status_code == 404
+
+
+def test_response_invalidated_while_computed_is_not_cached(init_db):
+    original_get_tag_versions = AsyncRedisCacheService.get_tag_versions
+
+    async def invalidate_after_first_read(self, tags):
+        versions = await original_get_tag_versions(self, tags)
+        await self.invalidate_tags(tags)
+        return versions
+
+    with mock.patch.object(
+        AsyncRedisCacheService, "get_tag_versions", invalidate_after_first_read
+    ):
+        assert client.get("/molecules/1").status_code == 200
+    assert_key_exists_in_cache(redis, "/molecules/1", should_exist=False)
+
+
+@pytest.mark.parametrize(
+    "path, tags",
+    [
+        ("/molecules/", ["molecules"]),
+        ("/molecules/5", ["molecule:5"]),
+        ("/molecules/5/", ["molecule:5"]),
+        ("/molecules/search/substructures", ["molecules"]),
+        ("/drugs/3", ["drug:3"]),
+        ("/drugs/", ["drugs"]),
+        ("/tasks/abc", []),
+    ],
+)
+def test_tags_for_path(path, tags):
+    assert tags_for_path(path) == tags
+
+
+def test_hot_key_is_served_from_local_tier(init_db):
+    assert client.get("/molecules/1").status_code == 200
+
+    with mock.patch("redis.asyncio.Redis.get") as redis_get:
+        response = client.get("/molecules/1")
+        redis_get.assert_not_called()
+    assert validate_response_dict_for_ith_alkane(response.json(), 1)
+
+
+def test_local_tier_is_invalidated_through_pub_sub(init_db):
+    client.get("/molecules/1")
+    assert redis.local_cache.get("/molecules/1") is not None
+
+    redis.start_invalidation_listener()
+    try:
+        # another node deleted the key and published it
+        time.sleep(0.2)
+        redis_test_client.publish(
+            RedisCacheServiceSingleton.INVALIDATION_CHANNEL,
+            json.dumps(["/molecules/1"]),
+        )
+        for _ in range(50):
+            if redis.local_cache.get("/molecules/1") is None:
+                break
+            time.sleep(0.05)
+        assert redis.local_cache.get("/molecules/1") is None
+    finally:
+        redis.stop_invalidation_listener()
+
+
+def test_invalidation_listener_reconnects(init_db):
+    redis.start_invalidation_listener()
+    try:
+        time.sleep(0.2)
+        # redis restarted, the listener subscribes again on a new connection
+        redis_test_client.client_kill_filter(_type="pubsub")
+        # the local tier is cleared when the connection is lost, the entry is cached after that
+        time.sleep(RedisCacheServiceSingleton.LISTENER_RETRY_SECONDS + 1.5)
+        client.get("/molecules/1")
+        assert redis.local_cache.get("/molecules/1") is not None
+        for _ in range(100):
+            redis_test_client.publish(
+                RedisCacheServiceSingleton.INVALIDATION_CHANNEL,
+                json.dumps(["/molecules/1"]),
+            )
+            if redis.local_cache.get("/molecules/1") is None:
+                break
+            time.sleep(0.05)
+        assert redis.local_cache.get("/molecules/1") is None
+        assert redis._listener.is_alive()
+    finally:
+        redis.stop_invalidation_listener()
+
+
+def test_app_starts_without_redis(init_db):
+    with mock.patch.object(
+        RedisCacheServiceSingleton,
+        "start_invalidation_listener",
+        side_effect=redis_errors.ConnectionError("redis is not reachable"),
+    ) as start:
+        with TestClient(app) as lifespan_client:
+            assert lifespan_client.get("/").status_code == 200
+        start.assert_called()
+
+
+def test_local_lru_cache_limits_and_ttl():
+    now = [0.0]
+    cache = LocalLRUCache(
+        max_entries=2, max_bytes=10, ttl_seconds=5, clock=lambda: now[0]
+    )
+
+    cache.put("a", b"1111")
+    cache.put("b", b"2222")
+    cache.get("a")
+    cache.put("c", b"3333")
+    # b was the least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1111"
+
+    cache.put("d", b"444444")
+    # 4 + 4 + 6 bytes is over the limit, c was the least recently used, dropping it is enough
+    assert cache.get("c") is None and cache.get("d") == b"444444"
+    assert cache.get("a") == b"1111"
+
+    now[0] = 5
+    assert cache.get("d") is None
+
+
+def test_local_lru_cache_skips_values_read_before_eviction():
+    cache = LocalLRUCache()
+    generation = cache.generation
+    cache.evict(["a"])
+    cache.put("a", b"stale", generation)
+    assert cache.get("a") is None
+
+
+def counting_middleware(body: bytes, delay: float = 0.1):
+    """
+    Caching middleware in front of an ASGI app that counts how many times it computed the response
+    """
+    calls = []
+
+    async def slow_app(scope, receive, send):
+        calls.append(scope["path"])
+        await asyncio.sleep(delay)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": body})
+
+    return CachingMiddleware(slow_app, cached_endpoints={"/molecules/**": 60}), calls
+
+
+async def get_body(middleware, path: str) -> bytes:
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": b"",
+        "headers": [],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    return b"".join(
+        m.get("body", b"") for m in messages if m["type"] == "http.response.body"
+    )
+
+
+def test_concurrent_misses_are_computed_once(init_db):
+    middleware, calls = counting_middleware(b"hot")
+
+    async def burst():
+        return await asyncio.gather(
+            *(get_body(middleware, "/molecules/hot") for _ in range(10))
+        )
+
+    assert asyncio.run(burst()) == [b"hot"] * 10
+    assert calls == ["/molecules/hot"]
+
+
+def test_response_is_sent_before_it_is_stored(init_db):
+    middleware, _ = counting_middleware(b"hot", delay=0)
+    sent = []
+    store = CachingMiddleware._store
+
+    async def send(message):
+        sent.append(message)
+
+    async def checked_store(*args):
+        # the client got the whole response before the redis writes started
+        assert sent[-1]["type"] == "http.response.body"
+        return await store(*args)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/molecules/hot",
+        "query_string": b"",
+        "headers": [],
+    }
+    with mock.patch.object(
+        CachingMiddleware, "_store", side_effect=checked_store
+    ) as mock_store:
+        asyncio.run(middleware(scope, None, send))
+        mock_store.assert_called_once()
+    assert_key_exists_in_cache(redis, "/molecules/hot", should_exist=True)
+
+
+def sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_cache_results_are_counted(init_db):
+    def cache_requests():
+        return {
+            result: sample("cache_requests_total", {"result": result})
+            for result in ("hit", "miss", "bypass")
+        }
+
+    def route_requests():
+        labels = {"method": "GET", "route": "/molecules/{molecule_id}", "status": "200"}
+        return sample("http_request_duration_seconds_count", labels)
+
+    before, requests_before = cache_requests(), route_requests()
+    client.get("/molecules/1")
+    client.get("/molecules/1")
+    client.get("/molecules/1", headers={"cache-control": "no-cache"})
+    after = cache_requests()
+
+    assert {result: after[result] - before[result] for result in after} == {
+        "hit": 1,
+        "miss": 1,
+        "bypass": 1,
+    }
+    # the hit is sent before routing, it is still labeled with the route
+    assert route_requests() - requests_before == 3
+
+
+def test_concurrent_misses_are_counted_as_coalesced(init_db):
+    middleware, _ = counting_middleware(b"hot")
+    before = sample("cache_requests_total", {"result": "coalesced"})
+
+    async def burst():
+        return await asyncio.gather(
+            *(get_body(middleware, "/molecules/hot") for _ in range(3))
+        )
+
+    asyncio.run(burst())
+    assert sample("cache_requests_total", {"result": "coalesced"}) - before == 2
+
+
+def test_miss_waits_for_the_node_holding_the_lock(init_db):
+    middleware, calls = counting_middleware(b"mine")
+    token = redis.acquire_lock("/molecules/hot", timeout_seconds=5)
+
+    async def other_node():
+        await asyncio.sleep(0.2)
+        redis.set_tagged_bytes(
+            "/molecules/hot", encode_cached_response(200, [], b"theirs"), [], 60
+        )
+        redis.release_lock("/molecules/hot", token)
+
+    async def run():
+        body, _ = await asyncio.gather(
+            get_body(middleware, "/molecules/hot"), other_node()
+        )
+        return body
+
+    assert asyncio.run(run()) == b"theirs"
+    assert calls == []
+    assert not redis.is_locked("/molecules/hot")
+
+
+def test_stale_entry_is_served_and_revalidated(init_db):
+    middleware, calls = counting_middleware(b"fresh", delay=0)
+    stale = encode_cached_response(200, [], b"stale", fresh_until=time.time() - 1)
+    redis.set_tagged_bytes("/molecules/hot", stale, [], 60)
+
+    async def run():
+        body = await get_body(middleware, "/molecules/hot")
+        await asyncio.gather(*middleware._background_tasks)
+        return body
+
+    assert asyncio.run(run()) == b"stale"
+    assert calls == ["/molecules/hot"]
+    refreshed = decode_cached_response(redis.get_bytes("/molecules/hot"))
+    assert refreshed.body == b"fresh"
+    assert refreshed.fresh_until > time.time()
+
+
+def test_conditional_get_returns_not_modified(init_db):
+    response = client.get("/molecules/1")
+    etag = response.headers["etag"]
+
+    with mock.patch.object(AsyncMoleculeService, "find_by_id") as find_by_id:
+        not_modified = client.get("/molecules/1", headers={"if-none-match": etag})
+        find_by_id.assert_not_called()
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+
+    cached = client.get("/molecules/1", headers={"if-none-match": '"other"'})
+    assert cached.status_code == 200
+    assert cached.headers["etag"] == etag
+    assert cached.content == response.content
+
+
+def test_conditional_get_on_miss_returns_not_modified(init_db):
+    etag = client.get("/molecules/?pageSize=5").headers["etag"]
+    redis_test_client.flushdb()
+    redis.local_cache.clear()
+
+    response = client.get("/molecules/?pageSize=5", headers={"if-none-match": etag})
+    assert response.status_code == 304
+    assert_key_exists_in_cache(redis, "/molecules/?pageSize=5", should_exist=True)
+
+
+def test_etag_changes_after_update(init_db):
+    etag = client.get("/molecules/1").headers["etag"]
+    client.patch("/molecules/1/", json={"name": "renamed"})
+
+    response = client.get("/molecules/1", headers={"if-none-match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+
+@pytest.mark.parametrize(
+    "if_none_match, matches",
+    [
+        (None, False),
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"x", "abc"', True),
+        ("*", True),
+        ('"abcd"', False),
+    ],
+)
+def test_etag_matches(if_none_match, matches):
+    assert etag_matches(if_none_match, '"abc"') == matches
+
+
+@pytest.mark.parametrize(
+    "value, stored_as",
+    [
+        (b"small", b"r"),
+        (b'{"molecule": "C"}' * 100, b"z"),
+        (random.randbytes(2048), b"r"),
+    ],
+)
+def test_cached_bytes_are_encoded_by_size(value, stored_as, init_db):
+    redis.set_tagged_bytes("entry", value, [], 60)
+    redis.local_cache.clear()
+
+    stored = redis_test_client.get("entry")
+    assert stored[:1] == stored_as
+    assert len(stored) <= len(value) + 1
+    assert redis.get_bytes("entry") == value
+    assert SizeTieredCodec.decode(stored) == value
+
+
+def test_entry_in_unknown_format_is_a_miss(init_db):
+    redis_test_client.set("entry", b"\x00\x00\x00\x02{}body")
+    assert redis.get_bytes("entry") is None
+
+
+def test_objects_are_packed(init_db):
+    redis.set_object("object", {"total": 10, "is_estimate": False}, 60)
+    assert redis.get_object("object") == {"total": 10, "is_estimate": False}
+    assert redis.get_object("missing") is None
+
+
+def test_async_service_writes_value_with_ttl(init_db):
+    async def run():
+        await redis.aio.set_object("object", {"total": 1}, 60)
+        await redis.aio.set_tagged_bytes("entry", b"body", ["molecules"], 60)
+        return await redis.aio.get_object("object")
+
+    assert asyncio.run(run()) == {"total": 1}
+    assert 0 < redis_test_client.ttl("object") <= 60
+    assert 0 < redis_test_client.ttl("entry") <= 60
+    assert redis.get_bytes("entry") == b"body"
+
+    async def invalidate():
+        await redis.aio.invalidate_tags(["molecules"])
+
+    asyncio.run(invalidate())
+    assert redis.get_bytes("entry") is None
+
+
+def test_tag_holds_live_entries_only(init_db):
+    redis.set_tagged_bytes("expiring", b"body", ["molecules"], 1)
+    time.sleep(1.1)
+    redis.set_tagged_bytes("live", b"body", ["molecules"], 60)
+    assert redis_test_client.zrange("tag-members:molecules", 0, -1) == [b"live"]
+
+
+def test_invalidation_deletes_in_batches(init_db):
+    for i in range(5):
+        redis.set_tagged_bytes(f"entry{i}", b"body", ["molecules"], 60)
+
+    with mock.patch("src.caching_service.INVALIDATION_BATCH_SIZE", 2):
+        redis.invalidate_tags(["molecules"])
+    assert redis_test_client.exists(*(f"entry{i}" for i in range(5))) == 0
+    assert not redis_test_client.exists("tag-members:molecules")
+
+
+def test_response_cache_can_be_disabled():
+    disabled = get_test_settings().model_copy(update={"RESPONSE_CACHE_ENABLED": False})
+    uncached_app = FastAPI()
+    with mock.patch("src.middleware.get_settings", return_value=disabled):
+        register_middlewares(uncached_app)
+    assert CachingMiddleware not in [
+        middleware.cls for middleware in uncached_app.user_middleware
+    ]
+    assert CachingMiddleware in [middleware.cls for middleware in app.user_middleware]
+
+
+def test_every_event_loop_gets_its_own_async_client():
+    async def client_of_loop():
+        return get_async_redis_client()
+
+    async def same_loop():
+        return get_async_redis_client() is get_async_redis_client()
+
+    assert asyncio.run(client_of_loop()) is not asyncio.run(client_of_loop())
+    assert asyncio.run(same_loop())
@@ -1,13 +1,36 @@
+import csv
+import io
+import json
 import os
 import random
+import socket
+from itertools import islice
+import httpx
 import pytest
+from rdkit import Chem
 import unittest.mock as mock
+from urllib.parse import parse_qs, urlparse
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
 from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
 from src.config import get_test_settings
 from src.database import Base, get_database_engine
 from src.main import app
+from src.metrics import start_metrics_server
+from src.molecules.counting import MoleculeCountCache
+from src.molecules.repository import get_molecule_repository
+from src.molecules.schema import MoleculeCollectionResponse, get_search_params
+from src.molecules.service import MoleculeService
+from src.drugs.model import QuantityUnit
+from src.molecules.tests.drug_like import (
+    generate_drug_like_molecules,
+    generate_drugs,
+    write_molecules,
+)
 from src.molecules.tests.generate_csv_file import generate_testing_files
+from src.tasks import substructure_search_task
+from src.timing import add_time, collect_timings, format_server_timing, timed
 from src.molecules.tests.testing_utils import (
     alkane_request_jsons,
     validate_response_dict_for_ith_alkane,
@@ -19,7 +42,7 @@ from src.molecules.tests.testing_utils import (
 settings = get_test_settings()
 engine = create_engine(settings.database_url)
 mocked_redis_client = mock.Mock()
-mocked_redis_client.get_json.return_value = None
+mocked_redis_client.get_object.return_value = None
 client = TestClient(app)
 
 
@@ -93,6 +116,12 @@ def test_save_duplicate_smiles(i, init_db):
     assert response.status_code == 400
 
 
+@pytest.mark.parametrize("smiles", ["incontnentia", "C1CC", "CC(C"])
+def test_save_invalid_smiles(smiles, init_db):
+    response = client.post("/molecules/", json={"name": "Invalid", "smiles": smiles})
+    assert response.status_code == 400
+
+
 @pytest.mark.parametrize("i", [random.randint(1, 99) for _ in range(5)])
 def test_find_by_id(i, init_db):
     response = post_consecutive_alkanes(i, 1)[0]
@@ -180,6 +209,183 @@ def test_superstructures(i, init_db):
         assert validate_response_dict_for_ith_alkane(response_json[j - i], j)
 
 
+def test_superstructures_sparse_fields(init_db):
+    post_consecutive_alkanes(1, 5)
+    response = client.get(
+        "/molecules/search/superstructures/?smiles=CCC&fields=molecule_id&links=false",
+        headers={"cache-control": "no-cache"},
+    )
+    assert response.status_code == 200
+    assert response.json()["data"] == [
+        {"molecule_id": 3},
+        {"molecule_id": 4},
+        {"molecule_id": 5},
+    ]
+
+
+def test_search_metrics(init_db):
+    post_consecutive_alkanes(1, 20)
+    labels = {"search": "superstructures"}
+
+    def sample(name: str) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def lookups() -> float:
+        return sum(
+            REGISTRY.get_sample_value("chem_service_lookups_total", {"result": result})
+            or 0
+            for result in ("hit", "miss")
+        )
+
+    scanned, hits, searches, chem_lookups = (
+        sample("molecule_search_rows_scanned_total"),
+        sample("molecule_search_hits_total"),
+        sample("molecule_search_duration_seconds_count"),
+        lookups(),
+    )
+    response = client.get(
+        "/molecules/search/superstructures/?smiles=CCCCC",
+        headers={"cache-control": "no-cache"},
+    )
+    assert response.status_code == 200
+
+    # methane to icosane are scanned, pentane and the longer alkanes are hits
+    assert sample("molecule_search_rows_scanned_total") - scanned == 20
+    assert sample("molecule_search_hits_total") - hits == 16
+    assert sample("molecule_search_duration_seconds_count") - searches == 1
+    # every scanned molecule is looked up in the ChemService, recorded once the search is done
+    assert lookups() - chem_lookups == 20
+
+
+def server_timing(response) -> dict[str, float]:
+    phases = {}
+    for entry in response.headers["server-timing"].split(", "):
+        phase, duration = entry.split(";dur=")
+        phases[phase] = float(duration)
+    return phases
+
+
+def test_server_timing_header(init_db):
+    post_consecutive_alkanes(1, 5)
+
+    response = client.get("/molecules/", headers={"cache-control": "no-cache"})
+    phases = server_timing(response)
+    assert {"cache", "db", "serialize", "app", "total"} <= phases.keys()
+    assert sum(phases[phase] for phase in phases if phase != "total") == pytest.approx(
+        phases["total"], abs=0.1
+    )
+
+    response = client.get(
+        "/molecules/search/superstructures/?smiles=CCC",
+        headers={"cache-control": "no-cache"},
+    )
+    assert {"db", "chem"} <= server_timing(response).keys()
+
+
+def test_collect_timings():
+    with collect_timings() as timings:
+        with timed("db"):
+            pass
+        add_time("db", 0.002)
+        add_time("chem", 0.001)
+    assert timings["db"] >= 0.002
+    assert timings["total"] >= timings["app"] >= 0
+    assert format_server_timing(timings).startswith(
+        "db;dur=2.0, chem;dur=1.0, app;dur="
+    )
+
+    # outside of collect_timings nothing is collected
+    add_time("db", 1)
+    assert timings["db"] < 1
+
+
+def test_profile_request(init_db):
+    post_consecutive_alkanes(1, 5)
+    response = client.get(
+        "/molecules/search/superstructures/?smiles=CCCC&profile=1",
+        headers={"x-request-id": "superstructures-profile"},
+    )
+    assert response.status_code == 200
+    assert response.headers["x-request-id"] == "superstructures-profile"
+
+    response = client.get("/profiles/superstructures-profile")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    stacks = response.text.splitlines()
+    assert stacks
+    for stack in stacks:
+        frames, count = stack.rsplit(" ", 1)
+        assert int(count) > 0
+    assert "get_superstructures" in response.text
+
+    assert client.get("/profiles/unknown").status_code == 404
+
+
+def test_profiling_is_guarded_in_prod(init_db):
+    settings_with_token = get_test_settings().model_copy(
+        update={"PROFILING_TOKENS": ["secret"]}
+    )
+    with mock.patch("src.profiling.getenv", return_value="PROD"), mock.patch(
+        "src.profiling.get_settings", return_value=settings_with_token
+    ):
+        response = client.get(
+            "/molecules/?profile=1",
+            headers={"x-request-id": "not-allowed", "x-profile-token": "wrong"},
+        )
+        assert response.status_code == 200
+        assert "x-request-id" not in response.headers
+
+        response = client.get(
+            "/molecules/?profile=1",
+            headers={"x-request-id": "allowed", "x-profile-token": "secret"},
+        )
+        assert response.headers["x-request-id"] == "allowed"
+
+        assert client.get("/profiles/allowed").status_code == 404
+        response = client.get(
+            "/profiles/allowed", headers={"x-profile-token": "secret"}
+        )
+        assert response.status_code == 200
+
+
+def test_profile_task(init_db):
+    post_consecutive_alkanes(1, 5)
+    result = substructure_search_task("CCC", 10, profile_id="task-profile")
+    assert len(result["data"]) == 3
+
+    response = client.get("/profiles/task-profile")
+    assert response.status_code == 200
+    assert "get_substructures" in response.text
+
+
+def test_metrics_endpoint(init_db):
+    client.get("/molecules/1")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    for name in (
+        "http_request_duration_seconds",
+        "cache_requests_total",
+        "chem_service_lookups_total",
+        "db_pool_connections_in_use",
+    ):
+        assert name in response.text
+
+
+def test_worker_metrics_server(init_db):
+    # substructure searches run in the celery worker, it serves the metrics on its own port
+    post_consecutive_alkanes(1, 5)
+    substructure_search_task("CCCCC", 10)
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+    start_metrics_server(port)
+
+    response = httpx.get(f"http://localhost:{port}/metrics")
+    assert response.status_code == 200
+    assert 'molecule_search_rows_scanned_total{search="substructures"}' in response.text
+
+
 @pytest.fixture
 def create_testing_files():
     generate_testing_files()
@@ -188,6 +394,8 @@ def create_testing_files():
     os.remove("alkanes.csv")
     os.remove("invalid_header.csv")
     os.remove("decane_nonane_invalid_smiles.csv")
+    os.remove("alkanes.smi.gz")
+    os.remove("alkanes.sdf.zst")
 
 
 def test_file_upload(init_db, create_testing_files):
@@ -231,6 +439,124 @@ def test_decane_nonane_invalid_smiles(init_db, create_testing_files):
         assert response_json["number_of_molecules_added"] == 5
 
 
+def test_file_upload_gzip_smi(init_db, create_testing_files):
+    """
+    alkanes.smi.gz contains the same 10 alkanes as alkanes.csv, first 3 of them are already in the database.
+    """
+    post_consecutive_alkanes(1, 3)
+    with open("alkanes.smi.gz", "rb") as file:
+        response = client.post(
+            "/molecules/upload/", files={"file": ("alkanes.smi.gz", file)}
+        )
+        assert response.status_code == 201
+        assert response.json()["number_of_molecules_added"] == 7
+
+
+@pytest.mark.parametrize("validate_rows", ["true", "false"])
+def test_file_upload_molecules_without_names(validate_rows, init_db):
+    """
+    Unnamed molecules of SMILES and SD files are named by their SMILES string, the name column is not nullable
+    """
+    mol = Chem.MolFromSmiles("CCO")
+    files = {
+        "unnamed.smi": "smiles name\nCCC Propane\nCCCC\n".encode(),
+        "unnamed.sdf": f"{Chem.MolToMolBlock(mol)}$$$$\n".encode(),
+    }
+    for filename, content in files.items():
+        response = client.post(
+            f"/molecules/upload/?validate_rows={validate_rows}",
+            files={"file": (filename, content)},
+        )
+        assert response.status_code == 201
+
+    response = client.get(
+        "/molecules/?fields=smiles,name&links=false",
+        headers={"cache-control": "no-cache"},
+    )
+    assert response.json()["data"] == [
+        {"smiles": "CCC", "name": "Propane"},
+        {"smiles": "CCCC", "name": "CCCC"},
+        {"smiles": "CCO", "name": "CCO"},
+    ]
+
+
+def test_file_upload_zstd_sdf_broken_record(init_db, create_testing_files):
+    """
+    Decane record in alkanes.sdf.zst can not be parsed, it should be skipped and the rest should be added.
+    """
+    with open("alkanes.sdf.zst", "rb") as file:
+        response = client.post(
+            "/molecules/upload/", files={"file": ("alkanes.sdf.zst", file)}
+        )
+        assert response.status_code == 201
+        assert response.json()["number_of_molecules_added"] == 9
+
+    response = client.get(
+        "/molecules/?name=Nonane", headers={"cache-control": "no-cache"}
+    )
+    assert response.json()["data"][0]["name"] == "Nonane"
+
+
+@pytest.mark.parametrize("filename", ["drug_like.csv.zst", "drug_like.sdf.gz"])
+def test_file_upload_drug_like(filename, init_db, tmp_path):
+    """
+    Generated drug-like molecules are valid molecules, every one of them is added, in every written format.
+    Bulk insert skips the rows with invalid smiles too, see test_bulk_upload_invalid_smiles_are_skipped
+    """
+    path = tmp_path / filename
+    write_molecules(str(path), 200, seed=7)
+    with open(path, "rb") as file:
+        response = client.post(
+            "/molecules/upload/?validate_rows=false",
+            files={"file": (filename, file)},
+        )
+        assert response.status_code == 201
+        assert response.json()["number_of_molecules_added"] == 200
+
+
+def test_drug_like_generator_is_seeded():
+    molecules = list(islice(generate_drug_like_molecules(7), 500))
+    assert molecules == list(islice(generate_drug_like_molecules(7), 500))
+    assert molecules != list(islice(generate_drug_like_molecules(8), 500))
+    assert len({smiles for smiles, _ in molecules}) == 500
+
+    for drug, components in generate_drugs(50, 500, seed=7):
+        assert 1 <= len(components) <= 4
+        for component in components:
+            assert component["drug_id"] == drug["drug_id"]
+            assert 1 <= component["molecule_id"] <= 500
+            assert component["quantity_unit"] in QuantityUnit.__members__
+
+
+def test_bulk_upload_invalid_smiles_are_skipped(init_db, create_testing_files):
+    """
+    Bulk insert does not check rows one by one, but rows still go through the write pipeline,
+    so decane and nonane with invalid smiles are skipped and masses are real molecular weights.
+    """
+    with open("decane_nonane_invalid_smiles.csv", "rb") as file:
+        response = client.post(
+            "/molecules/upload/?validate_rows=false", files={"file": file}
+        )
+        assert response.status_code == 201
+        assert response.json()["number_of_molecules_added"] == 8
+
+    response = client.get(
+        "/molecules/?orderBy=mass&order=desc", headers={"cache-control": "no-cache"}
+    )
+    data = response.json()["data"]
+    assert len(data) == 8
+    assert data[0]["smiles"] == "CCCCCCCC"
+    assert 114 < data[0]["mass"] < 115
+
+
+def test_file_upload_unsupported_format(init_db, create_testing_files):
+    with open("alkanes.csv", "rb") as file:
+        response = client.post(
+            "/molecules/upload/", files={"file": ("alkanes.xlsx", file)}
+        )
+        assert response.status_code == 400
+
+
 @pytest.mark.parametrize("page, page_size", [(1, 5), (2, 5), (1, 9), (1, 20)])
 def test_find_all(page, page_size, init_db):
     post_consecutive_alkanes(1, 10)
@@ -266,6 +592,23 @@ def test_find_all_name_filter(_, init_db):
     assert response.json()["data"][0]["name"] == alkane_requests[i]["name"]
 
 
+@pytest.mark.parametrize("threshold, expected_length", [(0.1, 5), (1, 1)])
+def test_find_all_name_similarity_threshold(threshold, expected_length, init_db):
+    for alkane in get_imaginary_alkane_requests(5, shuffle=True):
+        assert client.post("/molecules/", json=alkane).status_code == 201
+
+    response = client.get(
+        f"/molecules/?name=gaozane48&similarityThreshold={threshold}",
+        headers={"cache-control": "no-cache"},
+    )
+    assert response.status_code == 200
+
+    body = response.json()
+    assert len(body["data"]) == expected_length
+    assert body["total"] == expected_length
+    assert body["data"][0]["name"] == "gaozane48"
+
+
 @pytest.mark.parametrize(
     "min_mass, max_mass, expected_length", [(0, 10, 0), (20, 50, 2), (13, 100, 5)]
 )
@@ -349,7 +692,7 @@ def test_find_all_pagination(init_db):
 
     assert response_body["page"] == 0
     assert response_body["page_size"] == 5
-    assert response_body["total"] == 5
+    assert response_body["total"] == 7
 
     response = client.get(
         response_body["links"]["next_page"]["href"],
@@ -361,7 +704,7 @@ def test_find_all_pagination(init_db):
 
     assert response_body["page"] == 1
     assert response_body["page_size"] == 5
-    assert response_body["total"] == 2
+    assert response_body["total"] == 7
     assert len(response_body["data"]) == 2
 
     response = client.get(
@@ -374,7 +717,7 @@ def test_find_all_pagination(init_db):
 
     assert response_body["page"] == 0
     assert response_body["page_size"] == 5
-    assert response_body["total"] == 5
+    assert response_body["total"] == 7
     assert len(response_body["data"]) == 5
 
     response = client.get(
@@ -388,5 +731,307 @@ def test_find_all_pagination(init_db):
 
     assert response_body["page"] == 0
     assert response_body["page_size"] == 5
-    assert response_body["total"] == 5
+    assert response_body["total"] == 7
     assert len(response_body["data"]) == 5
+
+
+def test_find_all_matches_the_response_schema(init_db):
+    """
+    Pages are built from plain dicts without validation, the result must be the same as the validated response
+    """
+    post_consecutive_alkanes(1, 7)
+    response = client.get(
+        "/molecules/?page=0&pageSize=5", headers={"cache-control": "no-cache"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+
+    response_body = response.json()
+    validated = MoleculeCollectionResponse.model_validate(response_body)
+    assert validated.model_dump(mode="json") == response_body
+    for i, molecule in enumerate(response_body["data"]):
+        assert validate_response_dict_for_ith_alkane(molecule, i + 1)
+
+
+def test_find_all_sparse_fields(init_db):
+    post_consecutive_alkanes(1, 7)
+    response = client.get(
+        "/molecules/?pageSize=5&fields=smiles,molecule_id&links=false",
+        headers={"cache-control": "no-cache"},
+    )
+    assert response.status_code == 200
+    response_body = response.json()
+    assert response_body["data"][0] == {"molecule_id": 1, "smiles": "C"}
+
+    # next page keeps the selection
+    response = client.get(
+        response_body["links"]["next_page"]["href"],
+        headers={"cache-control": "no-cache"},
+    )
+    assert response.status_code == 200
+    assert [molecule.keys() for molecule in response.json()["data"]] == [
+        {"molecule_id", "smiles"}
+    ] * 2
+
+
+def test_find_all_sparse_fields_ordered_by_mass(init_db):
+    post_consecutive_alkanes(1, 7)
+    response = client.get(
+        "/molecules/?pageSize=5&orderBy=mass&order=desc&fields=name",
+        headers={"cache-control": "no-cache"},
+    )
+    assert response.status_code == 200
+    response_body = response.json()
+    assert [molecule.keys() for molecule in response_body["data"]] == [
+        {"name", "links"}
+    ] * 5
+    assert response_body["data"][0]["links"]["self"]["href"] == "/molecules/7"
+
+    # cursor is built from the mass, even if it is not selected
+    response = client.get(
+        response_body["links"]["next_page"]["href"],
+        headers={"cache-control": "no-cache"},
+    )
+    assert [
+        molecule["links"]["self"]["href"] for molecule in response.json()["data"]
+    ] == ["/molecules/2", "/molecules/1"]
+
+
+def test_find_all_selects_only_needed_columns(init_db):
+    post_consecutive_alkanes(1, 3)
+    with sessionmaker(bind=engine)() as session:
+        rows = get_molecule_repository().find_all(
+            session, 0, 10, get_search_params(orderBy="mass"), columns=["name"]
+        )
+    assert rows[0]._fields == ("molecule_id", "mass", "name")
+
+
+def test_find_by_id_sparse_fields(init_db):
+    post_consecutive_alkanes(1, 3)
+    response = client.get(
+        "/molecules/2?fields=name,mass&links=false",
+        headers={"cache-control": "no-cache"},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"name": alkane_request_jsons[2]["name"], "mass": 30.07}
+
+    response = client.get(
+        "/molecules/2?fields=smiles", headers={"cache-control": "no-cache"}
+    )
+    assert response.json()["smiles"] == "CC"
+    assert response.json()["links"]["self"]["href"] == "/molecules/2"
+
+
+@pytest.mark.parametrize("fields", ["", "smiles,fingerprint", "mol_pickle"])
+def test_invalid_fields(fields, init_db):
+    response = client.get(
+        f"/molecules/?fields={fields}", headers={"cache-control": "no-cache"}
+    )
+    assert response.status_code == 400
+
+
+def test_total_is_updated_after_writes(init_db):
+    post_consecutive_alkanes(1, 3)
+    response = client.get(
+        "/molecules/?pageSize=2", headers={"cache-control": "no-cache"}
+    )
+    assert response.json()["total"] == 3
+    assert response.json()["total_is_estimate"] is False
+
+    post_consecutive_alkanes(4, 2)
+    response = client.get(
+        "/molecules/?pageSize=2", headers={"cache-control": "no-cache"}
+    )
+    assert response.json()["total"] == 5
+
+    response = client.get(
+        "/molecules/?pageSize=2&minMass=40", headers={"cache-control": "no-cache"}
+    )
+    assert response.json()["total"] == 3
+
+
+def test_total_is_estimated_for_large_result_sets(init_db):
+    post_consecutive_alkanes(1, 3)
+    with mock.patch.object(MoleculeCountCache, "EXACT_COUNT_LIMIT", -1):
+        response = client.get(
+            "/molecules/?pageSize=2&maxMass=1000",
+            headers={"cache-control": "no-cache"},
+        )
+    assert response.status_code == 200
+    assert response.json()["total_is_estimate"] is True
+
+
+descriptor_molecules = [
+    {"smiles": "CCO", "name": "Ethanol"},
+    {"smiles": "c1ccccc1", "name": "Benzene"},
+    {"smiles": "C1CCCCC1", "name": "Cyclohexane"},
+    {"smiles": "CCCC", "name": "Butane"},
+    # mass over 500 and logP over 5, fails the Rule of Five
+    {"smiles": "C" * 40, "name": "Tetracontane"},
+]
+
+
+@pytest.mark.parametrize(
+    "query, expected_names",
+    [
+        ("minRingCount=1", {"Benzene", "Cyclohexane"}),
+        ("minHbd=1", {"Ethanol"}),
+        ("maxLogP=1", {"Ethanol"}),
+        ("minTpsa=1&maxTpsa=100", {"Ethanol"}),
+        ("minRotatableBonds=10", {"Tetracontane"}),
+        ("ruleOfFive=false", {"Tetracontane"}),
+        ("ruleOfFive=true&maxRingCount=0", {"Ethanol", "Butane"}),
+    ],
+)
+def test_find_all_descriptor_filters(query, expected_names, init_db):
+    for molecule in descriptor_molecules:
+        assert client.post("/molecules/", json=molecule).status_code == 201
+
+    response = client.get(f"/molecules/?{query}", headers={"cache-control": "no-cache"})
+    assert response.status_code == 200
+    body = response.json()
+    assert {molecule["name"] for molecule in body["data"]} == expected_names
+    assert body["total"] == len(expected_names)
+
+
+def test_backfill_descriptors(init_db):
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO molecules (smiles, name, mass) VALUES ('CCO', 'Ethanol', 2), ('CC', 'Ethane', 2)"
+            )
+        )
+    service = MoleculeService(get_molecule_repository(), sessionmaker(bind=engine))
+
+    assert service.backfill_descriptors(chunk_size=1) == 2
+    assert service.backfill_descriptors() == 0
+
+    response = client.get(
+        "/molecules/?minHbd=1&ruleOfFive=true", headers={"cache-control": "no-cache"}
+    )
+    data = response.json()["data"]
+    assert [molecule["name"] for molecule in data] == ["Ethanol"]
+    assert data[0]["mass"] == pytest.approx(46.07, abs=0.01)
+
+
+def walk_next_page_links(href):
+    """
+    Follow next_page links starting from href, returns all the molecules of all the pages
+    """
+    data = []
+    while href is not None:
+        response = client.get(href, headers={"cache-control": "no-cache"})
+        assert response.status_code == 200
+        body = response.json()
+        data.extend(body["data"])
+        href = body["links"].get("next_page", {}).get("href")
+    return data
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_cursor_pagination_ordered_by_mass(order, init_db):
+    post_consecutive_alkanes(1, 12)
+
+    data = walk_next_page_links(f"/molecules/?pageSize=5&orderBy=mass&order={order}")
+
+    masses = [molecule["mass"] for molecule in data]
+    assert len(data) == 12
+    assert len({molecule["molecule_id"] for molecule in data}) == 12
+    assert masses == sorted(masses, reverse=order == "desc")
+
+
+def test_cursor_pagination_name_search(init_db):
+    for alkane in get_imaginary_alkane_requests(9, shuffle=True):
+        assert client.post("/molecules/", json=alkane).status_code == 201
+
+    expected = client.get(
+        "/molecules/?name=gaozane&pageSize=100", headers={"cache-control": "no-cache"}
+    ).json()["data"]
+    data = walk_next_page_links("/molecules/?name=gaozane&pageSize=3")
+
+    assert [molecule["molecule_id"] for molecule in data] == [
+        molecule["molecule_id"] for molecule in expected
+    ]
+
+
+def test_cursor_pagination_last_page_has_no_next_link(init_db):
+    post_consecutive_alkanes(1, 3)
+    response = client.get(
+        "/molecules/?pageSize=5", headers={"cache-control": "no-cache"}
+    )
+    assert response.status_code == 200
+    assert "next_page" not in response.json()["links"]
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "eyJvIjogIm1hc3MifQ"])
+def test_invalid_cursor(cursor, init_db):
+    response = client.get(
+        f"/molecules/?cursor={cursor}", headers={"cache-control": "no-cache"}
+    )
+    assert response.status_code == 400
+
+
+def test_cursor_of_other_ordering_is_rejected(init_db):
+    post_consecutive_alkanes(1, 4)
+    response = client.get(
+        "/molecules/?pageSize=2&orderBy=mass", headers={"cache-control": "no-cache"}
+    )
+    cursor = parse_qs(urlparse(response.json()["links"]["next_page"]["href"]).query)[
+        "cursor"
+    ][0]
+
+    response = client.get(
+        f"/molecules/?pageSize=2&cursor={cursor}",
+        headers={"cache-control": "no-cache"},
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "min_mass, max_mass, expected_length", [(None, None, 10), (20, 50, 2)]
+)
+def test_export_csv(min_mass, max_mass, expected_length, init_db):
+    post_consecutive_alkanes(1, 10)
+    url = "/molecules/export?format=csv"
+    if min_mass is not None:
+        url += f"&minMass={min_mass}&maxMass={max_mass}"
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == expected_length
+    for row in rows:
+        assert row["smiles"] == "C" * int(row["name"].split()[-1])
+        if min_mass is not None:
+            assert min_mass <= float(row["mass"]) <= max_mass
+
+
+def test_export_ndjson_ordered_by_mass(init_db):
+    post_consecutive_alkanes(1, 10)
+    response = client.get("/molecules/export?format=ndjson&orderBy=mass&order=desc")
+    assert response.status_code == 200
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 10
+    assert [row["smiles"] for row in rows] == ["C" * i for i in range(10, 0, -1)]
+    assert "links" not in rows[0]
+
+
+def test_export_parquet(init_db):
+    pq = pytest.importorskip("pyarrow.parquet")
+    post_consecutive_alkanes(1, 10)
+    response = client.get("/molecules/export?format=parquet")
+    assert response.status_code == 200
+
+    table = pq.read_table(io.BytesIO(response.content))
+    assert table.num_rows == 10
+    assert sorted(table.column("smiles").to_pylist()) == sorted(
+        "C" * i for i in range(1, 11)
+    )
+
+
+def test_export_empty(init_db):
+    response = client.get("/molecules/export?format=csv")
+    assert response.status_code == 200
+    assert response.text.strip() == "molecule_id,smiles,name,mass,created_at,updated_at"
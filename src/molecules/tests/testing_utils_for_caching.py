@@ -1,11 +1,40 @@
 from unittest import mock
 
+import redis.asyncio
 
-def assert_set_json_called_with_url(client, redis, url, should_be_called, headers=None):
+from src.caching_service import AsyncRedisCacheService
+from src.config import get_test_settings
+
+
+class NullConnectionPool(redis.asyncio.ConnectionPool):
+    """
+    Connections are closed when they are released, like NullPool of the async engine in the tests.
+    Every request of the TestClient runs in its own event loop, pooled connections would outlive their loop.
+    """
+
+    async def release(self, connection):
+        await super().release(connection)
+        await connection.disconnect()
+
+
+def get_test_async_redis_client() -> redis.asyncio.Redis:
+    """
+    async_redis_client_factory of the RedisCacheServiceSingleton in the tests
+    """
+    settings = get_test_settings()
+    return redis.asyncio.Redis(
+        connection_pool=NullConnectionPool(
+            host=settings.REDIS_HOST, port=settings.REDIS_PORT
+        )
+    )
+
+
+def assert_cache_set_called_with_url(client, url, should_be_called, headers=None):
     """
     This is helpful method fot **UNIT** testing the caching mechanism.
 
-    Checks if the set_json method of the RedisCacheService is being called after the get request.
+    Checks if the set_tagged_bytes method of the AsyncRedisCacheService is being called after the get request,
+    responses are cached as raw bytes by the caching middleware, through the asyncio redis client.
 
     Does not check if the method is being called with the correct parameters, just checks if it is being called.
     that is very hard and requires a lot of mocking of implementation details. Instead, correctness will be easily
@@ -13,13 +42,12 @@ def assert_set_json_called_with_url(client, redis, url, should_be_called, header
 
     :param headers:
     :param client: TestClient instance
-    :param redis: Instance of the RedisCacheService
     :param url: URL to be tested
-    :param should_be_called: is a boolean that indicates if the set_json method should be called or not.
+    :param should_be_called: is a boolean that indicates if the set_tagged_bytes method should be called or not.
     logic is simple, if the URL is not in the cache, it should be called, otherwise it should not be called.
     """
 
-    with mock.patch.object(redis, "set_json") as mock_set:
+    with mock.patch.object(AsyncRedisCacheService, "set_tagged_bytes") as mock_set:
         if not headers:
             response = client.get(url)
         else:
@@ -37,9 +65,9 @@ def assert_key_exists_in_cache(redis_cache_service, key, should_exist):
     """
 
     if should_exist:
-        assert redis_cache_service.get_json(key) is not None
+        assert redis_cache_service.get_bytes(key) is not None
     else:
-        assert redis_cache_service.get_json(key) is None
+        assert redis_cache_service.get_bytes(key) is None
 
 
 def get_key_from_url_queries(url: str, query_params: dict):
@@ -1,10 +1,16 @@
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 from functools import lru_cache
+from typing import Optional
 
 from rdkit import Chem
 
+from src.metrics import CHEM_SERVICE_LOOKUPS, CHEM_SERVICE_SIZE
 from src.molecules.exception import InvalidSmilesException
 
+# labels() looks the child up on every call, the children are bound once
+CHEM_SERVICE_HITS = CHEM_SERVICE_LOOKUPS.labels("hit")
+CHEM_SERVICE_MISSES = CHEM_SERVICE_LOOKUPS.labels("miss")
+
 
 def is_valid_smiles(smiles: str) -> bool:
     """
@@ -24,10 +30,11 @@ def get_chem_molecule_from_smiles_or_raise_exception(smiles: str):
 
     :param smiles: SMILES string
     :return: RDKit molecule object
-    :raises InvalidSmilesException: if the SMILES string
+    :raises InvalidSmilesException: if the SMILES string is empty or does not represent a valid molecule
     """
 
-    mol = Chem.MolFromSmiles(smiles)
+    # RDKit parses an empty string into an empty molecule, it is not valid for us
+    mol = Chem.MolFromSmiles(smiles) if smiles else None
     if mol is None:
         raise InvalidSmilesException(smiles)
     return mol
@@ -40,16 +47,37 @@ class ChemService:
         self._cache_size = cache_size
         self._cache = OrderedDict()
 
-    def get_chem(self, smiles: str):
+    def get_chem(self, smiles: str, lookups: Optional[Counter] = None):
+        """
+        :param lookups: counts the hits and misses instead of the metrics, scans of many rows record them
+            once, see record_lookups
+        """
         if smiles in self._cache:
+            if lookups is None:
+                CHEM_SERVICE_HITS.inc()
+            else:
+                lookups["hit"] += 1
             return self._cache[smiles]
 
         mol = get_chem_molecule_from_smiles_or_raise_exception(smiles)
         if len(self._cache) >= self._cache_size:
             self._cache.popitem(last=False)
         self._cache[smiles] = mol
+        if lookups is None:
+            CHEM_SERVICE_MISSES.inc()
+            CHEM_SERVICE_SIZE.set(len(self._cache))
+        else:
+            lookups["miss"] += 1
         return mol
 
+    def record_lookups(self, lookups: Counter) -> None:
+        """
+        Add the hits and misses counted by get_chem to the metrics
+        """
+        CHEM_SERVICE_HITS.inc(lookups["hit"])
+        CHEM_SERVICE_MISSES.inc(lookups["miss"])
+        CHEM_SERVICE_SIZE.set(len(self._cache))
+
 
 @lru_cache
 def get_chem_service():
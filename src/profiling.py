@@ -0,0 +1,207 @@
+"""
+Profiling of single requests and celery tasks on demand.
+
+Request with the X-Profile header, or the profile query parameter, runs under StackSampler. Profiling is allowed
+in DEV and TEST environments, in PROD only with one of PROFILING_TOKENS of the settings in the X-Profile-Token
+header, otherwise the flag is ignored.
+
+The profile is stored in redis for PROFILE_EXPIRATION_SECONDS under the request id, the id is taken from the
+X-Request-Id header of the request, or generated, and sent back in the X-Request-Id header of the response.
+GET /profiles/{request_id} returns it in the collapsed stacks format, one stack per line followed by the number
+of samples, flamegraph.pl, speedscope and inferno read it as it is.
+
+Profiled requests skip the cached responses, the profile shows the computation, not a redis lookup.
+The substructure search of a profiled request is profiled in the celery task too, under the task id,
+see substructure_search_task.
+"""
+
+import hmac
+import logging
+import os
+import sys
+import threading
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from os import getenv
+from typing import Iterator, Optional
+from urllib.parse import parse_qsl
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.caching_service import RedisCacheServiceSingleton
+from src.config import Environment, get_settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_EXPIRATION_SECONDS = 60 * 60 * 24
+SAMPLING_INTERVAL_SECONDS = 0.001
+# innermost frames of threads waiting for work, threading.Condition.wait and the loop of the
+# concurrent.futures workers, which waits in the C code of SimpleQueue.get
+IDLE_FRAMES = {("threading.py", "wait"), ("thread.py", "_worker")}
+
+
+def get_profile_key(profile_id: str) -> str:
+    return f"profile:{profile_id}"
+
+
+def is_profiling_allowed(token: Optional[str]) -> bool:
+    if getenv("ENVIRONMENT") in (Environment.DEV.value, Environment.TEST.value):
+        return True
+    return token is not None and any(
+        hmac.compare_digest(token, allowed)
+        for allowed in get_settings().PROFILING_TOKENS
+    )
+
+
+class StackSampler:
+    """
+    Takes the stacks of the running threads every interval from a background thread, wall clock time,
+    waiting for the database or redis shows up as much as computing.
+
+    Stacks start with the name of the thread. Sync endpoints run in the threadpool, so every thread is sampled,
+    except the idle ones waiting for work, requests running at the same time show up in the profile too.
+    """
+
+    def __init__(
+        self,
+        interval: float = SAMPLING_INTERVAL_SECONDS,
+        thread_ids: Optional[set[int]] = None,
+    ):
+        """
+        :param interval: seconds between the samples
+        :param thread_ids: sample only these threads, all of them if None
+        """
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.samples: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> str:
+        """
+        :return: the collapsed stacks
+        """
+        self._stopped.set()
+        self._thread.join()
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (
+                    self.thread_ids is not None and thread_id not in self.thread_ids
+                ):
+                    continue
+                stack = _collapse(frame)
+                if stack is None:
+                    continue
+                self.samples[f"{names.get(thread_id, thread_id)};{stack}"] += 1
+
+
+def _collapse(frame) -> Optional[str]:
+    """
+    :return: frames from the outermost one, separated by ";", None for threads waiting for work
+    """
+    code = frame.f_code
+    if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+        return None
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+@contextmanager
+def profiled(profile_id: Optional[str], **sampler_options) -> Iterator[None]:
+    """
+    Profile the block and store the profile under profile_id, does nothing if profile_id is None
+    """
+    if profile_id is None:
+        yield
+        return
+
+    sampler = StackSampler(**sampler_options)
+    sampler.start()
+    try:
+        yield
+    finally:
+        RedisCacheServiceSingleton.get_instance().set_object(
+            get_profile_key(profile_id), sampler.stop(), PROFILE_EXPIRATION_SECONDS
+        )
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the requests asking for it, see the module docstring. The request id is in
+    scope["state"]["profile_id"] of the profiled requests, the endpoints pass it on to the celery tasks.
+
+    The profile is stored before the end of the body is sent, it is there when the client gets the response.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        query = dict(parse_qsl(scope["query_string"].decode("latin-1")))
+        if "x-profile" not in headers and "profile" not in query:
+            await self.app(scope, receive, send)
+            return
+
+        if not is_profiling_allowed(headers.get("x-profile-token")):
+            logger.warning(f"Profiling of {scope['path']} is not allowed, ignoring")
+            await self.app(scope, receive, send)
+            return
+
+        request_id = headers.get("x-request-id") or uuid.uuid4().hex
+        scope.setdefault("state", {})["profile_id"] = request_id
+        mutable_headers = MutableHeaders(scope=scope)
+        mutable_headers["cache-control"] = "no-cache"
+        redis = RedisCacheServiceSingleton.get_instance().aio
+
+        sampler = StackSampler()
+        sampler.start()
+        stored = False
+
+        async def store_profile() -> None:
+            nonlocal stored
+            if not stored:
+                stored = True
+                await redis.set_object(
+                    get_profile_key(request_id),
+                    sampler.stop(),
+                    PROFILE_EXPIRATION_SECONDS,
+                )
+                logger.info(f"Profile of {scope['path']} stored under {request_id}")
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Request-Id"] = request_id
+            elif message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                await store_profile()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            await store_profile()
@@ -1,4 +1,7 @@
+import asyncio
+
 import redis
+import redis.asyncio
 from src.config import get_settings
 
 redis_client = redis.Redis(
@@ -9,6 +12,9 @@ redis_celery_client = redis.Redis(
     host=get_settings().REDIS_HOST, port=get_settings().REDIS_PORT, db=1
 )
 
+# event loop -> asyncio client, see get_async_redis_client
+_async_redis_clients: dict[asyncio.AbstractEventLoop, redis.asyncio.Redis] = {}
+
 
 def get_redis_client_celery():
     return redis_celery_client
@@ -16,3 +22,50 @@ def get_redis_client_celery():
 
 def get_redis_client():
     return redis_client
+
+
+def get_async_redis_client() -> redis.asyncio.Redis:
+    """
+    Asyncio client of the cache layer, used from the event loop, so waiting for redis does not block it.
+
+    Connections belong to the event loop they were opened in, so every loop gets its own client and pool.
+    A web process runs one loop, so that is one pool per process, the TestClient runs every request in a new loop.
+    Clients of closed loops are dropped when a new one is created, the connections keep their loop alive,
+    so they can not be weak references, their sockets are closed when they are garbage collected.
+
+    The pool is blocking, when all REDIS_POOL_MAX_CONNECTIONS are busy, requests wait for a free connection
+    up to REDIS_POOL_TIMEOUT seconds, instead of opening more connections.
+
+    :raises RuntimeError: if called outside of a running event loop
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_redis_clients.get(loop)
+    if client is None:
+        for closed_loop in [
+            other for other in _async_redis_clients if other.is_closed()
+        ]:
+            del _async_redis_clients[closed_loop]
+
+        settings = get_settings()
+        pool = redis.asyncio.BlockingConnectionPool(
+            host=settings.REDIS_HOST,
+            port=settings.REDIS_PORT,
+            db=0,
+            max_connections=settings.REDIS_POOL_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        )
+        client = redis.asyncio.Redis(connection_pool=pool)
+        _async_redis_clients[loop] = client
+    return client
+
+
+async def close_async_redis_client() -> None:
+    """
+    Close the pool of the running event loop, called when the app shuts down
+    """
+    client = _async_redis_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+        # the client does not close a pool it was given
+        await client.connection_pool.disconnect()
@@ -1,10 +1,42 @@
+import json
 from typing import Type
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import Session
+from sqlalchemy.sql.expression import ClauseElement, Executable
 
 from src.database import Base
 
 
+class Explain(Executable, ClauseElement):
+    """
+    EXPLAIN (FORMAT JSON) of a statement, the statement keeps its bound parameters.
+
+    Used for cheap row estimates from the planner statistics, see planned_rows.
+    """
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kwargs):
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.statement, **kwargs)
+
+
+def planned_rows(explain_output) -> int:
+    """
+    :param explain_output: the single value returned by Explain, psycopg2 parses the json, asyncpg does not
+    :return: number of rows the planner expects the top plan node to return
+    """
+    if isinstance(explain_output, str):
+        explain_output = json.loads(explain_output)
+    return int(explain_output[0]["Plan"]["Plan Rows"])
+
+
 class SQLAlchemyRepository:
     """
     Base class for all repositories that use SQLAlchemy.
@@ -73,3 +105,63 @@ class SQLAlchemyRepository:
             return True
         except Exception:
             return False
+
+
+class AsyncSQLAlchemyRepository:
+    """
+    Async variant of SQLAlchemyRepository, same methods, but they take an AsyncSession and have to be awaited.
+
+    Relationships are not lazy loaded in async sessions, so subclasses have to load everything
+    they need eagerly.
+    """
+
+    def __init__(self, model_type: Type[Base]):
+        self._model_type = model_type
+
+    async def find_by_id(self, obj_id, session: AsyncSession):
+        return await session.get(self._model_type, obj_id)
+
+    async def find_all(self, session: AsyncSession, page=0, page_size=1000):
+        """
+        Find all instances of the model with pagination support
+
+        :param page: Zero indexed page number
+        :param page_size: Items per page
+        :return: List of instances
+        """
+
+        stmt = select(self._model_type).limit(page_size).offset(page * page_size)
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    async def filter(self, session: AsyncSession, **kwargs):
+        stmt = select(self._model_type).filter_by(**kwargs)
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    async def save(self, session: AsyncSession, data: dict):
+        instance = self._model_type(**data)
+        session.add(instance)
+        return instance
+
+    async def update(self, session: AsyncSession, obj_id, data: dict):
+        instance = await session.get(self._model_type, obj_id)
+        for key, value in data.items():
+            setattr(instance, key, value)
+        await session.flush()
+        await session.refresh(instance)
+        return instance
+
+    async def delete(self, session: AsyncSession, obj_id) -> bool:
+        """
+        Delete an instance, same contract as SQLAlchemyRepository.delete
+
+        :return:  True if the instance is deleted, False otherwise
+        """
+
+        try:
+            instance = await session.get(self._model_type, obj_id)
+            await session.delete(instance)
+            return True
+        except Exception:
+            return False
@@ -1,8 +1,17 @@
+import threading
+from typing import Optional, Sequence
+
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+
 from src.celery import celery_app
 from src.config import get_settings
 from src.database import get_session_factory, get_database_engine
+from src.metrics import mark_process_dead, start_metrics_server
 from src.molecules.repository import get_molecule_repository
+from src.molecules.schema import MOLECULE_FIELDS, FieldSelection
 from src.molecules.service import get_molecule_service
+from src.profiling import profiled
+from src.timing import collect_timings, format_server_timing
 
 molecule_service = get_molecule_service(
     repository=get_molecule_repository(),
@@ -12,6 +21,56 @@ molecule_service = get_molecule_service(
 )
 
 
+@worker_process_init.connect
+def reset_database_pool(**kwargs):
+    """
+    Prefork children inherit the engine of the parent process together with its pooled connections,
+    a connection must never be shared between processes. close=False drops the inherited connections
+    without closing them, they still belong to the parent, every child opens its own.
+    """
+    get_database_engine(get_settings().database_url).dispose(close=False)
+
+
+@worker_init.connect
+def serve_metrics(**kwargs):
+    """
+    The searches run in the pool processes, the main process of the worker serves the metrics of all of them
+    """
+    start_metrics_server(get_settings().METRICS_PORT)
+
+
+@worker_process_shutdown.connect
+def remove_process_metrics(pid, **kwargs):
+    mark_process_dead(pid)
+
+
+@celery_app.task
+def substructure_search_task(
+    smiles: str,
+    limit: int,
+    fields: Sequence[str] = MOLECULE_FIELDS,
+    links: bool = True,
+    profile_id: Optional[str] = None,
+):
+    """
+    fields and links of the FieldSelection of the request, task arguments have to be JSON serializable
+
+    Time of the task by phase is in the server_timing of the result, in the format of the Server-Timing header
+    of the requests, see src.timing
+
+    :param profile_id: profile the search and store the profile under this id, see src.profiling
+    """
+    selection = FieldSelection(fields=fields, links=links)
+    with profiled(profile_id, thread_ids={threading.get_ident()}):
+        with collect_timings() as timings:
+            result = molecule_service.get_substructures(smiles, limit, selection)
+    result["server_timing"] = format_server_timing(timings)
+    return result
+
+
 @celery_app.task
-def substructure_search_task(smiles: str, limit: int):
-    return molecule_service.get_substructures(smiles, limit).model_dump()
+def backfill_descriptors_task(chunk_size: int = 1000):
+    """
+    Fill the descriptor columns of the molecules saved before they existed, run once after the migration
+    """
+    return molecule_service.backfill_descriptors(chunk_size)
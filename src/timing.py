@@ -0,0 +1,95 @@
+"""
+Latency breakdown of a request, or of a celery task, by phase.
+
+collect_timings starts collecting for the current context, code on the hot paths reports the time it spends
+with timed or add_time, and the result is sent in the Server-Timing response header and written
+to the access log, see log_request_time_middleware. Phases are:
+
+- cache: redis lookups and writes of CachingMiddleware
+- db: SQL statements, measured around the cursor execution, see src.database
+- chem: RDKit parsing and substructure matching
+- serialize: encoding of the response body
+
+Time not spent in any of them is app, everything else the request did, "total" is the whole request.
+Outside collect_timings reporting does nothing, so the same code runs in scripts and tests.
+
+Timings are kept in a context variable, the threadpool of the sync endpoints and the tasks of the async ones
+copy the context, they report to the same dict as the request.
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from fastapi.responses import ORJSONResponse
+
+PHASES = ("cache", "db", "chem", "serialize")
+
+_timings: ContextVar[Optional[dict[str, float]]] = ContextVar("timings", default=None)
+
+
+@contextmanager
+def collect_timings() -> Iterator[dict[str, float]]:
+    """
+    Collect timings of the phases reported inside the block
+
+    :return: phase -> seconds, "total" and "app" are added when the block exits
+    """
+    timings = {}
+    token = _timings.set(timings)
+    started = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+        timings["total"] = time.perf_counter() - started
+        timings["app"] = max(
+            timings["total"] - sum(timings.get(phase, 0) for phase in PHASES), 0
+        )
+
+
+def add_time(phase: str, seconds: float) -> None:
+    timings = _timings.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0) + seconds
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(phase, time.perf_counter() - started)
+
+
+def timings_in_milliseconds(timings: dict[str, float]) -> dict[str, float]:
+    """
+    Collected phases in milliseconds, in the order of PHASES, then app and total
+    """
+    return {
+        phase: round(timings[phase] * 1000, 2)
+        for phase in (*PHASES, "app", "total")
+        if phase in timings
+    }
+
+
+def format_server_timing(timings: dict[str, float]) -> str:
+    """
+    :return: value of the Server-Timing header, for example "db;dur=3.1, app;dur=0.4, total;dur=3.5"
+    """
+    return ", ".join(
+        f"{phase};dur={duration}"
+        for phase, duration in timings_in_milliseconds(timings).items()
+    )
+
+
+class TimedORJSONResponse(ORJSONResponse):
+    """
+    ORJSONResponse reporting the encoding of the body as the serialize phase
+    """
+
+    def render(self, content) -> bytes:
+        with timed("serialize"):
+            return super().render(content)